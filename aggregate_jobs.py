@@ -0,0 +1,150 @@
+import asyncio
+import contextlib
+import datetime
+import os
+import uuid
+
+import async_database as adb
+
+# 집계 작업 설정 (환경 변수로 조정 가능)
+AGGREGATE_JOB_LEASE = float(os.getenv("AGGREGATE_JOB_LEASE", "120"))  # 초, 실행 중인 프로세스가 멈추면 이 시간 뒤에 다른 실행이 작업을 이어받음
+AGGREGATE_JOB_MAX_ATTEMPTS = int(os.getenv("AGGREGATE_JOB_MAX_ATTEMPTS", "3"))  # 작업을 이어서 실행하는 최대 횟수 (처음 실행 포함)
+
+# 집계 단계 (완료한 단계는 steps_done에 남기고 재개 시 건너뜀)
+#   rank: 순위와 역할 변경 대상 확정, color: 1등 역할 색상 복원, roles: 역할 변경, streaks: 연속 기록 갱신,
+#   reset: 채팅 카운트 초기화와 집계 날짜 저장, history: 집계 기록 저장
+AGGREGATE_JOB_STEPS = ("rank", "color", "roles", "streaks", "reset", "history")
+
+
+class AggregateJobLeaseLost(Exception):
+    """작업 임대를 다른 실행에 빼앗겼을 때 (이후 단계는 그 실행이 진행)"""
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class AggregateJobStore:
+    """집계 작업을 aggregate_jobs 컬렉션에 단계별로 기록하고 서버별 임대를 관리합니다
+
+    진행 중인 작업은 서버마다 하나만 저장되므로 같은 서버의 집계가 동시에 실행되지 않고,
+    실행 중인 프로세스는 임대를 주기적으로 연장합니다. 프로세스가 멈춰 임대가 끝난 작업은
+    다른 실행(재시작한 봇)이 가져가 완료하지 않은 단계부터 이어서 실행합니다
+    """
+
+    def __init__(self, owner_id=None, lease=AGGREGATE_JOB_LEASE, max_attempts=AGGREGATE_JOB_MAX_ATTEMPTS):
+        self.owner_id = owner_id or uuid.uuid4().hex[:12]
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._held = set()  # 이 프로세스가 실행 중인 작업 ID
+
+        # 통계
+        self.created = 0
+        self.busy = 0
+        self.resumed = 0
+        self.completed = 0
+        self.failed = 0
+        self.lease_lost = 0
+
+    def stats(self):
+        return {
+            "owner": self.owner_id,
+            "running": len(self._held),
+            "created": self.created,
+            "busy": self.busy,
+            "resumed": self.resumed,
+            "completed": self.completed,
+            "failed": self.failed,
+            "lease_lost": self.lease_lost,
+        }
+
+    def _lease_until(self):
+        return _now() + datetime.timedelta(seconds=self.lease)
+
+    async def create(self, guild_id, fields):
+        """새 집계 작업을 만들고 임대를 가져옵니다. 같은 서버에 진행 중인 작업이 있으면 None"""
+        now = _now()
+        job = await adb.create_aggregate_job(dict(
+            fields,
+            guild_id=guild_id,
+            status="running",
+            steps_done=[],
+            attempts=1,
+            lease_owner=self.owner_id,
+            lease_until=self._lease_until(),
+            created_at=now,
+            updated_at=now,
+        ))
+        if job is None:
+            self.busy += 1
+            return None
+        self.created += 1
+        self._held.add(job["_id"])
+        return job
+
+    async def resumable(self):
+        """임대가 끝난 진행 중인 작업 목록을 반환합니다 (이 프로세스가 실행 중인 작업 제외)"""
+        return [job for job in await adb.get_resumable_aggregate_jobs(_now()) if job["_id"] not in self._held]
+
+    async def claim(self, job):
+        """임대가 끝난 작업을 가져옵니다. 가져온 작업 문서 또는 None (시도 횟수를 넘었으면 실패로 끝냄)"""
+        job = await adb.claim_aggregate_job(job["_id"], self.owner_id, self._lease_until(), _now())
+        if job is None:
+            return None
+        self._held.add(job["_id"])
+        if job["attempts"] > self.max_attempts:
+            await self.finish(job, "failed", f"{self.max_attempts}번 시도했지만 끝내지 못함")
+            return None
+        self.resumed += 1
+        return job
+
+    async def checkpoint(self, job, step, fields=None):
+        """단계 완료를 기록합니다 (fields도 함께 저장). 임대를 잃었으면 AggregateJobLeaseLost"""
+        update = {"$addToSet": {"steps_done": step}}
+        if fields:
+            update["$set"] = dict(fields)
+        if not await adb.update_aggregate_job(job["_id"], self.owner_id, update):
+            self.lease_lost += 1
+            raise AggregateJobLeaseLost(job["_id"])
+        job.update(fields or {})
+        if step not in job["steps_done"]:
+            job["steps_done"].append(step)
+
+    async def release(self, job):
+        """작업을 끝내지 않고 임대만 풉니다 (일시적인 오류, 다음 확인 때 다시 시도)"""
+        self._held.discard(job["_id"])
+        try:
+            await adb.update_aggregate_job(job["_id"], self.owner_id, {"$set": {"lease_until": _now()}})
+        except Exception as e:
+            print(f"⚠️ [집계 작업] {job['_id']} 임대 해제 실패: {e}")
+
+    async def finish(self, job, status, error=None):
+        """작업을 끝내고 서버 임대를 풉니다 (status: done 또는 실패 사유)"""
+        self._held.discard(job["_id"])
+        if status == "done":
+            self.completed += 1
+        else:
+            self.failed += 1
+        try:
+            await adb.finish_aggregate_job(job["_id"], self.owner_id, status, error)
+        except Exception as e:
+            print(f"⚠️ [집계 작업] {job['_id']} 종료 기록 실패: {e}")
+
+    async def _renew(self, job):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                if not await adb.update_aggregate_job(job["_id"], self.owner_id, {"$set": {"lease_until": self._lease_until()}}):
+                    print(f"⚠️ [집계 작업] {job['_id']} 임대를 잃음")
+                    return
+            except Exception as e:
+                print(f"⚠️ [집계 작업] {job['_id']} 임대 연장 실패: {e}")
+
+    @contextlib.asynccontextmanager
+    async def hold(self, job):
+        """블록을 실행하는 동안 작업 임대를 주기적으로 연장합니다"""
+        renewer = asyncio.ensure_future(self._renew(job))
+        try:
+            yield job
+        finally:
+            renewer.cancel()
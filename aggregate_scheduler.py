@@ -0,0 +1,258 @@
+import asyncio
+import datetime
+import os
+import random
+import time
+
+import disnake
+import pytz
+from disnake.ext import tasks
+
+import async_database as adb
+
+# 예약 집계 설정 (환경 변수로 조정 가능)
+AGGREGATE_SCHEDULE_POLL_INTERVAL = float(os.getenv("AGGREGATE_SCHEDULE_POLL_INTERVAL", "60"))  # 초, 실행할 예약을 확인하는 간격
+AGGREGATE_SCHEDULE_JITTER = float(os.getenv("AGGREGATE_SCHEDULE_JITTER", "600"))  # 초, 같은 시각의 예약이 몰리지 않도록 더하는 최대 지연
+AGGREGATE_SCHEDULE_CONCURRENCY = int(os.getenv("AGGREGATE_SCHEDULE_CONCURRENCY", "2"))  # 동시에 집계하는 서버 수
+AGGREGATE_SCHEDULE_GRACE = float(os.getenv("AGGREGATE_SCHEDULE_GRACE", "21600"))  # 초, 봇이 꺼져 있어 이보다 늦어진 예약은 건너뜀
+
+KST = pytz.timezone('Asia/Seoul')
+WEEKDAY_NAMES = ["월", "화", "수", "목", "금", "토", "일"]
+
+
+def _as_utc(value):
+    """DB에서 읽은 시각(UTC, tzinfo 없음)을 UTC 시각으로 맞춥니다"""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=pytz.UTC)
+    return value.astimezone(pytz.UTC)
+
+
+def next_schedule_run(weekday, hour, minute, after):
+    """after 이후 처음 오는 weekday요일(0=월) hour:minute(KST)를 UTC 시각으로 반환합니다"""
+    local = _as_utc(after).astimezone(KST)
+    day = local.date() + datetime.timedelta(days=(weekday - local.weekday()) % 7)
+    run_at = KST.localize(datetime.datetime.combine(day, datetime.time(hour, minute)))
+    if run_at <= local:
+        run_at = KST.localize(datetime.datetime.combine(day + datetime.timedelta(days=7), datetime.time(hour, minute)))
+    return run_at.astimezone(pytz.UTC)
+
+
+def schedule_period(run_at, period_days):
+    """예약 실행 시각의 집계 기간을 (시작, 끝) UTC 시각으로 반환합니다
+
+    실행일(KST) 전날까지의 period_days일 (예: 월요일 실행, 7일이면 지난주 월요일 00:00 ~ 일요일 23:59:59)
+    """
+    day = _as_utc(run_at).astimezone(KST).date()
+    start = KST.localize(datetime.datetime.combine(day - datetime.timedelta(days=period_days), datetime.time(0, 0, 0)))
+    end = KST.localize(datetime.datetime.combine(day - datetime.timedelta(days=1), datetime.time(23, 59, 59)))
+    return start.astimezone(pytz.UTC), end.astimezone(pytz.UTC)
+
+
+def describe_schedule(schedule):
+    """예약 설정을 "매주 월요일 00:05 (KST), 최근 7일" 형태로 반환합니다"""
+    return (f"매주 {WEEKDAY_NAMES[schedule['weekday']]}요일 {schedule['hour']:02d}:{schedule['minute']:02d} (KST), "
+            f"최근 {schedule['period_days']}일")
+
+
+class AggregateScheduler:
+    """서버 설정에 저장된 예약 집계를 주기적으로 확인해 실행합니다
+
+    실행 시각이 지난 예약은 next_run_at을 조건부로 옮겨서 가져가므로 한 번만 실행되고,
+    같은 시각에 몰린 서버는 지터만큼 흩어서 시작하며 동시에 집계하는 서버 수를 제한합니다
+    임대가 끝난(실행하던 봇이 멈춘) 집계 작업도 같은 루프에서 가져와 이어서 실행합니다 (시작 직후 첫 확인 포함)
+    """
+
+    def __init__(self, bot, jobs, poll_interval=AGGREGATE_SCHEDULE_POLL_INTERVAL, jitter=AGGREGATE_SCHEDULE_JITTER,
+                 concurrency=AGGREGATE_SCHEDULE_CONCURRENCY, grace=AGGREGATE_SCHEDULE_GRACE):
+        self.bot = bot
+        self.jobs = jobs  # 집계 작업 기록 (aggregate_jobs.AggregateJobStore)
+        self.jitter = jitter
+        self.grace = grace
+        self.run_job = None  # 집계를 실행하는 코루틴 함수 (commands/aggregate.py의 run_period_aggregation)
+        self.resume_job = None  # 집계 작업을 이어서 실행하는 코루틴 함수 (commands/aggregate.py의 run_aggregate_job)
+        self.ensure_state = None  # 서버 상태를 메모리에 불러오는 코루틴 함수 (bot.py의 ensure_guild_state)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._running = {}  # {guild_id: 실행 중인 예약 집계 태스크}
+        self._loop = tasks.loop(seconds=poll_interval)(self._tick)
+
+        # 통계
+        self.runs = 0
+        self.failed = 0
+        self.missed = 0
+        self.resumed = 0
+        self.last_run_ms = 0
+
+    def stats(self):
+        return {
+            "running": len(self._running),
+            "runs": self.runs,
+            "failed": self.failed,
+            "missed": self.missed,
+            "resumed": self.resumed,
+            "last_run_ms": self.last_run_ms,
+        }
+
+    def start(self):
+        """예약 확인 루프를 시작합니다 (on_ready가 여러 번 호출되어도 한 번만 실행)"""
+        if not self._loop.is_running():
+            self._loop.start()
+            print(f"[예약 집계] 확인 루프 시작: {self._loop.seconds:.0f}초 간격, 지터 최대 {self.jitter:.0f}초")
+
+    async def close(self):
+        """루프를 멈추고 실행 중인 예약 집계를 취소합니다 (봇 종료 시 호출)"""
+        self._loop.cancel()
+        tasks_to_cancel = list(self._running.values())
+        for task in tasks_to_cancel:
+            task.cancel()
+        if tasks_to_cancel:
+            await asyncio.gather(*tasks_to_cancel, return_exceptions=True)
+
+    async def _tick(self):
+        try:
+            await self.check_resumable()
+        except Exception as e:
+            print(f"⚠️ [예약 집계] 집계 작업 재개 확인 중 오류: {e}")
+        try:
+            await self.check_due()
+        except Exception as e:
+            print(f"⚠️ [예약 집계] 예약 확인 중 오류: {e}")
+
+    def _track(self, guild_id, coro):
+        self._running[guild_id] = asyncio.ensure_future(coro)
+        self._running[guild_id].add_done_callback(lambda _, guild_id=guild_id: self._running.pop(guild_id, None))
+
+    async def check_resumable(self):
+        """임대가 끝난 집계 작업을 가져와 이어서 실행합니다. 재개한 작업 수 반환"""
+        if self.resume_job is None:
+            return 0
+        resumed = 0
+        for job in await self.jobs.resumable():
+            guild = self.bot.get_guild(job["guild_id"])
+            if guild is None or guild.id in self._running:
+                continue
+            job = await self.jobs.claim(job)
+            if job is None:
+                continue
+            print(f"[예약 집계] 서버 {guild.id}의 중단된 집계 작업 {job['_id']} 재개 (시도 {job['attempts']}번째, "
+                  f"완료 단계: {job['steps_done']})")
+            self._track(guild.id, self._resume(guild, job))
+            resumed += 1
+        return resumed
+
+    async def _ensure_state(self, guild_id):
+        """집계 전에 서버 상태(역할 설정 등)를 불러옵니다 (오래 조용해 캐시에서 내려갔거나 워밍업 전인 서버)"""
+        if self.ensure_state is None:
+            return
+        try:
+            await self.ensure_state(guild_id)
+        except Exception as e:
+            print(f"⚠️ [예약 집계] 서버 {guild_id} 상태 로드 실패: {e}")
+
+    async def _resume(self, guild, job):
+        async with self._semaphore:
+            await self._ensure_state(guild.id)
+            result = await self.resume_job(guild, job)
+        self.resumed += 1
+        if job["trigger"] == "schedule" and result["status"] != "ok" and not result.get("resumable"):
+            # 이어서 실행한 예약 집계가 실패로 끝났으면 기록 (성공은 resume_job이 기록)
+            self.failed += 1
+            await self._save_failure(guild.id, job["history_fields"].get("scheduled_for"), None, result["status"],
+                                     result.get("message"), result.get("timings") or {}, job["start_date"], job["end_date"])
+        await self._notify(guild, job.get("channel_id"), result, "🔁 중단되었던 집계를 이어서 끝낸 것이다!")
+
+    async def check_due(self):
+        """실행 시각이 지난 예약을 가져가서 실행을 시작합니다. 시작한 서버 수 반환"""
+        now = datetime.datetime.now(pytz.UTC)
+        started = 0
+        for guild_id, schedule in await adb.get_due_aggregate_schedules(now):
+            if guild_id in self._running or self.run_job is None:
+                continue
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                continue
+
+            run_at = schedule["next_run_at"]
+            next_run_at = next_schedule_run(schedule["weekday"], schedule["hour"], schedule["minute"], now)
+            if not await adb.claim_aggregate_schedule(guild_id, run_at, next_run_at):
+                continue
+
+            run_at = _as_utc(run_at)
+            if self.grace and (now - run_at).total_seconds() > self.grace:
+                # 봇이 오래 꺼져 있었으면 지난 예약은 실행하지 않고 기록만 남김
+                self.missed += 1
+                print(f"⚠️ [예약 집계] 서버 {guild_id}: {run_at} 예약이 너무 늦어 건너뜀")
+                await self._save_failure(guild_id, run_at, schedule, "missed", "예약 시각이 너무 지남", {})
+                continue
+
+            self._track(guild_id, self._run(guild, schedule, run_at))
+            started += 1
+        return started
+
+    async def _run(self, guild, schedule, run_at):
+        """지터만큼 기다린 뒤 동시 실행 수 제한 안에서 예약 집계를 실행하고 결과를 채널에 알립니다"""
+        timings = {}
+        delay = random.uniform(0, self.jitter) if self.jitter else 0
+        await asyncio.sleep(delay)
+        timings["jitter"] = round(delay * 1000)
+
+        queued = time.perf_counter()
+        async with self._semaphore:
+            timings["queue"] = round((time.perf_counter() - queued) * 1000)
+            started = time.perf_counter()
+            start_date, end_date = schedule_period(run_at, schedule["period_days"])
+            try:
+                await self._ensure_state(guild.id)
+                result = await self.run_job(guild, start_date, end_date, trigger="schedule", timings=timings,
+                                            history_fields={"scheduled_for": run_at}, channel_id=schedule.get("channel_id"))
+            except Exception as e:
+                result = {"status": "error", "message": f"❌ 예약 집계 중 오류가 발생한 것이다: {e}", "timings": timings}
+                import traceback
+                traceback.print_exc()
+            self.last_run_ms = round((time.perf_counter() - started) * 1000)
+
+        self.runs += 1
+        if result.get("resumable"):
+            # 작업이 남아 있어 이어서 실행되고 끝나면 run_job이 기록을 남기므로 여기서는 기록하지 않음
+            print(f"⚠️ [예약 집계] 서버 {guild.id} 중단, 이어서 실행 예정: {result['status']} {result.get('message')}")
+        elif result["status"] != "ok":
+            # 성공한 집계는 run_job이 기록을 남기므로 실패로 끝난 실행만 여기서 기록
+            self.failed += 1
+            print(f"⚠️ [예약 집계] 서버 {guild.id} 실패: {result['status']} {result.get('message')}")
+            await self._save_failure(guild.id, run_at, schedule, result["status"], result.get("message"),
+                                     result.get("timings") or timings, start_date, end_date)
+        else:
+            print(f"[예약 집계] 서버 {guild.id} 완료: {result['timings']}")
+
+        await self._notify(guild, schedule.get("channel_id"), result, "📊 예약 집계 결과인 것이다!")
+
+    async def _save_failure(self, guild_id, run_at, schedule, status, error, timings, start_date=None, end_date=None):
+        if start_date is None:
+            start_date, end_date = schedule_period(run_at, schedule["period_days"])
+        try:
+            await adb.save_aggregate_history(
+                guild_id=guild_id,
+                aggregate_date=datetime.datetime.now(pytz.UTC),
+                start_date=start_date,
+                end_date=end_date,
+                top_chatters=[],
+                trigger="schedule",
+                status=status,
+                timings=timings,
+                error=error,
+                scheduled_for=run_at
+            )
+        except Exception as e:
+            print(f"⚠️ [예약 집계] 서버 {guild_id} 실행 기록 저장 실패: {e}")
+
+    async def _notify(self, guild, channel_id, result, title):
+        """채널에 결과 이미지나 실패 사유를 보냅니다"""
+        channel = guild.get_channel(channel_id) if channel_id else None
+        if channel is None:
+            return
+        try:
+            if result["status"] == "ok":
+                await channel.send(content=title, file=disnake.File(fp=result["image"], filename="ranking.png"))
+            else:
+                await channel.send(content=f"⚠️ 집계를 끝내지 못한 것이다.\n{result.get('message') or result['status']}")
+        except Exception as e:
+            print(f"⚠️ [예약 집계] 서버 {guild.id} 결과 알림 실패: {e}")
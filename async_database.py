@@ -0,0 +1,136 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pymongo
+
+import database as db
+
+# 비동기 DB 계층 설정
+# pymongo는 동기 드라이버이므로 전용 스레드 풀에서 실행하여 이벤트 루프(게이트웨이)가 멈추지 않도록 함
+ASYNC_DB_WORKERS = int(os.getenv("ASYNC_DB_WORKERS", str(db.MONGO_MAX_POOL_SIZE)))
+ASYNC_DB_TIMEOUT = float(os.getenv("ASYNC_DB_TIMEOUT", "15"))  # 초, None이면 제한 없음
+
+_executor = ThreadPoolExecutor(max_workers=ASYNC_DB_WORKERS, thread_name_prefix="mongo")
+
+
+def _call_with_timeout(func, timeout, args, kwargs):
+    # pymongo.timeout은 스레드(컨텍스트)별로 적용되므로 작업 스레드 안에서 설정
+    if timeout is None:
+        return func(*args, **kwargs)
+    with pymongo.timeout(timeout):
+        return func(*args, **kwargs)
+
+
+async def run(func, *args, timeout=ASYNC_DB_TIMEOUT, **kwargs):
+    """
+    동기 DB 함수를 전용 스레드 풀에서 실행하고 결과를 기다립니다.
+    timeout이 지나면 DB 작업 자체도 중단되며, 호출한 코루틴이 취소되면 대기 중인 작업은 실행되지 않습니다.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(
+        _executor,
+        functools.partial(_call_with_timeout, func, timeout, args, kwargs)
+    )
+    if timeout is None:
+        return await future
+    # 스레드 쪽 타임아웃보다 약간 늦게 끊어 pymongo 예외가 먼저 전달되도록 함
+    return await asyncio.wait_for(future, timeout + 1)
+
+
+def _wrap(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run(func, *args, **kwargs)
+    return wrapper
+
+
+def is_mongo_connected():
+    """DB 호출이 없으므로 동기 함수 그대로 사용합니다"""
+    return db.is_mongo_connected()
+
+
+def shutdown():
+    """작업 스레드 풀을 정리합니다 (봇 종료 시 호출)"""
+    _executor.shutdown(wait=True, cancel_futures=True)
+
+
+# database.py 함수의 코루틴 버전 (이름과 인자가 같음)
+# 서버 설정 (역할 / 제외 역할 / 역할 색상)
+get_guild_config = _wrap(db.get_guild_config)
+load_guild_configs = _wrap(db.load_guild_configs)
+get_guild_configs = _wrap(db.get_guild_configs)
+get_guild_config_changes = _wrap(db.get_guild_config_changes)
+ensure_guild_configs_migrated = _wrap(db.ensure_guild_configs_migrated)
+load_role_data = _wrap(db.load_role_data)
+get_guild_role_data = _wrap(db.get_guild_role_data)
+save_role_data = _wrap(db.save_role_data)
+load_excluded_role_data = _wrap(db.load_excluded_role_data)
+get_guild_excluded_roles = _wrap(db.get_guild_excluded_roles)
+save_excluded_role_data = _wrap(db.save_excluded_role_data)
+add_excluded_role = _wrap(db.add_excluded_role)
+remove_excluded_role = _wrap(db.remove_excluded_role)
+save_role_original_color = _wrap(db.save_role_original_color)
+get_role_original_color = _wrap(db.get_role_original_color)
+
+# 채팅 카운트 / 메시지
+load_chat_counts = _wrap(db.load_chat_counts)
+get_guild_chat_counts = _wrap(db.get_guild_chat_counts)
+get_chat_counts_for_guilds = _wrap(db.get_chat_counts_for_guilds)
+get_chat_count_changes = _wrap(db.get_chat_count_changes)
+count_guild_chat_counts = _wrap(db.count_guild_chat_counts)
+increment_chat_count = _wrap(db.increment_chat_count)
+increment_chat_counts = _wrap(db.increment_chat_counts)
+reset_chat_counts = _wrap(db.reset_chat_counts)
+save_message = _wrap(db.save_message)
+save_messages = _wrap(db.save_messages)
+get_message_date_range = _wrap(db.get_message_date_range)
+increment_hourly_chat_counts = _wrap(db.increment_hourly_chat_counts)
+replay_ingest_records = _wrap(db.replay_ingest_records)
+mark_hourly_rollups_live = _wrap(db.mark_hourly_rollups_live)
+get_chat_counts_in_period = _wrap(db.get_chat_counts_in_period)
+get_top_chatters_in_period = _wrap(db.get_top_chatters_in_period)
+
+# 집계 / 연속 기록
+save_last_aggregate_date = _wrap(db.save_last_aggregate_date)
+get_last_aggregate_date = _wrap(db.get_last_aggregate_date)
+set_aggregate_schedule = _wrap(db.set_aggregate_schedule)
+clear_aggregate_schedule = _wrap(db.clear_aggregate_schedule)
+get_due_aggregate_schedules = _wrap(db.get_due_aggregate_schedules)
+claim_aggregate_schedule = _wrap(db.claim_aggregate_schedule)
+get_role_streak = _wrap(db.get_role_streak)
+get_role_streaks = _wrap(db.get_role_streaks)
+get_role_streak_changes = _wrap(db.get_role_streak_changes)
+update_role_streak = _wrap(db.update_role_streak)
+update_ranking_streaks = _wrap(db.update_ranking_streaks)
+reset_role_streaks = _wrap(db.reset_role_streaks)
+reset_user_role_streak = _wrap(db.reset_user_role_streak)
+save_aggregate_history = _wrap(db.save_aggregate_history)
+get_aggregate_history = _wrap(db.get_aggregate_history)
+get_aggregate_record = _wrap(db.get_aggregate_record)
+create_aggregate_job = _wrap(db.create_aggregate_job)
+get_active_aggregate_job = _wrap(db.get_active_aggregate_job)
+get_resumable_aggregate_jobs = _wrap(db.get_resumable_aggregate_jobs)
+claim_aggregate_job = _wrap(db.claim_aggregate_job)
+update_aggregate_job = _wrap(db.update_aggregate_job)
+finish_aggregate_job = _wrap(db.finish_aggregate_job)
+
+# 인증
+generate_auth_code = _wrap(db.generate_auth_code)
+validate_auth_code = _wrap(db.validate_auth_code)
+use_auth_code = _wrap(db.use_auth_code)
+load_authorized_guilds = _wrap(db.load_authorized_guilds)
+is_guild_authorized = _wrap(db.is_guild_authorized)
+list_authorized_guilds = _wrap(db.list_authorized_guilds)
+list_unused_auth_codes = _wrap(db.list_unused_auth_codes)
+delete_authorized_guild = _wrap(db.delete_authorized_guild)
+delete_auth_code = _wrap(db.delete_auth_code)
+
+# 봇 메타 정보
+get_bot_meta = _wrap(db.get_bot_meta)
+set_bot_meta = _wrap(db.set_bot_meta)
+
+# 서버 / 사용자 정보
+save_guild_info = _wrap(db.save_guild_info)
+save_user_data = _wrap(db.save_user_data)
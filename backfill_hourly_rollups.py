@@ -0,0 +1,47 @@
+import sys
+from datetime import datetime, timezone, timedelta
+
+import database as db
+
+# 사용법: python backfill_hourly_rollups.py [guild_id ...]
+# 서버 ID를 지정하지 않으면 messages 컬렉션에 있는 모든 서버를 백필합니다.
+# 봇이 시간별 집계를 쌓기 시작한 뒤(최소 한 시간 이상 실행된 뒤)에 실행해야 합니다.
+
+def backfill_hourly_rollups(guild_ids=None):
+    if not db.is_mongo_connected():
+        print("❌ MongoDB에 연결되지 않았습니다.")
+        return False
+
+    live = db.rollup_status_collection.find_one({"_id": db.ROLLUP_LIVE_ID})
+    if not live or not live.get("since"):
+        print("❌ 시간별 집계가 아직 시작되지 않았습니다. 봇을 먼저 실행한 뒤 다시 시도하세요.")
+        return False
+
+    # 수집 큐에 남아 있을 수 있는 최근 메시지와 겹치지 않도록 한 시간 전까지만 다시 만듦
+    cutoff = db.hour_bucket(datetime.now(timezone.utc)) - timedelta(hours=1)
+    live_start = db.hour_bucket(live["since"]) + timedelta(hours=1)
+    if cutoff < live_start:
+        print(f"❌ 실시간 집계 시작({live['since']}) 후 충분한 시간이 지나지 않았습니다. {live_start + timedelta(hours=1)} (UTC) 이후에 다시 실행하세요.")
+        return False
+
+    if not guild_ids:
+        guild_ids = db.messages_collection.distinct("guild_id")
+
+    print(f"시간별 집계 백필 시작: 서버 {len(guild_ids)}개, {cutoff} (UTC) 이전 메시지 대상")
+    failed = 0
+    for index, guild_id in enumerate(guild_ids, 1):
+        started = datetime.now()
+        try:
+            db.backfill_hourly_chat_counts(guild_id, cutoff)
+        except Exception as e:
+            failed += 1
+            print(f"❌ [{index}/{len(guild_ids)}] 서버 {guild_id} 백필 실패: {e}")
+            continue
+        elapsed = (datetime.now() - started).total_seconds()
+        print(f"✅ [{index}/{len(guild_ids)}] 서버 {guild_id} 백필 완료 ({elapsed:.1f}초)")
+
+    print(f"시간별 집계 백필 완료 (실패 {failed}개)")
+    return failed == 0
+
+if __name__ == "__main__":
+    backfill_hourly_rollups([int(arg) for arg in sys.argv[1:]])
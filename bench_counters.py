@@ -0,0 +1,68 @@
+import random
+import sys
+import time
+import tracemalloc
+from collections import Counter
+
+from ranking import RankedCounter
+from compact_counter import CompactCounter, np
+
+# 사용법: python bench_counters.py [사용자 수 ...]
+# 채팅 카운터 구현별 메모리 사용량과 증가/순위 조회 비용을 비교합니다.
+
+SIZES = [10_000, 100_000, 1_000_000]
+INCREMENTS = 200_000
+RANK_QUERIES = 20
+
+
+def make_counts(size):
+    rng = random.Random(size)
+    # 디스코드 ID와 비슷한 크기의 64비트 정수, 채팅 수는 긴 꼬리 분포
+    return {rng.getrandbits(62) | (1 << 62): int(rng.paretovariate(1.2)) for _ in range(size)}
+
+
+def measure_memory(factory, counts):
+    tracemalloc.start()
+    counter = factory(counts)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return counter, current
+
+
+def measure_increments(counter, keys):
+    rng = random.Random(0)
+    targets = [rng.choice(keys) for _ in range(INCREMENTS)]
+    started = time.perf_counter()
+    for key in targets:
+        counter[key] += 1
+    return (time.perf_counter() - started) / INCREMENTS * 1e9
+
+
+def measure_top_page(counter):
+    started = time.perf_counter()
+    for _ in range(RANK_QUERIES):
+        if isinstance(counter, Counter) and not isinstance(counter, RankedCounter):
+            sorted(counter.items(), key=lambda x: x[1], reverse=True)[:25]
+        else:
+            counter.page(1, 25)
+    return (time.perf_counter() - started) / RANK_QUERIES * 1e3
+
+
+def run(sizes):
+    print(f"numpy 사용: {'예' if np is not None else '아니오'}")
+    print(f"{'사용자 수':>10} | {'구현':<15} | {'메모리(MB)':>10} | {'바이트/사용자':>12} | {'증가(ns)':>9} | {'1페이지(ms)':>11}")
+    print("-" * 85)
+    for size in sizes:
+        counts = make_counts(size)
+        keys = list(counts)
+        for name, factory in (("Counter", Counter), ("RankedCounter", RankedCounter), ("CompactCounter", CompactCounter)):
+            counter, memory = measure_memory(factory, counts)
+            increment_ns = measure_increments(counter, keys)
+            page_ms = measure_top_page(counter)
+            print(f"{size:>10,} | {name:<15} | {memory / 1024 / 1024:>10.1f} | {memory / size:>12.1f} | {increment_ns:>9.0f} | {page_ms:>11.2f}")
+            del counter
+        print("-" * 85)
+
+
+if __name__ == "__main__":
+    run([int(arg) for arg in sys.argv[1:]] or SIZES)
@@ -1,8 +1,8 @@
 import asyncio
+import time
 import disnake
-from disnake.ext import commands, tasks
-from collections import Counter
-from datetime import datetime
+from disnake.ext import commands
+from datetime import datetime, timezone
 from dotenv import load_dotenv
 import os
 import warnings
@@ -25,13 +25,37 @@ intents.members = True
 intents.guilds = True
 intents.messages = True
 
-# Bot 설정
-bot = commands.InteractionBot(
+# Bot 설정 (종료 시 쓰기 지연 버퍼를 비우도록 close 확장)
+class MizukiBot(commands.InteractionBot):
+    async def close(self):
+        # 진행 중인 워밍업을 멈추고, 남은 채팅 카운트 증가분을 DB에 저장한 뒤 종료
+        if _warmup_task is not None and not _warmup_task.done():
+            _warmup_task.cancel()
+        await aggregate_scheduler.close()
+        await mongo_health_monitor.close()
+        await guild_cache.close()
+        try:
+            await chat_count_buffer.close()
+        except Exception as e:
+            print(f"⚠️ 종료 중 채팅 카운트 저장 오류: {e}")
+        await state_snapshotter.close()
+        try:
+            await message_ingest_queue.close()
+        except Exception as e:
+            print(f"⚠️ 종료 중 메시지 저장 오류: {e}")
+        # 버퍼/큐를 비운 뒤 반영된 수집 로그 세그먼트 정리
+        await ingest_wal.close()
+        await super().close()
+        adb.shutdown()
+
+bot = MizukiBot(
     intents=intents,
-    test_guilds=None  # 전역 명령어로 설정
+    test_guilds=None,  # 전역 명령어로 설정
+    # 자동 동기화 대신 on_ready에서 명령어 정의가 바뀌었을 때만 동기화 (command_sync.py)
+    command_sync_flags=commands.CommandSyncFlags.none()
 )
 
-# 메모리 캐시 변수 (채팅 카운트만 Counter 객체로 유지, 나머지는 DB에서 로드)
+# 메모리 캐시 변수 (채팅 카운트만 RankedCounter/CompactCounter 객체로 유지하여 순위 조회를 빠르게, 나머지는 DB에서 로드)
 server_roles = {}
 server_chat_counts = {}
 server_excluded_roles = {}
@@ -40,16 +64,118 @@ role_streaks = {}
 
 # 데이터베이스 모듈 임포트
 import database as db
-from database import reset_user_role_streak  # 반드시 이 줄이 있어야 함
+import async_database as adb  # 이벤트 루프를 막지 않는 DB 함수 (코루틴 버전)
+from write_buffer import ChatCountBuffer, MessageIngestQueue
+from message_router import MessageRouter
+from compact_counter import make_chat_counter, compact_if_large
+from guild_cache import GuildStateCache
+from command_sync import sync_commands_if_changed
+from state_snapshot import StateSnapshotter, counter_from_arrays, STATE_SNAPSHOT_DELTA_SLACK
+from mongo_health import MongoHealthMonitor, MONGO_HEALTH_TIMEOUT
+from ingest_wal import IngestWAL
+from role_assigner import RoleAssigner
+from excluded_members import ExcludedMemberIndex
+from aggregate_scheduler import AggregateScheduler
+from aggregate_jobs import AggregateJobStore
+
+# 수집 로그 (메시지 수집 기록을 DB보다 먼저 로컬 파일에 남기고, 반영되지 못한 기록은 DB 연결 후 재생)
+ingest_wal = IngestWAL() if db.is_mongo_configured() else IngestWAL(directory="")
+
+# 채팅 카운트 쓰기 지연 버퍼 (메시지마다 DB에 쓰지 않고 모아서 $inc로 저장, 저장 후 DB 값으로 메모리 카운터를 맞춤)
+chat_count_buffer = ChatCountBuffer(server_chat_counts, wal_writer_id=ingest_wal.writer_id)
+
+# 메시지 수집 큐 (메시지 문서를 모아서 message_id 기준으로 업서트, 새로 저장된 메시지만 채팅 카운트 버퍼에 더함)
+message_ingest_queue = MessageIngestQueue(chat_count_buffer, wal_writer_id=ingest_wal.writer_id)
+ingest_wal.ack_sources = [chat_count_buffer.applied_lsn, message_ingest_queue.applied_lsn]
+
+# 역할 변경 엔진 (집계 시 멤버 역할 변경을 서버별 동시 실행 수 제한과 429 재시도로 병렬 실행)
+role_assigner = RoleAssigner()
+
+# 서버별 제외 역할 멤버 집합 (role.members로 만들고 멤버 이벤트로 갱신, 집계/리더보드의 제외 여부 확인용)
+excluded_member_index = ExcludedMemberIndex(server_excluded_roles)
+
+# 집계 작업 기록 (단계별 진행 상황과 서버별 임대를 DB에 남겨 같은 서버의 동시 집계를 막고, 중단된 집계를 재개)
+aggregate_jobs = AggregateJobStore()
+
+# 예약 집계 스케줄러 (서버 설정의 aggregate_schedule을 주기적으로 확인해 실행하고 임대가 끝난 집계 작업을 재개,
+# run_job/resume_job은 commands/aggregate.py에서 연결)
+aggregate_scheduler = AggregateScheduler(bot, aggregate_jobs)
+
+# 텍스트 명령어 라우터 (각 명령어 모듈이 message_router.command로 등록)
+message_router = MessageRouter()
+
+# 서버 상태 캐시 (오래 쓰지 않은 서버는 채팅 카운트 저장 후 메모리에서 내리고, 다음 사용 시 다시 로드)
+guild_cache = GuildStateCache(
+    server_chat_counts,
+    [server_roles, server_excluded_roles, last_aggregate_dates, role_streaks],
+    flush_dirty=chat_count_buffer.flush,
+    pending_guild_ids=chat_count_buffer.pending_guild_ids
+)
+_pending_guild_loads = {}
+
+# 메모리 상태 스냅샷 (주기적으로 로컬 파일에 저장, 시작 시 읽고 그 이후 변경분만 DB에서 조회)
+state_snapshotter = StateSnapshotter(
+    server_chat_counts, server_roles, server_excluded_roles, role_streaks,
+    flush_pending=chat_count_buffer.flush,
+    pending_counts=chat_count_buffer.pending_counts,
+    skip_guild_ids=lambda: _degraded_guilds
+)
+
+# DB 연결이 끊긴 동안 빈 상태로 올라온 서버 (복구 후, 또는 접근할 때 DB에서 다시 로드)
+_degraded_guilds = set()
+DEGRADED_GUILD_RETRY_INTERVAL = float(os.getenv("DEGRADED_GUILD_RETRY_INTERVAL", "30"))  # 초, 빈 상태로 올라온 서버를 접근할 때 다시 로드하는 최소 간격
+_degraded_retry_at = {}  # {guild_id: 다음 다시 로드 시도 시각 (monotonic)}
+
+async def _ping_mongo():
+    return await adb.run(db.ping, timeout=MONGO_HEALTH_TIMEOUT)
+
+async def _reconnect_mongo():
+    return await adb.run(db.connect, timeout=None)
+
+async def _on_mongo_recovered():
+    """연결 복구 후 밀린 채팅 카운트를 저장하고, 끊긴 동안 빈 상태로 올라온 서버를 다시 로드합니다"""
+    global _warmup_task
+    await chat_count_buffer.flush()
+
+    # 저장되지 않은 증가분이 남은 서버는 플러시 후 DB 값으로 맞춰지므로 그대로 둠
+    pending = chat_count_buffer.pending_guild_ids()
+    reloaded = [guild_id for guild_id in _degraded_guilds if guild_id not in pending]
+    for guild_id in reloaded:
+        _degraded_guilds.discard(guild_id)
+        _degraded_retry_at.pop(guild_id, None)
+        server_chat_counts.pop(guild_id, None)
+        for state in (server_roles, server_excluded_roles, last_aggregate_dates, role_streaks):
+            state.pop(guild_id, None)
+    if reloaded:
+        print(f"[DB 상태] 연결이 끊긴 동안 올라온 서버 {len(reloaded)}개를 다시 로드합니다")
+
+    # 시작 시 연결되지 않아 건너뛴 워밍업도 여기서 실행 (메모리에 없는 서버만 로드)
+    if bot.is_ready() and (_warmup_task is None or _warmup_task.done()):
+        _warmup_task = asyncio.ensure_future(warm_up_guild_states([guild.id for guild in bot.guilds]))
+
+# MongoDB 상태 확인 (주기적 ping, 연속 실패 시 차단 후 백오프로 재연결)
+mongo_health_monitor = MongoHealthMonitor(
+    ping=_ping_mongo,
+    reconnect=_reconnect_mongo,
+    set_available=db.set_mongo_available,
+    on_recovered=_on_mongo_recovered
+)
+
+# 시작 시 워밍업 설정 (환경 변수로 조정 가능)
+WARMUP_BATCH_SIZE = int(os.getenv("WARMUP_BATCH_SIZE", "50"))  # $in 조회 하나에 넣을 서버 수
+WARMUP_CONCURRENCY = int(os.getenv("WARMUP_CONCURRENCY", "4"))  # 동시에 실행할 조회 수
+WARMUP_QUERY_TIMEOUT = float(os.getenv("WARMUP_QUERY_TIMEOUT", "60"))  # 초, 배치 조회 하나의 최대 시간
+warmup_stats = {}
+_warmup_task = None
 
 # MongoDB 기반 함수들 - 기존 SQLite 함수들 대체
-def get_role_streak(guild_id, user_id):
+async def get_role_streak(guild_id, user_id):
     """사용자의 역할 연속 기록을 가져옵니다."""
     if not db.is_mongo_connected():
         print("⚠️ MongoDB 연결 실패: 역할 연속 기록을 불러올 수 없습니다")
         return {"type": None, "count": 0}
 
-    result = db.get_role_streak(guild_id, user_id)
+    result = await adb.get_role_streak(guild_id, user_id)
 
     # 메모리 캐시 업데이트
     if guild_id not in role_streaks:
@@ -58,13 +184,13 @@ def get_role_streak(guild_id, user_id):
 
     return result
 
-def update_role_streak(guild_id, user_id, role_type):
+async def update_role_streak(guild_id, user_id, role_type):
     """사용자의 역할 연속 기록을 업데이트합니다."""
     if not db.is_mongo_connected():
         print("⚠️ MongoDB 연결 실패: 역할 연속 기록을 저장할 수 없습니다")
         return 1
 
-    new_streak = db.update_role_streak(guild_id, user_id, role_type)
+    new_streak = await adb.update_role_streak(guild_id, user_id, role_type)
 
     # 메모리 캐시 업데이트
     if guild_id not in role_streaks:
@@ -77,177 +203,364 @@ def update_role_streak(guild_id, user_id, role_type):
 
     return new_streak
 
-def reset_chat_counts(guild_id):
-    """특정 길드의 모든 채팅 카운트를 초기화합니다."""
-    if guild_id in server_chat_counts:
-        server_chat_counts[guild_id].clear()  # Counter 객체 초기화
+async def update_ranking_streaks(guild_id, role_types, dropped_user_ids=None, lookup_user_ids=None, job_id=None):
+    """집계 결과의 연속 기록(순위권 증가, 순위권 제외 초기화)을 한 번에 반영하고 새 기록을 반환합니다."""
+    if not db.is_mongo_connected():
+        print("⚠️ MongoDB 연결 실패: 역할 연속 기록을 저장할 수 없습니다")
+
+    result = await adb.update_ranking_streaks(guild_id, role_types, dropped_user_ids, lookup_user_ids, job_id)
+
+    # 메모리 캐시 업데이트
+    guild_streaks = role_streaks.setdefault(guild_id, {})
+    for user_id in dropped_user_ids or []:
+        if user_id in guild_streaks:
+            guild_streaks[user_id]["count"] = 0
+    guild_streaks.update(result)
+
+    return result
 
+async def reset_user_role_streak(guild_id, user_id):
+    """순위권에서 벗어난 사용자의 역할 연속 기록을 초기화합니다."""
     if not db.is_mongo_connected():
-        print("⚠️ MongoDB 연결 실패: 채팅 카운트를 초기화할 수 없습니다")
-        return
+        return False
 
-    # MongoDB에서 채팅 카운트 삭제
-    db.reset_chat_counts(guild_id)
-    print(f"[MongoDB] 길드 {guild_id}의 채팅 카운트 초기화 완료")
+    result = await adb.reset_user_role_streak(guild_id, user_id)
 
-def save_last_aggregate_date(guild_id):
+    # 메모리 캐시 업데이트
+    if guild_id in role_streaks and user_id in role_streaks[guild_id]:
+        role_streaks[guild_id][user_id]["count"] = 0
+
+    return result
+
+async def reset_chat_counts(guild_id, job_id=None):
+    """특정 길드의 모든 채팅 카운트를 초기화합니다."""
+    async def reset():
+        if guild_id in server_chat_counts:
+            server_chat_counts[guild_id].clear()  # 채팅 카운터 객체 초기화 (순위 정보 포함)
+
+        if not db.is_mongo_connected():
+            print("⚠️ MongoDB 연결 실패: 채팅 카운트를 초기화할 수 없습니다")
+            return
+
+        # MongoDB에서 채팅 카운트 삭제
+        await adb.reset_chat_counts(guild_id, job_id)
+        print(f"[MongoDB] 길드 {guild_id}의 채팅 카운트 초기화 완료")
+
+    # 진행 중인 플러시를 기다린 뒤 아직 저장되지 않은 증가분을 버리고 초기화
+    # (플러시 잠금 안에서 실행하므로 저장 중이던 증가분이 삭제 뒤에 다시 더해지지 않음)
+    await chat_count_buffer.reset_guild(guild_id, reset)
+
+async def save_last_aggregate_date(guild_id):
     """마지막 집계 날짜를 저장합니다."""
     if not db.is_mongo_connected():
         print("⚠️ MongoDB 연결 실패: 집계 날짜를 저장할 수 없습니다")
         return
 
     # MongoDB에 저장
-    db.save_last_aggregate_date(guild_id)
+    await adb.save_last_aggregate_date(guild_id)
     print(f"[MongoDB] 길드 {guild_id}의 마지막 집계 날짜 저장 완료")
 
-def get_last_aggregate_date(guild_id):
+async def get_last_aggregate_date(guild_id):
     """마지막 집계 날짜를 조회합니다."""
     if not db.is_mongo_connected():
         print("⚠️ MongoDB 연결 실패: 집계 날짜를 조회할 수 없습니다")
         return None
 
-    return db.get_last_aggregate_date(guild_id)
+    return await adb.get_last_aggregate_date(guild_id)
+
+async def get_top_chatters_in_period(guild_id, start_date, end_date, limit=6, exclude_user_ids=None):
+    """특정 기간의 채팅 상위 사용자와 합계를 조회합니다. (DB에서 합산/정렬)"""
+    if not db.is_mongo_connected():
+        print("⚠️ MongoDB 연결 실패: 채팅 기록을 조회할 수 없습니다")
+        return [], {"messages": 0, "chatters": 0}
+
+    return await adb.get_top_chatters_in_period(guild_id, start_date, end_date, limit, exclude_user_ids)
 
-def get_messages_in_period(guild_id, start_date, end_date):
-    """특정 기간의 메시지를 조회합니다."""
+async def _load_guild_state(guild_id):
+    """서버의 채팅 카운트, 역할, 제외 역할을 DB에서 불러와 메모리에 올립니다"""
     if not db.is_mongo_connected():
-        print("⚠️ MongoDB 연결 실패: 메시지를 조회할 수 없습니다")
-        return []
+        server_chat_counts.setdefault(guild_id, make_chat_counter())
+        if db.is_mongo_configured():
+            _degraded_guilds.add(guild_id)
+        return
+
+    try:
+        guild_chat_counts, config = await asyncio.gather(
+            adb.get_guild_chat_counts(guild_id),
+            adb.get_guild_config(guild_id)  # 역할, 제외 역할 등 서버 설정 문서 하나
+        )
+    except Exception as e:
+        print(f"[서버 상태] 서버 {guild_id} 로드 실패: {e}")
+        server_chat_counts.setdefault(guild_id, make_chat_counter())
+        _degraded_guilds.add(guild_id)
+        return
+
+    if _apply_guild_state(guild_id, config, guild_chat_counts):
+        print(f"[서버 상태] 서버 {guild_id}의 채팅 카운트 로드: {len(guild_chat_counts)}개 항목")
+
+def _apply_guild_state(guild_id, config, guild_chat_counts):
+    """DB에서 불러온 서버 상태를 메모리에 올립니다. 채팅 카운터를 새로 만들었으면 True"""
+    role_data = db.role_data_from_config(config)
+    excluded_roles = db.excluded_roles_from_config(config)
+
+    # 역할 설정은 명령어로 먼저 저장되었을 수 있으므로 비어 있을 때만 채움
+    if role_data and guild_id not in server_roles:
+        server_roles[guild_id] = role_data
+    if excluded_roles and guild_id not in server_excluded_roles:
+        server_excluded_roles[guild_id] = excluded_roles
+
+    # 지연 로드로 먼저 올라온 서버는 그대로 둠 (그 사이 증가분이 있을 수 있음)
+    created = guild_id not in server_chat_counts
+    if created:
+        server_chat_counts[guild_id] = make_chat_counter(guild_chat_counts)
+    guild_cache.record_load(guild_id)
+    return created
+
+def _as_timestamp(value):
+    # pymongo는 UTC 시각을 시간대 없는 datetime으로 반환
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+async def restore_state_snapshot(guild_ids):
+    """로컬 스냅샷에서 서버 상태를 올리고, 스냅샷 이후 바뀐 부분만 DB에서 조회해 덮어씁니다. 복원한 서버 수 반환"""
+    snapshot = await asyncio.to_thread(state_snapshotter.load)
+    if snapshot is None:
+        return 0
+
+    since_ts = snapshot["taken_at"] - STATE_SNAPSHOT_DELTA_SLACK
+    since = datetime.fromtimestamp(since_ts, timezone.utc)
+    count_changes, config_changes, streak_changes = await asyncio.gather(
+        adb.get_chat_count_changes(since, timeout=WARMUP_QUERY_TIMEOUT),
+        adb.get_guild_config_changes(since, timeout=WARMUP_QUERY_TIMEOUT),
+        adb.get_role_streak_changes(since, timeout=WARMUP_QUERY_TIMEOUT)
+    )
+
+    restored = 0
+    for guild_id in guild_ids:
+        saved = snapshot["guilds"].get(guild_id)
+        # 스냅샷에 없는 서버와 그 사이 지연 로드로 올라온 서버는 건너뜀
+        if saved is None or guild_id in server_chat_counts:
+            continue
+
+        config = config_changes.get(guild_id)
+        reset_at = _as_timestamp((config or {}).get("chat_counts_reset_at"))
+        if reset_at is not None and reset_at >= since_ts:
+            # 스냅샷 이후 초기화되었으면 스냅샷 값을 버리고 변경분만 사용
+            counter = make_chat_counter()
+        else:
+            counter = counter_from_arrays(saved["ids"], saved["counts"])
+        for user_id, count in count_changes.get(guild_id, {}).items():
+            counter[user_id] = count
+        server_chat_counts[guild_id] = compact_if_large(counter)
+
+        if config is not None:
+            role_data = db.role_data_from_config(config)
+            excluded_roles = db.excluded_roles_from_config(config)
+        else:
+            role_data = saved["roles"]
+            excluded_roles = saved["excluded_roles"]
+        if role_data and guild_id not in server_roles:
+            server_roles[guild_id] = role_data
+        if excluded_roles and guild_id not in server_excluded_roles:
+            server_excluded_roles[guild_id] = excluded_roles
+
+        guild_streaks = dict(saved["streaks"])
+        guild_streaks.update(streak_changes.get(guild_id, {}))
+        if guild_streaks:
+            role_streaks.setdefault(guild_id, {}).update(guild_streaks)
+
+        guild_cache.record_load(guild_id)
+        restored += 1
+
+    print(f"[스냅샷] 시퀀스 {snapshot['sequence']} 스냅샷에서 {restored}개 서버 복원 "
+          f"(변경분: 채팅 카운트 {sum(len(changes) for changes in count_changes.values())}개, "
+          f"서버 설정 {len(config_changes)}개, 연속 기록 {sum(len(changes) for changes in streak_changes.values())}개)")
+    return restored
+
+async def warm_up_guild_states(guild_ids):
+    """여러 서버의 상태를 $in 배치 조회로 동시에 불러옵니다
+
+    워밍업 중에 온 메시지는 ensure_guild_state의 서버별 지연 로드로 처리되며,
+    워밍업은 아직 메모리에 없는 서버만 채움
+    """
+    started = time.perf_counter()
+    guild_ids = [guild_id for guild_id in guild_ids if guild_id not in server_chat_counts]
+    spans = {}  # 단계 -> [처음 시작, 마지막 끝] (동시에 실행되므로 단계별 실제 경과 시간)
+
+    # 지난 실행에서 반영되지 못한 수집 로그를 먼저 DB에 반영 (이후 불러오는 채팅 카운트에 포함되도록)
+    if ingest_wal.spilling:
+        replay_started = time.perf_counter()
+        if not await ingest_wal.wait_replayed(timeout=WARMUP_QUERY_TIMEOUT):
+            print(f"⚠️ [워밍업] 수집 로그 재생이 끝나지 않아 먼저 진행합니다: {ingest_wal.stats()}")
+        spans["수집 로그 재생"] = [replay_started, time.perf_counter()]
+
+    # 로컬 스냅샷이 있으면 먼저 복원하고, 스냅샷에 없던 서버만 배치 조회로 불러옴
+    snapshot_started = time.perf_counter()
+    restored = 0
+    try:
+        restored = await restore_state_snapshot(guild_ids)
+    except Exception as e:
+        print(f"⚠️ [워밍업] 스냅샷 복원 실패 (DB에서 모두 불러옴): {e}")
+    spans["스냅샷"] = [snapshot_started, time.perf_counter()]
+    total_guilds = len(guild_ids)
+    guild_ids = [guild_id for guild_id in guild_ids if guild_id not in server_chat_counts]
+
+    batches = [guild_ids[i:i + WARMUP_BATCH_SIZE] for i in range(0, len(guild_ids), WARMUP_BATCH_SIZE)]
+    semaphore = asyncio.Semaphore(WARMUP_CONCURRENCY)
+
+    def record(phase, phase_started):
+        span = spans.setdefault(phase, [phase_started, phase_started])
+        span[0] = min(span[0], phase_started)
+        span[1] = max(span[1], time.perf_counter())
+
+    async def timed(phase, func, batch):
+        async with semaphore:
+            phase_started = time.perf_counter()
+            try:
+                return await func(batch, timeout=WARMUP_QUERY_TIMEOUT)
+            finally:
+                record(phase, phase_started)
+
+    async def load_batch(batch):
+        configs, chat_counts = await asyncio.gather(
+            timed("설정", adb.get_guild_configs, batch),
+            timed("채팅 카운트", adb.get_chat_counts_for_guilds, batch)
+        )
+        apply_started = time.perf_counter()
+        loaded = sum(_apply_guild_state(guild_id, configs.get(guild_id), chat_counts.get(guild_id, {}))
+                     for guild_id in batch)
+        record("적용", apply_started)
+        return loaded
+
+    print(f"[워밍업] 시작: 서버 {len(guild_ids)}개, 배치 {len(batches)}개 (배치당 {WARMUP_BATCH_SIZE}개, 동시 {WARMUP_CONCURRENCY}개)")
+
+    # 예전 컬렉션에 남은 서버 설정은 배치 조회 전에 한 번에 옮김
+    migrate_started = time.perf_counter()
+    try:
+        await adb.ensure_guild_configs_migrated(timeout=None)
+    except Exception as e:
+        print(f"⚠️ [워밍업] 서버 설정 이전 실패 (서버별 지연 로드 시 다시 시도): {e}")
+    record("설정 이전", migrate_started)
+
+    results = await asyncio.gather(*(load_batch(batch) for batch in batches), return_exceptions=True)
+    failed = [batch for batch, result in zip(batches, results) if isinstance(result, Exception)]
+    for batch, result in zip(batches, results):
+        if isinstance(result, Exception):
+            print(f"⚠️ [워밍업] 서버 {len(batch)}개 배치 로드 실패 (서버별 지연 로드로 처리): {result}")
+
+    warmup_stats.update({
+        "guilds": total_guilds,
+        "restored": restored,
+        "loaded": sum(result for result in results if not isinstance(result, Exception)),
+        "failed_batches": len(failed),
+        "phases_ms": {phase: round((end - begin) * 1000, 1) for phase, (begin, end) in spans.items()},
+        "total_ms": round((time.perf_counter() - started) * 1000, 1),
+    })
+    phases = ", ".join(f"{phase} {ms}ms" for phase, ms in warmup_stats["phases_ms"].items())
+    # 제외 역할이 설정된 서버의 제외 멤버 집합을 미리 만듦 (이후에는 멤버 이벤트로 갱신)
+    excluded_built = excluded_member_index.rebuild_all(bot.guilds)
+    print(f"[워밍업] 제외 멤버 집합 {excluded_built}개 서버: {excluded_member_index.stats()}")
+
+    print(f"[워밍업] 완료: 스냅샷 {restored}개 + DB {warmup_stats['loaded']}/{len(guild_ids)}개 서버, {phases}, 전체 {warmup_stats['total_ms']}ms "
+          f"(역할 설정 {len(server_roles)}개, 제외 역할 {len(server_excluded_roles)}개, 채팅 카운트 {len(server_chat_counts)}개 서버)")
+    return warmup_stats
+
+async def _reload_degraded_guild(guild_id):
+    """빈 상태로 올라온 서버를 DB에서 다시 불러옵니다 (아직 저장되지 않은 증가분은 DB 값 위에 더함)"""
+    async def load():
+        return await asyncio.gather(adb.get_guild_chat_counts(guild_id), adb.get_guild_config(guild_id))
 
-    return db.get_messages_in_period(guild_id, start_date, end_date)
+    try:
+        (guild_chat_counts, config), pending = await chat_count_buffer.reload_guild(guild_id, load)
+    except Exception as e:
+        print(f"[서버 상태] 서버 {guild_id} 다시 로드 실패: {e}")
+        return
+    # 그 사이 연결 복구로 다시 로드되었거나 서버가 내려갔으면 그대로 둠
+    if guild_id not in _degraded_guilds or guild_id not in server_chat_counts:
+        return
+
+    _degraded_guilds.discard(guild_id)
+    _degraded_retry_at.pop(guild_id, None)
+    server_chat_counts.pop(guild_id, None)
+    for state in (last_aggregate_dates, role_streaks):
+        state.pop(guild_id, None)
+    _apply_guild_state(guild_id, config, guild_chat_counts)
+    counter = server_chat_counts[guild_id]
+    for user_id, amount in pending.items():
+        counter[user_id] = counter.get(user_id, 0) + amount
+    print(f"[서버 상태] 빈 상태로 올라온 서버 {guild_id}를 다시 로드: {len(guild_chat_counts)}개 항목")
+
+async def ensure_guild_state(guild_id):
+    """서버 상태가 메모리에 없으면 불러옵니다 (동시에 여러 번 불러오지 않음)
+
+    빈 상태로 올라온 서버는 DEGRADED_GUILD_RETRY_INTERVAL마다 백그라운드에서 다시 불러옴 (기다리지 않음)
+    """
+    if guild_id in server_chat_counts:
+        guild_cache.touch(guild_id)
+        if guild_id in _degraded_guilds and guild_id not in _pending_guild_loads:
+            now = time.monotonic()
+            if now >= _degraded_retry_at.get(guild_id, 0):
+                _degraded_retry_at[guild_id] = now + DEGRADED_GUILD_RETRY_INTERVAL
+                reload = asyncio.ensure_future(_reload_degraded_guild(guild_id))
+                _pending_guild_loads[guild_id] = reload
+                reload.add_done_callback(lambda _: _pending_guild_loads.pop(guild_id, None))
+        return
+
+    pending = _pending_guild_loads.get(guild_id)
+    if pending is None:
+        pending = asyncio.ensure_future(_load_guild_state(guild_id))
+        _pending_guild_loads[guild_id] = pending
+        pending.add_done_callback(lambda _: _pending_guild_loads.pop(guild_id, None))
+    await asyncio.shield(pending)
 
 @bot.event
 async def on_ready():
     print(f"✅ 봇 로그인 완료: {bot.user} (ID: {bot.user.id})")
 
-    global server_roles, server_chat_counts, server_excluded_roles
+    global server_roles, server_chat_counts, server_excluded_roles, _warmup_task
     try:
         print(f"Logged in as {bot.user.name}")
         print(f"Bot ID: {bot.user.id}")
 
-        # 명령어 디버깅 및 동기화 코드 추가
-        print("\n==== 슬래시 명령어 상태 확인 ====")
+        # 수집 로그 쓰기 루프 (지난 실행에서 반영되지 못한 기록이 있으면 재생도 시작)
+        ingest_wal.start()
+
+        # 서버 상태 워밍업은 백그라운드에서 명령어 동기화와 함께 실행
+        # (그동안 온 메시지는 서버별 지연 로드로 바로 집계)
+        if db.is_mongo_connected() and (_warmup_task is None or _warmup_task.done()):
+            _warmup_task = asyncio.ensure_future(warm_up_guild_states([guild.id for guild in bot.guilds]))
+
+        # 슬래시 명령어 동기화 (정의 해시가 마지막 동기화와 같으면 건너뜀)
         try:
-            print("명령어 동기화 시작...")
-            synced = await bot.sync_commands()
-            print(f"명령어 동기화 완료: {len(synced)}개 명령어 등록됨")
-            
-            # 등록된 명령어 목록 확인
-            commands = await bot.fetch_global_commands()
-            print("\n등록된 명령어 목록:")
-            for cmd in commands:
-                print(f" - {cmd.name}: {cmd.id}")
+            await sync_commands_if_changed(bot)
         except Exception as e:
             print(f"명령어 동기화 중 오류: {e}")
             import traceback
             traceback.print_exc()
-            
-        print("============================\n")
 
         check_required_files()
-        game_activity = disnake.Game(name="www.mofucat.jp")
-        await bot.change_presence(activity=game_activity)
 
-        print("\n==== 봇 초기화 및 데이터 로드 ====")
-        if db.is_mongo_connected():
-            print("MongoDB 연결 확인됨, 데이터 로드 시작...")
-
-            # 1. 역할 설정 데이터 (전체 로드)
-            print("\n역할 설정 데이터 로드 중...")
-            loaded_roles = db.load_role_data() # DB에서 모든 역할 데이터 로드
-            if loaded_roles:
-                # guild_id를 정수형으로 변환하여 저장
-                for guild_id_str, role_data in loaded_roles.items():
-                    try:
-                        guild_id_int = int(guild_id_str)
-                        server_roles[guild_id_int] = role_data
-                    except ValueError:
-                        print(f"잘못된 guild_id 형식: {guild_id_str}")
-                print(f"역할 데이터 로드 완료: {len(server_roles)}개 서버")
-                print(f"샘플 데이터 (처음 3개): {list(server_roles.items())[:3]}")
-            else:
-                print("DB에서 로드된 역할 데이터가 없습니다.")
-
-            # 2. 제외 역할 데이터 (전체 로드)
-            print("\n제외 역할 데이터 로드 중...")
-            loaded_excluded_roles = db.load_excluded_role_data()
-            if loaded_excluded_roles:
-                for guild_id_str, roles in loaded_excluded_roles.items():
-                    try:
-                        guild_id_int = int(guild_id_str)
-                        server_excluded_roles[guild_id_int] = roles
-                    except ValueError:
-                         print(f"잘못된 guild_id 형식 (제외 역할): {guild_id_str}")
-                print(f"제외 역할 데이터 로드 완료: {len(server_excluded_roles)}개 서버")
-                print(f"샘플 데이터 (처음 3개): {list(server_excluded_roles.items())[:3]}")
-            else:
-                print("DB에서 로드된 제외 역할 데이터가 없습니다.")
-            
-            # 3. 채팅 카운트 데이터 로드 (기존 코드 유지)
-            print("\n채팅 카운트 데이터 로드 중...")
-            loaded_chat_counts = db.load_chat_counts()
-            if loaded_chat_counts:
-                for guild_id, counts in loaded_chat_counts.items():
-                    server_chat_counts[guild_id] = Counter(counts)
-                print(f"채팅 카운트 로드 완료: {len(server_chat_counts)}개 서버, "
-                      f"총 {sum(len(counts) for counts in server_chat_counts.values())}명의 사용자")
-                for guild_id_key in list(server_chat_counts.keys())[:3]:
-                    user_count = len(server_chat_counts[guild_id_key])
-                    message_count = sum(server_chat_counts[guild_id_key].values())
-                    print(f"  서버 {guild_id_key}: {user_count}명, {message_count}개 메시지")
-            else:
-                print("DB에서 로드된 채팅 카운트 데이터가 없습니다.")
-
-            # 4. 각 서버별 데이터 재검증 및 누락된 데이터 로드
-            print("\n참여 중인 모든 서버 데이터 검증 및 추가 로드 중...")
-            for guild in bot.guilds:
-                guild_id = guild.id
-                print(f"\n서버 {guild_id} ({guild.name}) 데이터 확인:")
-
-                # 역할 데이터 확인 및 로드
-                if guild_id not in server_roles:
-                    print(f"  역할 데이터 메모리에 없음, DB에서 직접 로드 시도...")
-                    role_data = db.get_guild_role_data(guild_id)
-                    if role_data:
-                        server_roles[guild_id] = role_data
-                        print(f"  ✓ DB에서 역할 데이터 직접 로드 성공: {role_data}")
-                    else:
-                        print(f"  - DB에도 역할 데이터 없음")
-                else:
-                    print(f"  ✅ 역할 데이터 메모리에 있음: {server_roles[guild_id]}")
-
-                # 제외 역할 데이터 확인 및 로드
-                if guild_id not in server_excluded_roles:
-                    print(f"  제외 역할 데이터 메모리에 없음, DB에서 직접 로드 시도...")
-                    excluded_roles = db.get_guild_excluded_roles(guild_id)
-                    if excluded_roles:
-                        server_excluded_roles[guild_id] = excluded_roles
-                        print(f"  ✓ DB에서 제외 역할 데이터 직접 로드 성공: {len(excluded_roles)}개")
-                    else:
-                        print(f"  - DB에도 제외 역할 데이터 없음")
-                else:
-                    print(f"  ✅ 제외 역할 데이터 메모리에 있음: {len(server_excluded_roles[guild_id])}개")
-                
-                # 채팅 카운트 데이터 확인 및 로드 (on_message에서도 처리하지만, 시작 시점에도 확인)
-                if guild_id not in server_chat_counts or not server_chat_counts[guild_id]:
-                    print(f"  채팅 카운트 데이터 메모리에 없음, DB에서 직접 로드 시도...")
-                    guild_chat_counts = db.get_guild_chat_counts(guild_id)
-                    if guild_chat_counts:
-                        server_chat_counts[guild_id] = Counter(guild_chat_counts)
-                        print(f"  ✓ DB에서 채팅 카운트 직접 로드 성공: {len(guild_chat_counts)}개 항목")
-                    else:
-                        server_chat_counts[guild_id] = Counter() # 데이터 없으면 빈 카운터
-                        print(f"  - DB에도 채팅 카운트 데이터 없음, 빈 카운터 생성")
-                else:
-                     print(f"  ✅ 채팅 카운트 데이터 메모리에 있음: {len(server_chat_counts[guild_id])}개 항목")
+        # 채팅 카운트 플러시 루프 및 메시지 저장 루프 시작
+        chat_count_buffer.start()
+        message_ingest_queue.start()
+        guild_cache.start()
+        state_snapshotter.start()
+        if db.is_mongo_configured():
+            mongo_health_monitor.start(db.is_mongo_connected())
+            aggregate_scheduler.start()
 
+        # 시간별 채팅 집계가 쌓이기 시작한 시각 기록 (처음 실행 시 한 번만)
+        if db.is_mongo_connected():
+            try:
+                await adb.mark_hourly_rollups_live()
+            except Exception as e:
+                print(f"⚠️ 시간별 집계 시작 시각 기록 실패: {e}")
 
-        # 최종 로드 결과 확인
-        print("\n==== 데이터 로드 결과 ====")
-        print(f"역할 설정 서버: {len(server_roles)}개")
-        print(f"제외 역할 서버: {len(server_excluded_roles)}개")
-        print(f"채팅 카운트 서버: {len(server_chat_counts)}개")
-        print("=========================\n")
+        game_activity = disnake.Game(name="www.mofucat.jp")
+        await bot.change_presence(activity=game_activity)
 
     except Exception as e:
         print(f"Error in on_ready: {e}")
@@ -302,8 +615,11 @@ async def on_guild_join(guild):
     if db.is_mongo_connected():
         print(f"서버 데이터 로드: {guild.name} (ID: {guild.id})")
         try:
+            # 서버 설정 문서 하나로 역할/제외 역할을 함께 로드
+            config = await adb.get_guild_config(guild.id)
+
             # 해당 서버의 역할 데이터 로드 (기존에 메모리에 있어도 갱신)
-            role_data = db.get_guild_role_data(guild.id)
+            role_data = db.role_data_from_config(config)
             if role_data:
                 server_roles[guild.id] = role_data
                 print(f"✓ 서버 {guild.id}({guild.name})의 역할 데이터 로드 완료: {role_data}")
@@ -311,7 +627,7 @@ async def on_guild_join(guild):
                 print(f"- 서버 {guild.id}({guild.name})의 역할 데이터 없음")
 
             # 제외 역할 데이터 로드 (기존에 메모리에 있어도 갱신)
-            excluded_roles = db.get_guild_excluded_roles(guild.id)
+            excluded_roles = db.excluded_roles_from_config(config)
             if excluded_roles:
                 server_excluded_roles[guild.id] = excluded_roles
                 print(f"✓ 서버 {guild.id}({guild.name})의 제외 역할 데이터 로드 완료: {len(excluded_roles)}개")
@@ -322,10 +638,43 @@ async def on_guild_join(guild):
             import traceback
             traceback.print_exc()
 
+# 제외 멤버 집합 갱신 (다른 모듈의 같은 이벤트 처리기를 덮어쓰지 않도록 listen 사용)
+@bot.listen("on_member_update")
+async def update_excluded_member(before, after):
+    if before.roles != after.roles:
+        excluded_member_index.update_member(after)
+
+@bot.listen("on_member_join")
+async def add_excluded_member(member):
+    excluded_member_index.update_member(member)
+
+@bot.listen("on_member_remove")
+async def remove_excluded_member(member):
+    excluded_member_index.remove_member(member)
+
+@bot.listen("on_guild_role_delete")
+async def rebuild_excluded_members(role):
+    # 역할이 삭제되면 멤버 역할 변경 이벤트가 오지 않으므로 제외 역할이었으면 다시 만듦
+    if role.id in (server_excluded_roles.get(role.guild.id) or []):
+        excluded_member_index.rebuild(role.guild)
+
+@bot.listen("on_guild_remove")
+async def discard_excluded_members(guild):
+    excluded_member_index.discard_guild(guild.id)
+
 @bot.event
 async def on_message(message):
     # 봇 메시지 무시
-    if message.author.bot or not message.guild:
+    if message.author.bot:
+        return
+
+    # 텍스트 명령어 확인 (일반 채팅은 접두사만 확인하고 바로 넘어감)
+    route, args = message_router.match(message.content)
+
+    # DM은 서버 밖에서도 허용된 명령어(!list)만 처리
+    if not message.guild:
+        if route is not None and not route.guild_only:
+            await route.handler(message, args)
         return
 
     # 포럼 채널 메시지 무시 (추가된 부분)
@@ -340,64 +689,13 @@ async def on_message(message):
             print(f"[채팅] 포럼 쓰레드 메시지 무시: 서버 {message.guild.id}, 채널 {message.channel.name}, 사용자 {message.author.name}")
             return
 
-    # !list 명령어는 항상 허용 (auth.py에서 처리)
-    if message.content.lower().startswith('!list'):
-        return
-
-    # !테놀 명령어 처리 추가
-    if message.content.lower().startswith('!테놀 '):
-        # 검색어 추출
-        search_query = message.content[4:].trip()
-        if not search_query:
-            await message.reply("검색어를 입력하는 것이다! 예: `!테놀 고양이`")
-            return
-            
-        # 서버 인증 확인
-        from commands.auth import is_guild_authorized
-        if not is_guild_authorized(message.guild.id):
-            await message.reply("❌ 이 서버에서는 이 명령어를 사용할 수 없는 것이다.")
-            return
-        
-        # tenor.py의 함수 호출
-        from commands.tenor import process_tenor_command
-        try:
-            await process_tenor_command(message, search_query, is_slash_command=False)
-        except Exception as e:
-            print(f"!테놀 명령어 처리 중 오류 발생: {e}")
-            import traceback
-            traceback.print_exc()
-            await message.reply(f"❌ GIF 검색 중 오류가 발생한 것이다: {str(e)}")
-        return
-
-    # !집계 명령어 처리 추가
-    if message.content.strip().lower() == "!집계":
-        # 관리자 권한 확인
-        if not message.author.guild_permissions.administrator:
-            await message.channel.send("❌ 관리자만 사용할 수 있는 명령어인 것이다.")
-            return
-        
-        # 집계 명령어 실행
-        await process_text_aggregate_command(message)
-        return
-
-    # !갱신 명령어 처리 추가
-    if message.content.strip().lower() == "!갱신":
-        # 관리자 권한 확인 (원하는 경우)
-        # if not message.author.guild_permissions.administrator:
-        #     await message.channel.send("❌ 관리자만 사용할 수 있는 명령어인 것이다.")
-        #     return
-
-        from database import save_guild_info
-        success = save_guild_info(message.guild)
-        if success:
-            await message.channel.send("✅ 서버 정보를 성공적으로 DB에 저장한 것이다!", delete_after=5)
-        else:
-            await message.channel.send("❌ 정보를 저장하지 못한 것이다. 관리자에게 문의하는 것이다!", delete_after=5)
+    # 등록된 텍스트 명령어 처리 (명령어 메시지는 채팅 카운트에 포함하지 않음)
+    if route is not None:
+        await route.handler(message, args)
         return
 
     # 서버 인증 확인
-    from commands.auth import is_guild_authorized
-    if not is_guild_authorized(message.guild.id):
+    if not await is_guild_authorized(message.guild.id):
         # 인증되지 않은 서버는 메시지 처리 중단
         return
 
@@ -405,43 +703,73 @@ async def on_message(message):
     guild_id = message.guild.id
     user_id = message.author.id
 
-    if guild_id not in server_chat_counts:
-        # 서버 데이터가 메모리에 없으면 DB에서 로드 시도 (추가된 부분)
-        if db.is_mongo_connected():
-            try:
-                guild_chat_counts = db.get_guild_chat_counts(guild_id)
-                if guild_chat_counts:
-                    server_chat_counts[guild_id] = Counter(guild_chat_counts)
-                    print(f"[on_message] 서버 {guild_id}의 채팅 카운트 로드: {len(guild_chat_counts)}개 항목")
-                else:
-                    server_chat_counts[guild_id] = Counter()
-                    print(f"[on_message] 서버 {guild_id}에 채팅 데이터 없음, 새 카운터 생성")
-            except Exception as e:
-                print(f"[on_message] 서버 {guild_id} 채팅 카운트 로드 실패: {e}")
-                server_chat_counts[guild_id] = Counter()
-        else:
-            server_chat_counts[guild_id] = Counter()
+    # 서버 데이터가 메모리에 없으면 DB에서 로드 (내려간 서버도 여기서 다시 로드됨)
+    await ensure_guild_state(guild_id)
+
+    # 처음 보는 사용자로 서버 규모가 기준을 넘으면 배열 기반 카운터로 전환
+    chat_counts = server_chat_counts[guild_id]
+    if user_id not in chat_counts:
+        chat_counts = server_chat_counts[guild_id] = compact_if_large(chat_counts)
 
     # 채팅 카운트 증가
-    server_chat_counts[guild_id][user_id] += 1
+    chat_counts[user_id] += 1
 
-    # MongoDB에만 저장 (로깅 추가)
-    if db.is_mongo_connected():
-        count = server_chat_counts[guild_id][user_id]
-        save_result = db.save_chat_count(guild_id, user_id, count)
+    # MongoDB에 저장 (메시지는 수집 큐로 일괄 업서트, 새로 저장된 메시지만 쓰기 지연 버퍼를 거쳐 채팅 카운트에 반영)
+    # 연결이 끊긴 동안에도 버퍼/큐에 보관했다가 복구 후 저장
+    if db.is_mongo_configured():
+        count = chat_counts[user_id]
 
         # 100의 배수마다 로그 출력 (너무 많은 로그 방지)
         if count % 100 == 0:
             print(f"[채팅] 서버 {guild_id}, 사용자 {user_id}의 채팅 카운트: {count}회")
 
-        # 메시지도 MongoDB에 저장
-        db.save_message(guild_id, user_id, message.id, message.created_at)
-    else:
-        print("⚠️ MongoDB에 연결되지 않아 데이터를 저장할 수 없습니다")
+        if ingest_wal.enabled:
+            await _ingest_with_wal(guild_id, user_id, message)
+        else:
+            await message_ingest_queue.put_message(guild_id, user_id, message.id, message.created_at)
 
     # 메시지 보낸 사용자의 정보 업데이트 (봇이 아닐 경우)
     if not message.author.bot and db.is_mongo_connected():
-        db.save_user_data(message.author, guild_id)
+        await adb.save_user_data(message.author, guild_id)
+
+async def _ingest_with_wal(guild_id, user_id, message):
+    """수집 로그에 먼저 기록한 뒤 메시지 큐에 넣습니다"""
+    lsn = ingest_wal.append(guild_id, user_id, message.id, message.created_at)
+    if ingest_wal.spilling:
+        # 재생 모드에서는 로그에만 기록 (재생 루프가 DB에 반영)
+        return
+
+    # 큐가 받지 못하면 이 기록부터 로그에서 재생 (채팅 카운트는 큐가 메시지를 저장한 뒤 버퍼에 더함)
+    if message_ingest_queue.has_room():
+        await message_ingest_queue.put_message(guild_id, user_id, message.id, message.created_at, lsn=lsn)
+    else:
+        ingest_wal.start_spill(lsn)
+
+# !집계 텍스트 명령어
+@message_router.command("!집계", exact=True)
+async def text_aggregate_command(message, args):
+    # 관리자 권한 확인
+    if not message.author.guild_permissions.administrator:
+        await message.channel.send("❌ 관리자만 사용할 수 있는 명령어인 것이다.")
+        return
+    
+    # 집계 명령어 실행
+    await process_text_aggregate_command(message)
+
+# !갱신 텍스트 명령어
+@message_router.command("!갱신", exact=True)
+async def text_update_command(message, args):
+    # 관리자 권한 확인 (원하는 경우)
+    # if not message.author.guild_permissions.administrator:
+    #     await message.channel.send("❌ 관리자만 사용할 수 있는 명령어인 것이다.")
+    #     return
+
+    member_ids = [uid for uid, cnt in server_chat_counts.get(message.guild.id, {}).items() if cnt > 0]
+    success = await adb.save_guild_info(message.guild, member_ids)
+    if success:
+        await message.channel.send("✅ 서버 정보를 성공적으로 DB에 저장한 것이다!", delete_after=5)
+    else:
+        await message.channel.send("❌ 정보를 저장하지 못한 것이다. 관리자에게 문의하는 것이다!", delete_after=5)
 
 # !집계 명령어를 처리하는 함수 수정
 async def process_text_aggregate_command(message):
@@ -458,23 +786,16 @@ async def process_text_aggregate_command(message):
     progress_msg = await message.channel.send("집계를 시작하는 것이다... ⏳")
     
     try:
-        # 서버 채팅 카운트 데이터 확인
-        if guild_id not in server_chat_counts or not server_chat_counts[guild_id]:
-            # 데이터가 없으면 DB에서 로드 시도
-            if db.is_mongo_connected():
-                guild_chat_counts = db.get_guild_chat_counts(guild_id)
-                if guild_chat_counts:
-                    server_chat_counts[guild_id] = Counter(guild_chat_counts)
-                    print(f"[!집계] 서버 {guild_id}의 채팅 카운트 로드: {len(guild_chat_counts)}개 항목")
-                else:
-                    await progress_msg.edit(content="❌ 채팅 기록이 없어 집계할 수 없는 것이다. (E002)")
-                    return
-            else:
-                await progress_msg.edit(content="❌ 데이터베이스에 연결되어 있지 않은 것이다. (E003)")
-                return
-                
+        # 서버 상태(채팅 카운트, 역할, 제외 역할)가 메모리에 없으면 불러옴 (캐시에서 내려간 서버 포함)
+        await ensure_guild_state(guild_id)
+
+        # DB에서 불러오지 못해 빈 상태로 올라온 서버는 채팅 카운트가 DB와 다르므로 집계하지 않음 (다시 로드 시도)
+        if guild_id in _degraded_guilds:
+            await progress_msg.edit(content="❌ 서버 데이터를 아직 불러오지 못해 집계할 수 없는 것이다. 잠시 후 다시 시도하는 것이다. (E020)")
+            return
+
         # 채팅 데이터 확인
-        if not server_chat_counts[guild_id]:
+        if not server_chat_counts.get(guild_id):
             await progress_msg.edit(content="❌ 집계할 채팅 데이터가 없는 것이다. (E004)")
             return
             
@@ -483,18 +804,10 @@ async def process_text_aggregate_command(message):
             
         # 리더보드의 데이터를 사용하여 직접 집계 처리
         try:
-            # 역할 설정 확인
+            # 역할 설정 확인 (ensure_guild_state가 DB의 설정을 불러옴)
             if guild_id not in server_roles:
-                if db.is_mongo_connected():
-                    role_data = db.get_guild_role_data(guild_id)
-                    if role_data:
-                        server_roles[guild_id] = role_data
-                    else:
-                        await progress_msg.edit(content="❌ 역할이 설정되지 않았습니다. `/역할설정` 명령어를 사용하는 것이다. (E005)")
-                        return
-                else:
-                    await progress_msg.edit(content="❌ 역할 설정을 확인할 수 없는 것이다. (E006)")
-                    return
+                await progress_msg.edit(content="❌ 역할이 설정되지 않았습니다. `/역할설정` 명령어를 사용하는 것이다. (E005)")
+                return
             
             # 역할 객체 가져오기
             first_role = disnake.utils.get(message.guild.roles, id=server_roles[guild_id]["first"])
@@ -505,139 +818,55 @@ async def process_text_aggregate_command(message):
                 return
                 
             # 제외 역할 적용
-            excluded_roles = server_excluded_roles.get(guild_id, [])
-            excluded_members = {member.id for member in message.guild.members
-                              if any(role.id in excluded_roles for role in member.roles)}
+            excluded_members = excluded_member_index.get(message.guild)
             
-            # 채팅 카운트에서 상위 6명 가져오기
+            # 채팅 카운트에서 상위 6명 가져오기 (순위가 유지되므로 앞에서부터 6명만 확인)
             chat_counts = server_chat_counts[guild_id]
-            top_chatters = [(user_id, count) for user_id, count in chat_counts.most_common()
-                          if user_id not in excluded_members][:6]
-                          
-            # 순위권 사용자 목록 (ID만 추출)
-            top_user_ids = [user_id for user_id, _ in top_chatters]
-            
-            # 기존에 역할이 있었지만 이번에 순위권에서 벗어난 사용자들의 연속 기록 초기화
-            for member in message.guild.members:
-                if (first_role in member.roles or other_role in member.roles) and member.id not in top_user_ids:
-                    # 순위권 밖으로 떨어진 사용자의 연속 기록 초기화
-                    reset_user_role_streak(guild_id, member.id)
-                    print(f"[!집계] 사용자 {member.id}({member.display_name})의 연속 기록 초기화 (순위권 제외)")
-                          
-            # 아무도 없으면 에러 메시지
-            if not top_chatters:
-                await progress_msg.edit(content="❌ 집계할 수 있는 사용자가 없는 것이다. (E008)")
-                return
-                
-            await progress_msg.edit(content="역할을 배분하는 것이다... ⏳")
-                
-            # 1. 기존 역할 제거
-            try:
-                for member in message.guild.members:
-                    if first_role in member.roles or other_role in member.roles:
-                        await member.remove_roles(first_role, other_role)
-            except disnake.Forbidden:
-                await progress_msg.edit(content="❌ 역할을 제거할 권한이 없는 것이다. (E009)")
-                return
-            except Exception as e:
-                await progress_msg.edit(content=f"❌ 역할 제거 중 오류: {e} (E010)")
-                return
-            
-            # 2. 1등 역할 원래 색상으로 복원
-            try:
-                from commands.role_color import restore_role_original_color
-                original_color = restore_role_original_color(message.guild, first_role)
-                if original_color:
-                    await first_role.edit(color=disnake.Color(original_color))
-            except disnake.Forbidden:
-                await progress_msg.edit(content="❌ 역할 색상을 변경할 권한이 없는 것이다! (E011)")
-                return
-            except Exception as e:
-                await progress_msg.edit(content=f"❌ 역할 색상 변경 중 오류: {e} (E012)")
-                return
-            
-            # 3. 새 역할 부여
-            try:
-                for index, (user_id, _) in enumerate(top_chatters):
-                    member = message.guild.get_member(user_id)
-                    if member:
-                        if index == 0:  # 1등만
-                            await member.add_roles(first_role)
-                            role_type = "first"
-                        else:  # 2-6등
-                            await member.add_roles(other_role)
-                            role_type = "other"
-                        update_role_streak(guild_id, user_id, role_type)
-            except disnake.Forbidden:
-                await progress_msg.edit(content="❌ 역할을 부여할 권한이 없는 것이다! (E013)")
-                return
-            except Exception as e:
-                await progress_msg.edit(content=f"❌ 역할 부여 중 오류: {e} (E014)")
-                return
-            
-            # 4. 이미지 생성 및 전송
-            await progress_msg.edit(content="결과 이미지를 생성 중인 것이다... ⏳")
-            
-            # 시작날짜와 종료날짜는 현재 시간으로 (의미 없음)
-            import pytz  # 이 줄도 추가하면 더 안전함
-            kst = pytz.timezone('Asia/Seoul')
-            now = datetime.now(kst)
-            now_utc = datetime.now(pytz.UTC)  # UTC 시간 추가
-            
-            # 이미지 생성 (aggregate.py의 함수 호출)
-            try:
-                from commands.aggregate import create_ranking_image
-                image = await create_ranking_image(
-                    message.guild,
-                    top_chatters,
-                    first_role,
-                    other_role,
-                    start_date=now,  # 현재 시간
-                    end_date=now     # 현재 시간
-                )
-            except Exception as e:
-                await progress_msg.edit(content=f"❌ 이미지 생성 중 오류: {e} (E015)")
-                return
-            
-            if image:
+            top_chatters = []
+            for user_id, count in chat_counts.ranked():
+                if user_id not in excluded_members:
+                    top_chatters.append((user_id, count))
+                    if len(top_chatters) == 6:
+                        break
+
+            async def report_status(content):
+                await progress_msg.edit(content=content)
+
+            # 집계 작업으로 실행 (역할 색상 복원 → 역할 변경 → 연속 기록 → 이미지 → 채팅 카운트 초기화 → 기록,
+            # 단계별로 DB에 기록되므로 중간에 멈춰도 재시작 후 이어서 끝냄)
+            # 집계할 사용자가 없어도 작업으로 실행해 임대 안에서 no_candidates로 끝냄 (다른 집계와 겹치지 않음)
+            # 시작날짜와 종료날짜는 현재 시간으로 (리더보드 기준이므로 의미 없음)
+            from commands.aggregate import run_period_aggregation
+            now_utc = datetime.now(pytz.UTC)
+            result = await run_period_aggregation(message.guild, now_utc, now_utc, report_status, trigger="text",
+                                                  channel_id=message.channel.id, top_chatters=top_chatters)
+
+            if result["status"] == "ok":
                 # 이미지 전송
                 try:
                     await progress_msg.delete()  # 기존 메시지 삭제
                 except:
                     pass  # 실패해도 계속 진행
-                
+
                 # 새 메시지로 이미지만 전송 (성공 메시지 제거)
                 await message.channel.send(
-                    file=disnake.File(fp=image, filename="ranking.png")
+                    file=disnake.File(fp=result["image"], filename="ranking.png")
                 )
-                
-                # 채팅 카운트 초기화
-                reset_chat_counts(guild_id)
-                
-                # 마지막 집계 시간 저장
-                save_last_aggregate_date(guild_id)
-                
-                # ===== 집계 기록 저장 코드 추가 =====
-                try:
-                    # 집계 기록 저장 (텍스트 명령어는 현재 리더보드 데이터를 기준으로 집계)
-                    db.save_aggregate_history(
-                        guild_id=guild_id,
-                        aggregate_date=now_utc,
-                        start_date=now_utc,  # !집계는 특정 기간이 없으므로 현재 시간으로
-                        end_date=now_utc,    # !집계는 특정 기간이 없으므로 현재 시간으로
-                        top_chatters=top_chatters,
-                        first_role_name=first_role.name,
-                        first_role_color=f"#{first_role.color.value:06x}",
-                        other_role_name=other_role.name,
-                        other_role_color=f"#{other_role.color.value:06x}"
-                    )
-                    print(f"[!집계] 서버 {guild_id}의 집계 기록 저장 성공")
-                except Exception as history_error:
-                    print(f"[!집계] 집계 기록 저장 중 오류 발생: {history_error}")
-                    import traceback
-                    traceback.print_exc()
-            else:
+            elif result["status"] == "busy":
+                await progress_msg.edit(content=f"{result['message']} (E019)")
+            elif result["status"] == "no_candidates":
+                await progress_msg.edit(content="❌ 집계할 수 있는 사용자가 없는 것이다. (E008)")
+            elif result["status"] == "color_error":
+                await progress_msg.edit(content="❌ 역할 색상을 변경할 권한이 없는 것이다! (E011)")
+            elif result["status"] == "role_error":
+                if isinstance(result["error"], disnake.Forbidden):
+                    await progress_msg.edit(content="❌ 역할을 변경할 권한이 없는 것이다. (E009)")
+                else:
+                    await progress_msg.edit(content=f"❌ 역할 변경 중 오류: {result['error']} (E010)")
+            elif result["status"] == "image_error":
                 await progress_msg.edit(content="❌ 이미지 생성에 실패한 것이다... (E016)")
+            else:
+                await progress_msg.edit(content=f"{result['message']} (E017)")
                 
         except Exception as e:
             print(f"!집계 명령어 처리 중 오류 발생: {e}")
@@ -668,6 +897,7 @@ import commands.role_set
 import commands.role_exclude
 import commands.leaderboard
 import commands.aggregate
+import commands.aggregate_schedule
 import commands.reset_streak
 import commands.omikuji
 import commands.role_color
@@ -676,6 +906,9 @@ import commands.manual
 import commands.tenor
 import commands.admin_leaderboard
 
+# on_message에서 사용하는 인증 확인 함수 (메시지마다 임포트하지 않도록 미리 가져옴)
+from commands.auth import is_guild_authorized
+
 # 봇 실행
 if TOKEN:
     masked_token = TOKEN[:4] + '*' * (len(TOKEN) - 8) + TOKEN[-4:]
@@ -0,0 +1,63 @@
+import os
+import sys
+
+import pymongo
+from dotenv import load_dotenv
+
+from db_schema import ensure_indexes, print_index_report, find_unused_indexes, explain_hot_queries
+
+# 사용법: python check_indexes.py
+# 선언된 인덱스(db_schema.INDEX_SPECS)가 있는지, 사용되지 않는 인덱스가 있는지,
+# 주요 조회가 인덱스를 타는지(COLLSCAN이 아닌지) 확인합니다.
+# 없는 인덱스는 봇 시작 시(database.connect) 자동으로 만들어지므로, 여기서는 database 모듈을 불러오지 않고
+# 직접 연결하여 만들지 않고 확인만 합니다.
+# 문제가 있으면 종료 코드 1을 반환합니다.
+
+def check_indexes():
+    load_dotenv()
+    mongo_uri = os.getenv("MONGODB_URI")
+    if not mongo_uri:
+        print("❌ MONGODB_URI가 설정되지 않았습니다.")
+        return False
+
+    client = pymongo.MongoClient(mongo_uri, serverSelectionTimeoutMS=5000)
+    try:
+        client.server_info()
+    except Exception as e:
+        print(f"❌ MongoDB에 연결되지 않았습니다: {e}")
+        client.close()
+        return False
+
+    try:
+        return _check(client.chatzipbot)
+    finally:
+        client.close()
+
+def _check(database):
+    ok = True
+
+    print("\n==== 선언된 인덱스 확인 ====")
+    report = ensure_indexes(database, create=False)
+    print_index_report(report)
+    if report["missing"] or report["failed"]:
+        ok = False
+
+    print("\n==== 사용되지 않는 인덱스 ($indexStats) ====")
+    unused = find_unused_indexes(database)
+    for collection_name, name, ops, reason in unused:
+        print(f"- {collection_name}.{name}: {reason} (사용 {ops}회)")
+    if not unused:
+        print("없음")
+
+    print("\n==== 주요 조회 실행 계획 (explain) ====")
+    for description, collection_name, uses_index, stages in explain_hot_queries(database):
+        mark = "✅" if uses_index else "❌"
+        print(f"{mark} {description} ({collection_name}): {' <- '.join(stages)}")
+        if not uses_index:
+            ok = False
+
+    print("\n모든 확인 통과" if ok else "\n⚠️ 확인이 필요한 항목이 있습니다")
+    return ok
+
+if __name__ == "__main__":
+    sys.exit(0 if check_indexes() else 1)
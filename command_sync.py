@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import time
+
+import async_database as adb
+import database as db
+
+# 슬래시 명령어 동기화 설정 (환경 변수로 조정 가능)
+COMMAND_MANIFEST_FILE = os.getenv("COMMAND_MANIFEST_FILE", ".command_manifest.json")  # MongoDB가 없을 때 해시를 저장할 파일
+FORCE_COMMAND_SYNC = os.getenv("FORCE_COMMAND_SYNC", "false").lower() == "true"  # 해시와 관계없이 항상 동기화
+
+# 동기화 통계 (마지막 실행 기준)
+command_sync_stats = {
+    "synced": False,
+    "skipped": 0,
+    "last_sync_ms": None,
+    "command_count": 0,
+    "hash": None,
+}
+_synced_hash = None  # 이 프로세스에서 이미 동기화(또는 확인)한 해시, 재연결 시 DB도 조회하지 않음
+
+
+def command_manifest(bot):
+    """등록된 슬래시 명령어 정의를 이름순 목록으로 반환합니다"""
+    return sorted((command.body.to_dict() for command in bot.application_commands),
+                  key=lambda body: (body.get("type", 1), body["name"]))
+
+
+def manifest_hash(manifest):
+    """명령어 정의 목록의 SHA-256 해시를 반환합니다 (키 순서와 관계없이 같은 정의면 같은 값)"""
+    encoded = json.dumps(manifest, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _meta_id(bot):
+    # 개발용/운영용 봇이 같은 DB를 써도 애플리케이션별로 따로 저장
+    return f"command_manifest:{bot.application_id}"
+
+
+async def _load_stored_hash(bot):
+    if db.is_mongo_connected():
+        doc = await adb.get_bot_meta(_meta_id(bot))
+        return doc.get("hash") if doc else None
+
+    try:
+        with open(COMMAND_MANIFEST_FILE, "r", encoding="utf-8") as f:
+            return json.load(f).get(str(bot.application_id))
+    except (OSError, ValueError):
+        return None
+
+
+async def _store_hash(bot, digest, manifest):
+    if db.is_mongo_connected():
+        await adb.set_bot_meta(_meta_id(bot), {
+            "hash": digest,
+            "command_names": [body["name"] for body in manifest],
+        })
+        return
+
+    try:
+        with open(COMMAND_MANIFEST_FILE, "r", encoding="utf-8") as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        stored = {}
+    stored[str(bot.application_id)] = digest
+    with open(COMMAND_MANIFEST_FILE, "w", encoding="utf-8") as f:
+        json.dump(stored, f, ensure_ascii=False, indent=2)
+
+
+async def sync_commands_if_changed(bot):
+    """명령어 정의가 마지막 동기화 이후 바뀌었을 때만 전역 슬래시 명령어를 덮어씁니다. 동기화했으면 True"""
+    global _synced_hash
+
+    manifest = command_manifest(bot)
+    digest = manifest_hash(manifest)
+    command_sync_stats["command_count"] = len(manifest)
+    command_sync_stats["hash"] = digest
+
+    if not FORCE_COMMAND_SYNC:
+        stored = _synced_hash
+        if stored is None:
+            try:
+                stored = await _load_stored_hash(bot)
+            except Exception as e:
+                print(f"⚠️ [명령어 동기화] 저장된 해시 조회 실패, 동기화 진행: {e}")
+        if stored == digest:
+            _synced_hash = digest
+            command_sync_stats["synced"] = False
+            command_sync_stats["skipped"] += 1
+            print(f"[명령어 동기화] 변경 없음, 건너뜀: {len(manifest)}개 명령어 (해시 {digest[:12]})")
+            return False
+
+    started = time.perf_counter()
+    synced = await bot.bulk_overwrite_global_commands([command.body for command in bot.application_commands])
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+
+    command_sync_stats["synced"] = True
+    command_sync_stats["last_sync_ms"] = elapsed_ms
+    print(f"[명령어 동기화] 완료: {len(synced)}개 명령어 등록, {elapsed_ms}ms (해시 {digest[:12]})")
+
+    _synced_hash = digest
+    try:
+        await _store_hash(bot, digest, manifest)
+    except Exception as e:
+        print(f"⚠️ [명령어 동기화] 해시 저장 실패 (다음 시작 시 다시 동기화): {e}")
+    return True
@@ -1,10 +1,11 @@
 from disnake.ext import commands
 import disnake
 from disnake.ui import Button, View
-from bot import bot, server_chat_counts, server_excluded_roles
+from bot import bot, server_chat_counts, server_excluded_roles, excluded_member_index
 import database as db
+import async_database as adb
 import pytz
-from collections import Counter
+from compact_counter import make_chat_counter
 
 class AdminLeaderboardView(View):
     def __init__(self, author_id, guild_id, current_page=1):
@@ -14,15 +15,12 @@ class AdminLeaderboardView(View):
         self.author_id = author_id  # 명령어 사용자 ID 저장
         self.chat_counts = server_chat_counts[self.guild_id]
         
-        # 모든 사용자의 채팅 데이터 로드 (필터링은 update_page에서)
-        sorted_chatters = sorted(self.chat_counts.items(), key=lambda x: x[1], reverse=True)
-        
-        # 페이지당 25명으로 설정
+        # 페이지당 25명으로 설정 (필터링은 update_page에서)
         self.items_per_page = 25
         self.max_page = 1  # 초기값, update_page에서 다시 계산
         
-        # 명령어 사용자의 순위 찾기
-        self.user_rank = next((i + 1 for i, (uid, _) in enumerate(sorted_chatters) if uid == author_id), None)
+        # 명령어 사용자의 순위 찾기 (채팅 카운터가 순위를 제공하므로 정렬 불필요)
+        self.user_rank = self.chat_counts.rank_of(author_id)
         if self.user_rank:
             self.user_page = (self.user_rank - 1) // self.items_per_page + 1
         else:
@@ -43,18 +41,17 @@ class AdminLeaderboardView(View):
         # 제외된 역할을 가진 사용자들만 필터링
         excluded_members_data = []
         
-        for user_id, count in chat_counts.items():
-            member = inter.guild.get_member(user_id)
-            if member and any(role.id in excluded_roles for role in member.roles):
+        # 순위 순서대로 확인하므로 따로 정렬할 필요 없음 (제외 여부는 집합 조회)
+        excluded_members = excluded_member_index.get(inter.guild)
+        for user_id, count in chat_counts.ranked():
+            member = inter.guild.get_member(user_id) if user_id in excluded_members else None
+            if member:
                 excluded_members_data.append((user_id, count))
                 
                 # 디버깅: 제외된 사용자 정보
                 role_names = [role.name for role in member.roles if role.id in excluded_roles]
                 print(f"[관리자리더보드] 제외된 사용자: {member.display_name}, 채팅 수: {count}, 역할: {role_names}")
         
-        # 채팅 수 기준으로 정렬
-        excluded_members_data.sort(key=lambda x: x[1], reverse=True)
-        
         # 전체 제외된 사용자 수
         total_excluded = len(excluded_members_data)
         
@@ -123,7 +120,7 @@ class AdminLeaderboardView(View):
         # 마지막 집계 날짜 표시
         last_aggregate_date = None
         if db.is_mongo_connected():
-            last_aggregate_date = db.get_last_aggregate_date(self.guild_id)
+            last_aggregate_date = await adb.get_last_aggregate_date(self.guild_id)
         
         if last_aggregate_date:
             kst = pytz.timezone('Asia/Seoul')
@@ -176,18 +173,11 @@ class AdminLeaderboardView(View):
             await inter.response.send_message("다른 사람의 리더보드 버튼은 조작할 수 없는 것이다!", ephemeral=True)
             return
         
-        # 제외된 역할을 가진 사용자만 필터링
-        excluded_roles = server_excluded_roles.get(self.guild_id, [])
-        excluded_members_data = []
-        
-        for user_id, count in self.chat_counts.items():
-            member = inter.guild.get_member(user_id)
-            if member and any(role.id in excluded_roles for role in member.roles):
-                excluded_members_data.append((user_id, count))
+        # 제외된 역할을 가진 사용자만 필터링 (순위 순서대로 확인하므로 따로 정렬할 필요 없음)
+        excluded_members = excluded_member_index.get(inter.guild)
+        excluded_members_data = [(user_id, count) for user_id, count in self.chat_counts.ranked()
+                                 if user_id in excluded_members]
                 
-        # 채팅 수 기준으로 정렬
-        excluded_members_data.sort(key=lambda x: x[1], reverse=True)
-        
         # 사용자 위치 찾기
         user_index = next((i for i, (uid, _) in enumerate(excluded_members_data) if uid == inter.author.id), None)
         
@@ -204,15 +194,8 @@ def is_admin_or_excluded(inter):
     if inter.author.guild_permissions.administrator:
         return True
         
-    # 제외된 역할 목록
-    excluded_roles = server_excluded_roles.get(inter.guild.id, [])
-    
     # 사용자가 제외된 역할을 가지고 있는지 확인
-    for role in inter.author.roles:
-        if role.id in excluded_roles:
-            return True
-            
-    return False
+    return inter.author.id in excluded_member_index.get(inter.guild)
 
 @bot.slash_command(
     name="리더보드관리자", 
@@ -237,10 +220,10 @@ async def 리더보드관리자(inter: disnake.ApplicationCommandInteraction):
         try:
             # DB에서 채팅 데이터 로드 시도
             if db.is_mongo_connected():
-                guild_chat_counts = db.get_guild_chat_counts(guild_id)
+                guild_chat_counts = await adb.get_guild_chat_counts(guild_id)
                 
                 if guild_chat_counts:
-                    server_chat_counts[guild_id] = Counter(guild_chat_counts)
+                    server_chat_counts[guild_id] = make_chat_counter(guild_chat_counts)
                     print(f"[관리자리더보드] 서버 {guild_id}의 채팅 데이터 로드: {len(guild_chat_counts)}개")
                 else:
                     await inter.response.send_message(
@@ -270,15 +253,7 @@ async def 리더보드관리자(inter: disnake.ApplicationCommandInteraction):
         return
     
     # 제외된 역할을 가진 사용자가 있는지 확인
-    excluded_roles = server_excluded_roles[guild_id]
-    has_excluded_members = False
-    
-    for member in inter.guild.members:
-        if any(role.id in excluded_roles for role in member.roles):
-            has_excluded_members = True
-            break
-    
-    if not has_excluded_members:
+    if not excluded_member_index.get(inter.guild):
         await inter.response.send_message(
             "❌ 제외된 역할을 가진 사용자가 서버에 없는 것이다!", 
             ephemeral=True
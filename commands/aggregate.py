@@ -1,18 +1,21 @@
 from disnake.ext import commands
 import disnake
 import asyncio
+import time
 from PIL import Image, ImageDraw, ImageFont, ImageOps
 import io
 import datetime
 import pytz
-from collections import Counter
-from bot import bot, server_roles, server_excluded_roles, get_messages_in_period, save_last_aggregate_date, update_role_streak, get_role_streak, reset_chat_counts, server_chat_counts
+from bot import bot, server_roles, ensure_guild_state, get_top_chatters_in_period, save_last_aggregate_date, update_ranking_streaks, reset_chat_counts, role_assigner, excluded_member_index, aggregate_scheduler, aggregate_jobs
+from role_assigner import plan_role_changes, describe_plan
+from aggregate_jobs import AggregateJobLeaseLost
 import random
 import math
 from commands.role_color import restore_role_original_color
 import os
 import sys
 import database as db
+import async_database as adb
 
 # 여러 환경에서 작동하는 경로 탐색 로직
 def find_resource_dir():
@@ -54,7 +57,7 @@ print(f"Python 모듈 경로: {sys.path}")
 
 @bot.slash_command(name="집계", description="서버에서 가장 채팅을 많이 친 6명을 집계하는 것이다.")
 @commands.has_permissions(administrator=True)
-async def 집계(inter: disnake.ApplicationCommandInteraction, start_date: str, end_date: str):
+async def 집계(inter: disnake.ApplicationCommandInteraction, start_date: str, end_date: str, dry_run: bool = False):
     try:
         # 초기 응답 지연 (15초 타임아웃)
         await inter.response.defer(ephemeral=False, with_message=True)
@@ -91,117 +94,34 @@ async def 집계(inter: disnake.ApplicationCommandInteraction, start_date: str,
             )
             return
 
-        # 진행 상황 알림
-        await inter.edit_original_response(content="메시지를 조회 중인 것이다... ⏳")
+        async def report_status(content):
+            await inter.edit_original_response(content=content)
 
-        # 메시지 조회
-        messages = get_messages_in_period(guild_id, start_date_utc, end_date_utc)
-        if not messages:
+        result = await run_period_aggregation(inter.guild, start_date_utc, end_date_utc, report_status,
+                                              trigger="command", dry_run=dry_run, channel_id=inter.channel.id)
+
+        if result["status"] == "no_data":
             await inter.edit_original_response(
                 content=f"❌ 이 기간 동안 채팅 데이터가 없는 것이다.\n"
                 f"검색 기간: {start_date.strftime('%Y-%m-%d %H:%M')} ~ {end_date.strftime('%Y-%m-%d %H:%M')}"
             )
-            return
-
-        # 채팅 카운트 계산
-        chat_counts = Counter(msg['user_id'] for msg in messages)
-        excluded_roles = server_excluded_roles.get(guild_id, [])
-        excluded_members = {member.id for member in inter.guild.members
-                            if any(role.id in excluded_roles for role in member.roles)}
-        
-        top_chatters = [(user_id, count) for user_id, count in chat_counts.most_common()
-                        if user_id not in excluded_members][:6]
-
-        if not top_chatters:
-            await inter.edit_original_response(content="❌ 집계할 수 있는 사용자가 없는 것이다.")
-            return
-
-        # 역할 업데이트
-        first_role = disnake.utils.get(inter.guild.roles, id=server_roles[guild_id]["first"])
-        other_role = disnake.utils.get(inter.guild.roles, id=server_roles[guild_id]["other"])
-
-        if not first_role or not other_role:
-            await inter.edit_original_response(content="❌ 설정된 역할을 찾을 수 없는 것이다.")
-            return
-
-        # 순위권 사용자 목록 (ID만 추출)
-        top_user_ids = [user_id for user_id, _ in top_chatters]
-        
-        # 새로운 부분: 기존에 역할이 있었지만 이번에 순위권에서 벗어난 사용자들의 연속 기록 초기화
-        for member in inter.guild.members:
-            if (first_role in member.roles or other_role in member.roles) and member.id not in top_user_ids:
-                # 순위권 밖으로 떨어진 사용자의 연속 기록 초기화
-                from bot import reset_user_role_streak
-                reset_user_role_streak(guild_id, member.id)
-                print(f"[집계] 사용자 {member.id}({member.display_name})의 연속 기록 초기화 (순위권 제외)")
-
-        # 기존 역할 제거
-        for member in inter.guild.members:
-            if first_role in member.roles or other_role in member.roles:
-                await member.remove_roles(first_role, other_role)
-
-        # 1등 역할 원래 색상으로 복원 (추가된 부분)
-        original_color = restore_role_original_color(inter.guild, first_role)
-        if original_color:
-            await first_role.edit(color=disnake.Color(original_color))
-        
-        # 새 역할 부여 (1등만 first_role, 2-6등은 other_role)
-        for index, (user_id, _) in enumerate(top_chatters):
-            member = inter.guild.get_member(user_id)
-            if member:
-                if index == 0:  # 1등만
-                    await member.add_roles(first_role)
-                    role_type = "first"
-                else:  # 2-6등
-                    await member.add_roles(other_role)
-                    role_type = "other"
-                update_role_streak(guild_id, user_id, role_type)
-
-        # 진행 상황 알림
-        await inter.edit_original_response(content="이미지를 생성 중인 것이다... 🎨")
-
-        # 이미지 생성
-        image = await create_ranking_image(
-            inter.guild,
-            top_chatters,
-            first_role,
-            other_role,
-            start_date=start_date_utc,
-            end_date=end_date_utc
-        )
-        
-        if image:
-            # 채팅 카운트 초기화
-            reset_chat_counts(guild_id)
-            
-            # 이미지 전송 및 마지막 집계 시간 저장
+        elif result["status"] == "dry_run":
+            # 미리보기: 역할, 연속 기록, 채팅 카운트를 바꾸지 않고 계획만 보여줌
+            lines = describe_plan(result["plan"])
+            if len(lines) > 31:
+                lines = lines[:31] + [f"... 외 {len(lines) - 31}건"]
+            ranking = "\n".join(f"{index}. <@{user_id}> ({count}회)" for index, (user_id, count) in enumerate(result["top_chatters"], 1))
+            await inter.edit_original_response(
+                content=f"🔍 집계 미리보기인 것이다. (아무것도 바뀌지 않은 것이다)\n{ranking}\n```\n" + "\n".join(lines) + "\n```",
+                allowed_mentions=disnake.AllowedMentions.none()
+            )
+        elif result["status"] == "ok":
             await inter.edit_original_response(
                 content=None,
-                file=disnake.File(fp=image, filename="ranking.png")
+                file=disnake.File(fp=result["image"], filename="ranking.png")
             )
-            
-            # 현재 시간을 집계 날짜로 저장
-            now_utc = datetime.datetime.now(pytz.UTC)
-            save_last_aggregate_date(guild_id)
-            
-            # ===== 여기에 집계 기록 저장 코드 추가 =====
-            try:
-                # 집계 기록 저장
-                db.save_aggregate_history(
-                    guild_id=guild_id,
-                    aggregate_date=now_utc,
-                    start_date=start_date_utc,
-                    end_date=end_date_utc,
-                    top_chatters=top_chatters
-                )
-                print(f"[집계] 서버 {guild_id}의 집계 기록 저장 성공")
-            except Exception as history_error:
-                print(f"[집계] 집계 기록 저장 중 오류 발생: {history_error}")
-                import traceback
-                traceback.print_exc()
-            
         else:
-            await inter.edit_original_response(content="❌ 이미지 생성에 실패한 것이다...")
+            await inter.edit_original_response(content=result["message"])
 
     except disnake.errors.InteractionResponded:
         # 이미 응답된 인터랙션에 대해 추가 응답 시도 시
@@ -216,7 +136,267 @@ async def 집계(inter: disnake.ApplicationCommandInteraction, start_date: str,
         except:
             await inter.channel.send("❌ 오류가 발생한 것이다. 다시 시도하는 것이다.")
 
-async def create_ranking_image(guild, top_chatters, first_role, other_role, start_date, end_date):
+async def run_period_aggregation(guild, start_date_utc, end_date_utc, on_status=None, trigger="command", dry_run=False,
+                                 timings=None, history_fields=None, channel_id=None, top_chatters=None):
+    """기간 집계를 실행합니다 (/집계, !집계, 예약 집계에서 사용)
+
+    집계 작업(aggregate_jobs)을 만들어 단계별로 기록하며 실행하므로, 봇이 중간에 멈춰도 재시작 후 이어서 끝냄
+    on_status: 진행 상황 문구를 받는 코루틴 함수
+    timings: 미리 잰 단계별 소요 시간(ms), history_fields: 집계 기록에 함께 저장할 필드 (예약 집계용)
+    channel_id: 재개한 작업의 결과를 보낼 채널, top_chatters: 미리 정한 순위 (!집계는 리더보드 기준)
+    {status, message, error, image, top_chatters, plan, timings, resumable} 반환
+    (status: ok, dry_run, busy, no_db, no_roles, no_data, no_candidates, color_error, role_error, image_error, error)
+    resumable: 작업이 끝나지 않고 남아 있어 이후에 이어서 실행됨 (임대 해제 또는 다른 실행이 이어받음)
+    """
+    guild_id = guild.id
+    if guild_id not in server_roles:
+        return _aggregate_result("no_roles", "❌ 역할이 설정되지 않았습니다. /역할설정 명령어를 사용하는 것이다.", timings=timings)
+
+    if dry_run:
+        return await _preview_aggregation(guild, start_date_utc, end_date_utc, on_status, top_chatters)
+
+    if not db.is_mongo_connected():
+        return _aggregate_result("no_db", "❌ 데이터베이스에 연결되어 있지 않은 것이다.", timings=timings)
+
+    job = await aggregate_jobs.create(guild_id, {
+        "trigger": trigger,
+        "start_date": start_date_utc,
+        "end_date": end_date_utc,
+        "channel_id": channel_id,
+        "history_fields": history_fields or {},
+        "timings": dict(timings or {}),
+        "first_role_id": server_roles[guild_id]["first"],
+        "other_role_id": server_roles[guild_id]["other"],
+    })
+    if job is None:
+        return _aggregate_result("busy", "❌ 이 서버에서 이미 집계가 진행 중인 것이다. 끝난 뒤에 다시 시도하는 것이다.", timings=timings)
+
+    print(f"[집계] 서버 {guild_id} 집계 작업 {job['_id']} 시작 ({trigger})")
+    return await run_aggregate_job(guild, job, on_status, top_chatters=top_chatters)
+
+def _aggregate_result(status, message=None, error=None, timings=None):
+    return {"status": status, "message": message, "error": error, "image": None, "top_chatters": [],
+            "plan": None, "timings": dict(timings or {}), "resumable": False}
+
+async def _rank_aggregation(guild, start_date_utc, end_date_utc, top_chatters=None):
+    """기간 내 상위 6명을 조회합니다. (상위 목록, 실패 상태 또는 None) 반환"""
+    if top_chatters is not None:
+        return top_chatters, None if top_chatters else "no_candidates"
+
+    # 제외 역할이 있는 멤버는 DB에서 상위 목록을 뽑을 때 제외
+    # (DB 조회는 다른 스레드에서 실행되므로 멤버 이벤트로 바뀌지 않도록 복사해서 넘김)
+    excluded_members = set(excluded_member_index.get(guild))
+
+    # 기간 내 상위 6명과 합계만 조회 (시간별 집계 합산, 정렬까지 DB에서 처리)
+    top_chatters, totals = await get_top_chatters_in_period(
+        guild.id, start_date_utc, end_date_utc, limit=6, exclude_user_ids=excluded_members
+    )
+    if not totals["messages"]:
+        return top_chatters, "no_data"
+    if not top_chatters:
+        return top_chatters, "no_candidates"
+    return top_chatters, None
+
+_FAILURE_MESSAGES = {
+    "no_data": "❌ 이 기간 동안 채팅 데이터가 없는 것이다.",
+    "no_candidates": "❌ 집계할 수 있는 사용자가 없는 것이다.",
+    "no_roles": "❌ 설정된 역할을 찾을 수 없는 것이다.",
+}
+
+async def _preview_aggregation(guild, start_date_utc, end_date_utc, on_status=None, top_chatters=None):
+    """미리보기: 역할, 연속 기록, 채팅 카운트를 바꾸지 않고 순위와 역할 변경 계획만 계산합니다"""
+    if on_status is not None:
+        await on_status("메시지를 조회 중인 것이다... ⏳")
+    top_chatters, failure = await _rank_aggregation(guild, start_date_utc, end_date_utc, top_chatters)
+    if failure:
+        return _aggregate_result(failure, _FAILURE_MESSAGES[failure])
+
+    first_role = guild.get_role(server_roles[guild.id]["first"])
+    other_role = guild.get_role(server_roles[guild.id]["other"])
+    if not first_role or not other_role:
+        return _aggregate_result("no_roles", _FAILURE_MESSAGES["no_roles"])
+
+    result = _aggregate_result("dry_run")
+    result["top_chatters"] = top_chatters
+    result["plan"] = plan_role_changes(first_role, other_role, [user_id for user_id, _ in top_chatters], guild.get_member)
+    return result
+
+async def run_aggregate_job(guild, job, on_status=None, top_chatters=None):
+    """집계 작업을 완료하지 않은 단계부터 실행합니다 (새 작업과 재개한 작업 모두)
+
+    순위 → 1등 역할 색상 복원 → 역할 변경 → 연속 기록 갱신 → 이미지 생성 → 채팅 카운트 초기화 → 집계 기록 저장
+    단계마다 완료를 기록하고, 각 단계는 다시 실행해도 결과가 같음
+    (역할 변경은 현재 역할과의 차이만, 연속 기록/채팅 카운트 초기화/집계 기록은 작업 ID로 한 번만 반영)
+    """
+    guild_id = guild.id
+    job_id = job["_id"]
+    done = set(job["steps_done"])
+    started = time.perf_counter()
+    timings = job["timings"]
+    result = _aggregate_result("ok")
+    result["timings"] = timings
+
+    async def status(content):
+        if on_status is not None:
+            try:
+                await on_status(content)
+            except Exception as e:
+                print(f"[집계] 진행 상황 알림 실패: {e}")
+
+    def lap(phase, phase_started):
+        timings[phase] = round((time.perf_counter() - phase_started) * 1000)
+        return time.perf_counter()
+
+    async def fail(failure, message, error=None):
+        result.update(status=failure, message=message, error=error)
+        await aggregate_jobs.finish(job, failure, message)
+        print(f"[집계] 서버 {guild_id} 집계 작업 {job_id} 실패: {failure}")
+        return result
+
+    async with aggregate_jobs.hold(job):
+        try:
+            first_role = guild.get_role(job["first_role_id"])
+            other_role = guild.get_role(job["other_role_id"])
+            if not first_role or not other_role:
+                return await fail("no_roles", _FAILURE_MESSAGES["no_roles"])
+
+            # 1. 순위와 역할 변경 대상 확정 (재개 시 채팅 카운트가 이미 초기화되었을 수 있으므로 저장된 순위 사용)
+            if "rank" not in done:
+                await status("메시지를 조회 중인 것이다... ⏳")
+                phase_started = time.perf_counter()
+                top_chatters, failure = await _rank_aggregation(guild, job["start_date"], job["end_date"], top_chatters)
+                if failure:
+                    return await fail(failure, _FAILURE_MESSAGES[failure])
+                plan = plan_role_changes(first_role, other_role, [user_id for user_id, _ in top_chatters], guild.get_member)
+                lap("query", phase_started)
+                await aggregate_jobs.checkpoint(job, "rank", {
+                    "top_chatters": [[user_id, count] for user_id, count in top_chatters],
+                    # 역할을 바꾸기 전의 보유자 기준 (재개 시 다시 계산하면 이미 역할을 뺀 사용자가 빠짐)
+                    "role_types": [[user_id, role_type] for user_id, role_type in plan["role_types"].items()],
+                    "dropped_user_ids": plan["removed"],
+                    "timings": timings,
+                })
+
+            top_chatters = [(user_id, count) for user_id, count in job["top_chatters"]]
+            top_user_ids = [user_id for user_id, _ in top_chatters]
+            role_types = {user_id: role_type for user_id, role_type in job["role_types"]}
+            dropped_user_ids = job["dropped_user_ids"]
+            result["top_chatters"] = top_chatters
+
+            # 2. 1등 역할 원래 색상으로 복원
+            if "color" not in done:
+                try:
+                    original_color = await restore_role_original_color(guild, first_role)
+                    if original_color:
+                        await first_role.edit(color=disnake.Color(original_color))
+                except disnake.Forbidden as e:
+                    return await fail("color_error", "❌ 역할 색상을 변경할 권한이 없는 것이다!", e)
+                await aggregate_jobs.checkpoint(job, "color")
+
+            # 3. 역할 변경 (현재 역할 보유자와 저장된 순위를 비교해 바뀌는 멤버만, 서버별 동시 실행 수 제한)
+            if "roles" not in done:
+                phase_started = time.perf_counter()
+                plan = plan_role_changes(first_role, other_role, top_user_ids, guild.get_member)
+                result["plan"] = plan
+
+                async def report_progress(done_count, total, per_second):
+                    await status(f"역할을 배분하는 것이다... ({done_count}/{total}, {per_second:.1f}건/초) ⏳")
+
+                edits = await role_assigner.run(guild, plan["operations"], on_progress=report_progress,
+                                                reason=f"집계 ({job['trigger']})")
+                if edits["errors"]:
+                    error = edits["errors"][0][1]
+                    return await fail("role_error", f"❌ 역할을 변경하지 못한 멤버가 {edits['failed']}명 있는 것이다: {error}", error)
+                lap("roles", phase_started)
+                await aggregate_jobs.checkpoint(job, "roles", {"timings": timings})
+
+            # 4. 연속 기록 갱신 (순위권 증가 + 순위권 제외 초기화, 이 작업으로 이미 증가한 기록은 그대로)
+            phase_started = time.perf_counter()
+            if "streaks" not in done:
+                streaks = await update_ranking_streaks(guild_id, role_types, dropped_user_ids,
+                                                       lookup_user_ids=top_user_ids, job_id=job_id)
+                if dropped_user_ids:
+                    print(f"[집계] 순위권에서 벗어난 {len(dropped_user_ids)}명의 연속 기록 초기화")
+                lap("streaks", phase_started)
+                await aggregate_jobs.checkpoint(job, "streaks", {"timings": timings})
+            else:
+                streaks = await adb.get_role_streaks(guild_id, top_user_ids)
+
+            # 이미지 생성 (저장하지 않으므로 재개 시 다시 생성)
+            await status("이미지를 생성 중인 것이다... 🎨")
+            phase_started = time.perf_counter()
+            image = await create_ranking_image(
+                guild,
+                top_chatters,
+                first_role,
+                other_role,
+                start_date=job["start_date"],
+                end_date=job["end_date"],
+                streaks=streaks
+            )
+            phase_started = lap("render", phase_started)
+            if not image:
+                return await fail("image_error", "❌ 이미지 생성에 실패한 것이다...")
+            result["image"] = image
+
+            # 5. 채팅 카운트 초기화 (이미 이 작업으로 초기화했으면 그 뒤에 쌓인 카운트를 지우지 않도록 건너뜀)
+            if "reset" not in done:
+                config = await adb.get_guild_config(guild_id) if job["attempts"] > 1 else None
+                if (config or {}).get("chat_counts_reset_job_id") != job_id:
+                    await reset_chat_counts(guild_id, job_id=job_id)
+                # 현재 시간을 집계 날짜로 저장
+                await save_last_aggregate_date(guild_id)
+                lap("reset", phase_started)
+                await aggregate_jobs.checkpoint(job, "reset", {"timings": timings, "aggregate_date": datetime.datetime.now(pytz.UTC)})
+
+            # 6. 집계 기록 저장 (실행 방식, 단계별 소요 시간, 작업 ID 포함)
+            if "history" not in done:
+                timings["total"] = timings.get("total", 0) + round((time.perf_counter() - started) * 1000)
+                await adb.save_aggregate_history(
+                    guild_id=guild_id,
+                    aggregate_date=job["aggregate_date"],
+                    start_date=job["start_date"],
+                    end_date=job["end_date"],
+                    top_chatters=top_chatters,
+                    first_role_name=first_role.name,
+                    first_role_color=f"#{first_role.color.value:06x}",
+                    other_role_name=other_role.name,
+                    other_role_color=f"#{other_role.color.value:06x}",
+                    trigger=job["trigger"],
+                    timings=timings,
+                    job_id=job_id,
+                    **job["history_fields"]
+                )
+                await aggregate_jobs.checkpoint(job, "history", {"timings": timings})
+
+            await aggregate_jobs.finish(job, "done")
+            print(f"[집계] 서버 {guild_id} 집계 작업 {job_id} 완료 ({job['trigger']}, 시도 {job['attempts']}번, {timings})")
+            return result
+
+        except AggregateJobLeaseLost:
+            # 임대가 끝나 다른 실행이 이어받았으므로 여기서는 멈춤
+            print(f"⚠️ [집계] 서버 {guild_id} 집계 작업 {job_id}를 다른 실행이 이어받음")
+            result.update(status="busy", message="❌ 집계가 다른 곳에서 이어서 진행 중인 것이다.", resumable=True)
+            return result
+        except Exception as e:
+            # 일시적인 오류일 수 있으므로 작업은 남기고 임대만 풀어 다음 확인 때 이어서 실행
+            print(f"⚠️ [집계] 서버 {guild_id} 집계 작업 {job_id} 중단: {e}")
+            import traceback
+            traceback.print_exc()
+            await aggregate_jobs.release(job)
+            result.update(status="error", message=f"❌ 집계 중 오류가 발생한 것이다. 잠시 뒤 이어서 진행하는 것이다: {e}", error=e,
+                          resumable=True)
+            return result
+
+# 예약 집계와 중단된 집계 재개도 같은 흐름으로 실행 (캐시에서 내려간 서버는 실행 전에 상태를 불러옴)
+aggregate_scheduler.run_job = run_period_aggregation
+aggregate_scheduler.resume_job = run_aggregate_job
+aggregate_scheduler.ensure_state = ensure_guild_state
+
+async def create_ranking_image(guild, top_chatters, first_role, other_role, start_date, end_date, streaks=None):
+    # 연속 기록이 주어지지 않으면 순위권 사용자의 기록을 한 번에 조회
+    if streaks is None:
+        streaks = await adb.get_role_streaks(guild.id, [user_id for user_id, _ in top_chatters])
     width, height = 920, 1050
     
     # 기본 캔버스 생성
@@ -746,7 +926,7 @@ async def create_ranking_image(guild, top_chatters, first_role, other_role, star
                                      main_color=rank_colors["name"],
                                      is_name=True)
                 
-                streak_info = get_role_streak(guild.id, user_id)
+                streak_info = streaks.get(user_id, {"type": None, "count": 0})
                 role_color = f"#{first_role.color.value:06x}"
                 draw_role_name_with_streak(text_x, y_offset_top + 250,
                                            first_role.name,
@@ -788,7 +968,7 @@ async def create_ranking_image(guild, top_chatters, first_role, other_role, star
                                      main_color=rank_colors["name"],
                                      is_name=True)
                 
-                streak_info = get_role_streak(guild.id, user_id)
+                streak_info = streaks.get(user_id, {"type": None, "count": 0})
                 role_color = f"#{other_role.color.value:06x}"
                 draw_role_name_with_streak(text_x, y_offset_bottom + 250,
                                            other_role.name,
@@ -833,7 +1013,7 @@ async def create_ranking_image(guild, top_chatters, first_role, other_role, star
                                      main_color=rank_colors["name"],
                                      is_name=True)
                 
-                streak_info = get_role_streak(guild.id, user_id)
+                streak_info = streaks.get(user_id, {"type": None, "count": 0})
                 role_color = f"#{other_role.color.value:06x}"
                 draw_role_name_with_streak(x_text, y_pos + 77,
                                            other_role.name,
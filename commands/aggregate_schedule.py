@@ -0,0 +1,81 @@
+from disnake.ext import commands
+import disnake
+import datetime
+import pytz
+from bot import bot, server_roles
+from aggregate_scheduler import next_schedule_run, describe_schedule, WEEKDAY_NAMES
+import database as db
+import async_database as adb
+
+@bot.slash_command(name="집계예약", description="정해진 요일과 시간에 자동으로 집계하도록 예약하는 것이다.")
+@commands.has_permissions(administrator=True)
+async def 집계예약(
+    inter: disnake.ApplicationCommandInteraction,
+    action: str = commands.Param(choices=["설정", "해제", "확인"], description="설정, 해제 또는 확인"),
+    weekday: str = commands.Param(default="월", choices=WEEKDAY_NAMES, description="집계할 요일 (KST)"),
+    time: str = commands.Param(default="00:05", description="집계할 시각 HH:MM (KST)"),
+    period_days: int = commands.Param(default=7, min_value=1, max_value=31, description="실행일 전날까지 집계할 일 수"),
+    channel: disnake.TextChannel = commands.Param(default=None, description="결과를 보낼 채널 (기본: 이 채널)"),
+):
+    guild_id = inter.guild.id
+    print(f"[집계예약] 명령어 실행 - 서버: {guild_id}, 작업: {action}")
+
+    if not db.is_mongo_connected():
+        await inter.response.send_message("❌ DB에 연결되지 않아 예약할 수 없는 것이다.", ephemeral=True)
+        return
+
+    if action == "확인":
+        config = await adb.get_guild_config(guild_id)
+        schedule = (config or {}).get("aggregate_schedule")
+        if not schedule:
+            await inter.response.send_message("📅 예약된 집계가 없는 것이다.", ephemeral=True)
+            return
+        next_run_at = schedule["next_run_at"].replace(tzinfo=pytz.UTC).astimezone(pytz.timezone('Asia/Seoul'))
+        history = await adb.get_aggregate_history(guild_id, limit=1)
+        last = ""
+        if history:
+            record = history[0]
+            last = (f"\n마지막 집계: {record['aggregate_date'].strftime('%Y-%m-%d %H:%M')} (UTC), "
+                    f"{record.get('trigger', 'command')} / {record.get('status', 'ok')}")
+        await inter.response.send_message(
+            f"📅 {describe_schedule(schedule)}, 결과 채널: <#{schedule['channel_id']}>\n"
+            f"다음 실행: {next_run_at.strftime('%Y-%m-%d %H:%M')} (KST){last}",
+            ephemeral=True
+        )
+        return
+
+    if action == "해제":
+        if await adb.clear_aggregate_schedule(guild_id):
+            await inter.response.send_message("✅ 예약된 집계를 해제한 것이다.", ephemeral=True)
+        else:
+            await inter.response.send_message("❌ 예약된 집계가 없는 것이다.", ephemeral=True)
+        return
+
+    if guild_id not in server_roles:
+        await inter.response.send_message("❌ 역할이 설정되지 않았습니다. /역할설정 명령어를 사용하는 것이다.", ephemeral=True)
+        return
+
+    try:
+        hour, minute = (int(part) for part in time.split(":"))
+        datetime.time(hour, minute)
+    except ValueError:
+        await inter.response.send_message("❌ 시각 형식이 잘못되었습니다. HH:MM 형식으로 입력하는 것이다.", ephemeral=True)
+        return
+
+    schedule = {
+        "weekday": WEEKDAY_NAMES.index(weekday),
+        "hour": hour,
+        "minute": minute,
+        "period_days": period_days,
+        "channel_id": (channel or inter.channel).id,
+    }
+    schedule["next_run_at"] = next_schedule_run(schedule["weekday"], hour, minute, datetime.datetime.now(pytz.UTC))
+    await adb.set_aggregate_schedule(guild_id, **schedule)
+
+    next_run_at = schedule["next_run_at"].astimezone(pytz.timezone('Asia/Seoul'))
+    print(f"[집계예약] 서버 {guild_id} 예약 저장: {schedule}")
+    await inter.response.send_message(
+        f"✅ 집계를 예약한 것이다. {describe_schedule(schedule)}, 결과 채널: <#{schedule['channel_id']}>\n"
+        f"다음 실행: {next_run_at.strftime('%Y-%m-%d %H:%M')} (KST)",
+        ephemeral=True
+    )
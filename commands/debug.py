@@ -1,7 +1,8 @@
 import disnake
 from disnake.ext import commands
-from bot import bot, server_roles, server_excluded_roles
+from bot import bot, server_roles, server_excluded_roles, mongo_health_monitor, ingest_wal, role_assigner, excluded_member_index, aggregate_scheduler, aggregate_jobs
 import database as db
+import async_database as adb
 import json
 
 @bot.slash_command(name="디버그", description="역할 설정 데이터를 확인하는 것이다.")
@@ -25,36 +26,48 @@ async def 디버그(inter: disnake.ApplicationCommandInteraction):
         
         # 문자열과 정수 모두 확인
         try:
-            # 정수형으로 찾기
-            doc1 = db.roles_collection.find_one({"guild_id": guild_id})
-            if doc1:
-                debug_info.append(f"정수 guild_id로 역할 찾음: {doc1}")
+            # 서버 설정 문서 (guild_configs)
+            config = await adb.get_guild_config(guild_id)
+            if config:
+                debug_info.append(f"서버 설정 문서 찾음: {config}")
             else:
-                debug_info.append("정수 guild_id로 역할 못찾음")
+                debug_info.append("서버 설정 문서 못찾음")
                 
-            # 문자열로 찾기
-            doc2 = db.roles_collection.find_one({"guild_id": str(guild_id)})
+            # 예전 roles 컬렉션 (정수/문자열 guild_id 모두 확인)
+            doc1 = await adb.run(db.roles_collection.find_one, {"guild_id": guild_id})
+            if doc1:
+                debug_info.append(f"예전 roles 컬렉션에서 정수 guild_id로 역할 찾음: {doc1}")
+            doc2 = await adb.run(db.roles_collection.find_one, {"guild_id": str(guild_id)})
             if doc2:
-                debug_info.append(f"문자열 guild_id로 역할 찾음: {doc2}")
-            else:
-                debug_info.append("문자열 guild_id로 역할 못찾음")
+                debug_info.append(f"예전 roles 컬렉션에서 문자열 guild_id로 역할 찾음: {doc2}")
                 
             # 전체 데이터베이스 검색
             debug_info.append("\n모든 역할 데이터 확인:")
-            cursor = db.roles_collection.find({})
-            for doc in cursor:
+            all_docs = await adb.run(lambda: list(db.guild_configs_collection.find({"first_role_id": {"$exists": True}})))
+            for doc in all_docs:
                 debug_info.append(f"- guild_id: {doc.get('guild_id')} (타입: {type(doc.get('guild_id')).__name__}), 역할: {doc}")
         except Exception as e:
             debug_info.append(f"MongoDB 조회 오류: {e}")
     else:
         debug_info.append("MongoDB 연결 안됨")
+
+    # 3. 연결 상태 (ping 지연 시간, 차단기) 및 커넥션 풀 통계
+    if db.is_mongo_configured():
+        debug_info.append(f"\nDB 상태: {mongo_health_monitor.stats()}")
+        debug_info.append(f"커넥션 풀: {db.pool_stats.stats()}")
+    if ingest_wal.enabled:
+        debug_info.append(f"수집 로그: {ingest_wal.stats()}")
+    debug_info.append(f"역할 변경: {role_assigner.stats()}")
+    debug_info.append(f"제외 멤버 집합: {excluded_member_index.stats()} (이 서버 {len(excluded_member_index.get(inter.guild))}명)")
+    debug_info.append(f"예약 집계: {aggregate_scheduler.stats()}")
+    debug_info.append(f"집계 작업: {aggregate_jobs.stats()}")
     
     info_text = "\n".join(debug_info)
     await inter.followup.send(f"**디버그 정보**\n```\n{info_text}\n```", ephemeral=True)
 
     # 수동으로 다시 로드 시도
     try:
-        role_data = db.get_guild_role_data(guild_id)
+        role_data = await adb.get_guild_role_data(guild_id)
         if role_data:
             server_roles[guild_id] = role_data
             await inter.followup.send(f"✅ 역할 데이터 다시 로드 성공: {role_data}", ephemeral=True)
@@ -1,10 +1,12 @@
 from disnake.ext import commands
 import disnake
 from disnake.ui import Button, View
-from bot import bot, server_chat_counts, server_excluded_roles
+from bot import bot, server_chat_counts, excluded_member_index
 import database as db
+import async_database as adb
 import pytz  # Add this import for timezone handling
-from collections import Counter  # Counter 명시적 임포트 추가
+from ranking import RankedCounter  # 순위를 유지하는 Counter
+from compact_counter import CompactCounter, make_chat_counter, compact_if_large
 
 class LeaderboardView(View):
     def __init__(self, author_id, guild_id, current_page=1):  # author_id 추가
@@ -15,14 +17,12 @@ class LeaderboardView(View):
         self.chat_counts = server_chat_counts[self.guild_id]
         
         # 순위 계산 시 제외 역할을 필터링하지 않음 (변경된 부분)
-        sorted_chatters = sorted(self.chat_counts.items(), key=lambda x: x[1], reverse=True)
-        
         # 페이지당 25명으로 변경 (50명에서)
         self.items_per_page = 25
-        self.max_page = (len(sorted_chatters) - 1) // self.items_per_page + 1
+        self.max_page = (len(self.chat_counts) - 1) // self.items_per_page + 1
         
-        # 명령어 사용자의 순위 찾기
-        self.user_rank = next((i + 1 for i, (uid, _) in enumerate(sorted_chatters) if uid == author_id), None)
+        # 명령어 사용자의 순위 찾기 (채팅 카운터가 순위를 제공하므로 정렬 불필요)
+        self.user_rank = self.chat_counts.rank_of(author_id)
         if self.user_rank:
             # 페이지당 25명으로 계산 (50명에서 변경)
             self.user_page = (self.user_rank - 1) // self.items_per_page + 1
@@ -31,29 +31,26 @@ class LeaderboardView(View):
 
     async def update_page(self, inter):
         chat_counts = self.chat_counts
-        # 모든 사용자 포함하여 정렬 (제외 역할 필터링 없음)
-        sorted_chatters = sorted(chat_counts.items(), key=lambda x: x[1], reverse=True)
-
+        # 모든 사용자 포함 (제외 역할 필터링 없음), 현재 페이지만 가져옴
         # 페이지당 25명으로 변경 (50명에서)
         start_index = (self.current_page - 1) * self.items_per_page
-        end_index = self.current_page * self.items_per_page
-        page_data = sorted_chatters[start_index:end_index]
+        page_data = chat_counts.page(self.current_page, self.items_per_page)
 
         embed = disnake.Embed(title="리더보드", color=disnake.Color.green())
         leaderboard_text = ""
 
-        excluded_roles = server_excluded_roles.get(self.guild_id, [])
+        excluded_members = excluded_member_index.get(inter.guild)
         command_user = inter.author  # 명령어 사용자 저장
 
         # 명령어 사용자의 순위 찾기
-        user_rank = next((i + 1 for i, (uid, _) in enumerate(sorted_chatters) if uid == command_user.id), None)
+        user_rank = chat_counts.rank_of(command_user.id)
         user_count = chat_counts.get(command_user.id, 0)
 
         for index, (user_id, count) in enumerate(page_data, start=start_index + 1):
             member = inter.guild.get_member(user_id)
             if member:
                 # 제외 역할 여부 확인
-                excluded = any(role.id in excluded_roles for role in member.roles)
+                excluded = member.id in excluded_members
                 
                 # 사용자를 강조할지 결정
                 if member.id == command_user.id:
@@ -74,7 +71,7 @@ class LeaderboardView(View):
             leaderboard_text += "\n─────────────────\n"
             
             # 자신이 제외 역할인지 확인
-            self_excluded = any(role.id in excluded_roles for role in command_user.roles)
+            self_excluded = command_user.id in excluded_members
             exclude_text = " (제외됨)" if self_excluded else ""
             
             leaderboard_text += f"**나의 순위: `{user_rank}등` - {user_count}회{exclude_text}**"
@@ -84,7 +81,7 @@ class LeaderboardView(View):
         # 마지막 집계 시간을 한국 시간으로 변환하고 포맷 변경
         last_aggregate_date = None
         if db.is_mongo_connected():
-            last_aggregate_date = db.get_last_aggregate_date(self.guild_id)
+            last_aggregate_date = await adb.get_last_aggregate_date(self.guild_id)
         
         if last_aggregate_date:
             kst = pytz.timezone('Asia/Seoul')
@@ -176,7 +173,7 @@ async def 리더보드(inter: disnake.ApplicationCommandInteraction):
         print(f"[리더보드] 서버 {guild_id}의 메모리에 채팅 데이터 있음: {chat_count}명의 사용자")
         
         # 메모리에 있는 데이터 샘플 출력 (첫 3개)
-        top_users = sorted(server_chat_counts[guild_id].items(), key=lambda x: x[1], reverse=True)[:3]
+        top_users = server_chat_counts[guild_id].top(3)
         for user_id, count in top_users:
             print(f"  - 사용자 {user_id}: {count}회")
     else:
@@ -185,27 +182,24 @@ async def 리더보드(inter: disnake.ApplicationCommandInteraction):
         # 2. MongoDB에서 직접 데이터 확인
         try:
             # 해당 길드의 채팅 데이터가 있는지 확인
-            chat_count = db.chat_counts_collection.count_documents({"guild_id": guild_id})
+            chat_count = await adb.count_guild_chat_counts(guild_id)
             print(f"[리더보드] MongoDB에서 서버 {guild_id}의 문서 수: {chat_count}")
             
             if chat_count > 0:
                 has_chat_data = True
                 print(f"[리더보드] MongoDB에서 서버 {guild_id}의 채팅 데이터 확인: {chat_count}개 항목")
                 
-                # 데이터를 메모리에 로드 (Counter 객체 명시적 생성)
+                # 데이터를 메모리에 로드 (서버 규모에 맞는 카운터 객체 명시적 생성)
                 if guild_id not in server_chat_counts:
-                    server_chat_counts[guild_id] = Counter()
+                    server_chat_counts[guild_id] = make_chat_counter()
                     
-                cursor = db.chat_counts_collection.find({"guild_id": guild_id})
-                loaded_count = 0
+                guild_chat_counts = await adb.get_guild_chat_counts(guild_id)
+                loaded_count = len(guild_chat_counts)
                 
-                for doc in cursor:
-                    user_id = doc.get("user_id")
-                    count = doc.get("count", 0)
-                    
-                    if user_id:  # user_id가 있는 경우만 처리
-                        server_chat_counts[guild_id][user_id] = count
-                        loaded_count += 1
+                # 비어 있는 카운터에 한 번에 채워 넣어 순위를 한 번만 정렬
+                server_chat_counts[guild_id].clear()
+                server_chat_counts[guild_id].update(guild_chat_counts)
+                server_chat_counts[guild_id] = compact_if_large(server_chat_counts[guild_id])
                 
                 print(f"[리더보드] MongoDB에서 서버 {guild_id}의 채팅 데이터 {loaded_count}개 로드됨")
                 
@@ -235,7 +229,7 @@ async def 리더보드(inter: disnake.ApplicationCommandInteraction):
                 debug_info.append(f"메모리에 있는 항목 수: {len(server_chat_counts[guild_id])}")
             
             # 직접 DB에서 카운트 확인
-            db_count = db.chat_counts_collection.count_documents({"guild_id": guild_id})
+            db_count = await adb.count_guild_chat_counts(guild_id)
             debug_info.append(f"DB에 있는 항목 수: {db_count}")
         except Exception as e:
             debug_info.append(f"디버그 정보 수집 중 오류: {e}")
@@ -254,14 +248,11 @@ async def 리더보드(inter: disnake.ApplicationCommandInteraction):
         )
         return
     
-    # 클래스가 Counter가 맞는지 확인
-    counter_class = type(server_chat_counts[guild_id]).__name__
-    print(f"[리더보드] server_chat_counts[{guild_id}]의 타입: {counter_class}")
-    
-    # 만약 Counter 객체가 아니라면 변환
-    if counter_class != "Counter":
-        print(f"[리더보드] Counter 객체가 아니므로 변환합니다: {counter_class}")
-        server_chat_counts[guild_id] = Counter(server_chat_counts[guild_id])
+    # 클래스가 순위를 유지하는 카운터(RankedCounter/CompactCounter)가 맞는지 확인
+    if not isinstance(server_chat_counts[guild_id], (RankedCounter, CompactCounter)):
+        counter_class = type(server_chat_counts[guild_id]).__name__
+        print(f"[리더보드] 순위 카운터 객체가 아니므로 변환합니다: {counter_class}")
+        server_chat_counts[guild_id] = make_chat_counter(server_chat_counts[guild_id])
 
     # 데이터가 있는 경우 리더보드 표시 계속
     view = LeaderboardView(inter.author.id, guild_id)
@@ -2,6 +2,7 @@ from disnake.ext import commands
 import disnake
 from bot import bot, server_roles, server_excluded_roles, server_chat_counts
 import database as db
+import async_database as adb
 import os
 import pytz
 from datetime import datetime
@@ -188,7 +189,7 @@ async def 메뉴얼(inter: disnake.ApplicationCommandInteraction):
                 last_aggregate = "❕ 아직 집계를 한 적이 없는 것이다!"
                 if db.is_mongo_connected():
                     try:
-                        last_date = db.get_last_aggregate_date(guild_id)
+                        last_date = await adb.get_last_aggregate_date(guild_id)
                         if last_date:
                             kst = pytz.timezone('Asia/Seoul')
                             # 시간대 정보 확인 및 명시적 변환
@@ -209,47 +210,27 @@ async def 메뉴얼(inter: disnake.ApplicationCommandInteraction):
                 chat_date_range = "기록 없음"
                 if db.is_mongo_connected():
                     try:
-                        # 데이터베이스 쿼리 최적화 - 인덱스 사용 및 필요한 필드만 조회
-                        # 쿼리 수행 시간 제한 설정 (5초)
-                        oldest_message = list(db.messages_collection.find(
-                            {"guild_id": guild_id}, 
-                            {"timestamp": 1, "_id": 0}  # _id 필드 제외
-                        ).sort("timestamp", 1).limit(1).max_time_ms(5000))
-                        
-                        newest_message = list(db.messages_collection.find(
-                            {"guild_id": guild_id}, 
-                            {"timestamp": 1, "_id": 0}  # _id 필드 제외
-                        ).sort("timestamp", -1).limit(1).max_time_ms(5000))
+                        # 가장 오래된/최근 메시지 시각과 메시지 수 (최대 10,000개까지만 셈)
+                        oldest_date, newest_date, total_messages = await adb.get_message_date_range(guild_id)
                         
                         # 날짜 범위가 있으면 포맷팅
-                        if oldest_message and newest_message:
-                            oldest_date = oldest_message[0].get("timestamp")
-                            newest_date = newest_message[0].get("timestamp")
+                        if oldest_date and newest_date:
+                            oldest_kst = oldest_date.astimezone(pytz.timezone('Asia/Seoul'))
+                            newest_kst = newest_date.astimezone(pytz.timezone('Asia/Seoul'))
                             
-                            # timestamp가 실제로 존재하는지 확인
-                            if oldest_date and newest_date:
-                                oldest_kst = oldest_date.astimezone(pytz.timezone('Asia/Seoul'))
-                                newest_kst = newest_date.astimezone(pytz.timezone('Asia/Seoul'))
-                                
-                                # 요청된 형식(yyyymmdd~yyyymmdd)으로 포맷팅
-                                chat_date_range = f"{oldest_kst.strftime('%Y%m%d')}~{newest_kst.strftime('%Y%m%d')}"
-                                
-                                # 추가 정보로 가독성 있는 날짜도 표시
-                                chat_date_range += f"\n({oldest_kst.strftime('%Y년 %m월 %d일')} ~ {newest_kst.strftime('%Y년 %m월 %d일')})"
-                                
-                                # 총 메시지 수 표시
-                                total_messages = db.messages_collection.count_documents(
-                                    {"guild_id": guild_id},
-                                    limit=10000,  # 대략적인 숫자만 필요하므로 제한
-                                    maxTimeMS=3000  # 시간 제한 3초
-                                )
-                                # 숫자가 너무 크면 "10,000+" 형태로 표시
-                                if total_messages >= 10000:
-                                    message_count_str = "10,000+"
-                                else:
-                                    message_count_str = f"{total_messages:,}"
-                                
-                                chat_date_range += f"\n총 {message_count_str}개 메시지"
+                            # 요청된 형식(yyyymmdd~yyyymmdd)으로 포맷팅
+                            chat_date_range = f"{oldest_kst.strftime('%Y%m%d')}~{newest_kst.strftime('%Y%m%d')}"
+                            
+                            # 추가 정보로 가독성 있는 날짜도 표시
+                            chat_date_range += f"\n({oldest_kst.strftime('%Y년 %m월 %d일')} ~ {newest_kst.strftime('%Y년 %m월 %d일')})"
+                            
+                            # 숫자가 너무 크면 "10,000+" 형태로 표시
+                            if total_messages >= 10000:
+                                message_count_str = "10,000+"
+                            else:
+                                message_count_str = f"{total_messages:,}"
+                            
+                            chat_date_range += f"\n총 {message_count_str}개 메시지"
                     except Exception as e:
                         chat_date_range = f"정보 조회 실패: {type(e).__name__}"
                         print(f"채팅 기록 조회 오류: {e}")
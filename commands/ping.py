@@ -1,6 +1,6 @@
 import disnake
-from bot import bot
-from database import save_guild_info
+from bot import bot, server_chat_counts
+import async_database as adb
 
 @bot.slash_command(name="갱신", description="이 서버의 정보를 DB에 즉시 업로드하는 것이다.")
 async def 갱신(inter: disnake.ApplicationCommandInteraction):
@@ -8,7 +8,8 @@ async def 갱신(inter: disnake.ApplicationCommandInteraction):
     guild = inter.guild
 
     try:
-        success = save_guild_info(guild)
+        member_ids = [uid for uid, cnt in server_chat_counts.get(guild.id, {}).items() if cnt > 0]
+        success = await adb.save_guild_info(guild, member_ids)
         if success:
             embed = disnake.Embed(
                 title="서버 정보 갱신 완료!",
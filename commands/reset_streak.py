@@ -2,6 +2,7 @@ from disnake.ext import commands
 import disnake
 from bot import bot, role_streaks
 import database as db
+import async_database as adb
 
 @bot.slash_command(name="연속초기화", description="서버의 모든 연속 기록을 초기화하는 것이다.")
 @commands.has_permissions(administrator=True)
@@ -24,7 +25,7 @@ async def 연속초기화(inter: disnake.ApplicationCommandInteraction):
                     return
                 
                 # MongoDB에서 해당 서버의 모든 연속 기록 초기화
-                result = db.reset_role_streaks(guild_id)
+                result = await adb.reset_role_streaks(guild_id)
                 
                 # 메모리에서도 연속 기록 초기화
                 if guild_id in role_streaks:
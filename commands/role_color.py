@@ -2,6 +2,7 @@ import disnake
 from disnake.ext import commands
 from bot import bot, server_roles
 import database as db  # MongoDB 모듈 임포트
+import async_database as adb
 
 # 역할 원래 색상 정보를 저장하는 딕셔너리 (메모리 캐시)
 role_original_colors = {}
@@ -39,7 +40,7 @@ async def 역할색상(inter: disnake.ApplicationCommandInteraction, color: str)
         original_color = first_role.color.value
         if db.is_mongo_connected():
             # 서버와 역할별로 원래 색상 저장
-            save_role_original_color(guild_id, first_role_id, original_color)
+            await save_role_original_color(guild_id, first_role_id, original_color)
         
         # 역할 색상 변경
         await first_role.edit(color=discord_color)
@@ -48,31 +49,20 @@ async def 역할색상(inter: disnake.ApplicationCommandInteraction, color: str)
     except Exception as e:
         await inter.response.send_message(f"❌ 오류가 발생한 것이다: {e}", ephemeral=True)
 
-def save_role_original_color(guild_id, role_id, color):
+async def save_role_original_color(guild_id, role_id, color):
     """역할의 원래 색상을 MongoDB에 저장합니다"""
     if not db.is_mongo_connected():
         return
     
-    # 컬렉션이 없다면 생성
-    if not hasattr(db, 'role_colors_collection'):
-        db.role_colors_collection = db.db.role_colors
-        
     # 역할의 원래 색상 저장
-    db.role_colors_collection.update_one(
-        {"guild_id": guild_id, "role_id": role_id},
-        {"$set": {
-            "original_color": color,
-            "updated_at": db.datetime.now(db.timezone.utc)
-        }},
-        upsert=True
-    )
+    await adb.save_role_original_color(guild_id, role_id, color)
     
     # 메모리 캐시도 업데이트
     if guild_id not in role_original_colors:
         role_original_colors[guild_id] = {}
     role_original_colors[guild_id][role_id] = color
 
-def restore_role_original_color(guild, role):
+async def restore_role_original_color(guild, role):
     """역할의 원래 색상을 복원합니다"""
     guild_id = guild.id
     role_id = role.id
@@ -83,16 +73,13 @@ def restore_role_original_color(guild, role):
     
     # 2. MongoDB에서 확인
     if db.is_mongo_connected():
-        if not hasattr(db, 'role_colors_collection'):
-            db.role_colors_collection = db.db.role_colors
-            
-        doc = db.role_colors_collection.find_one({"guild_id": guild_id, "role_id": role_id})
-        if doc and "original_color" in doc:
+        original_color = await adb.get_role_original_color(guild_id, role_id)
+        if original_color is not None:
             # 메모리 캐시 업데이트
             if guild_id not in role_original_colors:
                 role_original_colors[guild_id] = {}
-            role_original_colors[guild_id][role_id] = doc["original_color"]
-            return doc["original_color"]
+            role_original_colors[guild_id][role_id] = original_color
+            return original_color
     
     # 3. 둘 다 없으면 현재 색상 반환
     return role.color.value
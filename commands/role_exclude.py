@@ -1,7 +1,8 @@
 from disnake.ext import commands
 import disnake
-from bot import bot, server_excluded_roles
+from bot import bot, server_excluded_roles, excluded_member_index
 import database as db
+import async_database as adb
 
 @bot.slash_command(name="역할제외", description="서버에서 역할을 제외하거나 해제하는 것이다.")
 @commands.has_permissions(administrator=True)
@@ -23,7 +24,7 @@ async def 역할제외(
     # MongoDB에 메모리 상태와 동기화 확인
     if db.is_mongo_connected():
         try:
-            db_excluded_roles = db.get_guild_excluded_roles(guild_id)
+            db_excluded_roles = await adb.get_guild_excluded_roles(guild_id)
             print(f"[역할제외] DB에서 불러온 제외 역할: {db_excluded_roles}")
             
             # DB에 데이터가 있고 메모리와 다르면 동기화
@@ -41,8 +42,8 @@ async def 역할제외(
             # MongoDB에 저장 및 로그 출력
             print(f"[역할제외] 역할 추가 - 서버: {guild_id}, 역할: {role.id} ({role.name})")
             if db.is_mongo_connected():
-                db.save_excluded_role_data(guild_id, server_excluded_roles[guild_id])
-                print(f"[역할제외] DB 저장 완료: {server_excluded_roles[guild_id]}")
+                await adb.add_excluded_role(guild_id, role.id)
+                print(f"[역할제외] DB 저장 완료 ($addToSet): {server_excluded_roles[guild_id]}")
         else:
             await inter.response.send_message(f"❌ {role.name} 역할은 이미 제외 목록에 있는 것이다.", ephemeral=True)
 
@@ -54,9 +55,12 @@ async def 역할제외(
             # MongoDB에 저장 및 로그 출력
             print(f"[역할제외] 역할 제거 - 서버: {guild_id}, 역할: {role.id} ({role.name})")
             if db.is_mongo_connected():
-                db.save_excluded_role_data(guild_id, server_excluded_roles[guild_id])
-                print(f"[역할제외] DB 저장 완료: {server_excluded_roles[guild_id]}")
+                await adb.remove_excluded_role(guild_id, role.id)
+                print(f"[역할제외] DB 저장 완료 ($pull): {server_excluded_roles[guild_id]}")
         else:
             await inter.response.send_message(f"❌ {role.name} 역할은 제외 목록에 없는 것이다.", ephemeral=True)
 
-    print(f"[역할제외] 작업 완료 후 제외 역할 목록: {server_excluded_roles[guild_id]}")
\ No newline at end of file
+    print(f"[역할제외] 작업 완료 후 제외 역할 목록: {server_excluded_roles[guild_id]}")
+
+    # 제외 멤버 집합을 바뀐 제외 역할 목록으로 다시 만듦
+    excluded_member_index.rebuild(inter.guild)
\ No newline at end of file
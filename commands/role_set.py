@@ -2,6 +2,7 @@ from disnake.ext import commands
 import disnake
 from bot import bot, server_roles
 import database as db
+import async_database as adb
 
 @bot.slash_command(name="역할설정", description="서버에서 사용할 역할을 설정하는 것이다.")
 @commands.has_permissions(administrator=True)
@@ -16,16 +17,16 @@ async def 역할설정(inter: disnake.ApplicationCommandInteraction, first_role:
     try:
         if db.is_mongo_connected():
             # 저장 전 기존 데이터 확인
-            existing_data = db.get_guild_role_data(guild_id)
+            existing_data = await adb.get_guild_role_data(guild_id)
             if existing_data:
                 print(f"[역할설정] 기존 설정 덮어쓰기: {existing_data}")
             
             # 데이터 저장
-            db.save_role_data(guild_id, first_role.id, other_role.id)
+            await adb.save_role_data(guild_id, first_role.id, other_role.id)
             print(f"✅ [역할설정] MongoDB 저장 성공 - 서버: {guild_id}")
             
             # 저장 후 바로 확인
-            saved_data = db.get_guild_role_data(guild_id)
+            saved_data = await adb.get_guild_role_data(guild_id)
             if saved_data:
                 print(f"✓ 저장된 데이터 확인: {saved_data}")
                 # 메모리 캐시도 확인
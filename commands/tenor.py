@@ -5,7 +5,8 @@ import os
 import re
 import random  # 랜덤 모듈 추가
 from dotenv import load_dotenv
-from bot import bot
+from bot import bot, message_router
+from commands.auth import is_guild_authorized
 
 # 환경 변수 로드
 load_dotenv()
@@ -185,6 +186,26 @@ async def tenor(inter: disnake.ApplicationCommandInteraction, search: str):
     # 기존 슬래시 명령어는 공통 함수 호출
     await process_tenor_command(inter, search, is_slash_command=True)
 
+# !테놀 텍스트 명령어
+@message_router.command("!테놀")
+async def tenor_text_command(message, search_query):
+    if not search_query:
+        await message.reply("검색어를 입력하는 것이다! 예: `!테놀 고양이`")
+        return
+        
+    # 서버 인증 확인
+    if not await is_guild_authorized(message.guild.id):
+        await message.reply("❌ 이 서버에서는 이 명령어를 사용할 수 없는 것이다.")
+        return
+    
+    try:
+        await process_tenor_command(message, search_query, is_slash_command=False)
+    except Exception as e:
+        print(f"!테놀 명령어 처리 중 오류 발생: {e}")
+        import traceback
+        traceback.print_exc()
+        await message.reply(f"❌ GIF 검색 중 오류가 발생한 것이다: {str(e)}")
+
 # Cog로 등록
 # def setup(bot):
 #     bot.add_cog(GifCommand(bot))
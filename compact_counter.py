@@ -0,0 +1,252 @@
+import os
+import heapq
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from collections.abc import MutableMapping
+
+from ranking import RankedCounter
+
+try:
+    import numpy as np  # 선택 사항: 있으면 순위 계산을 벡터 연산으로 처리
+except ImportError:
+    np = None
+
+# 이 수 이상의 사용자가 있는 서버는 CompactCounter 사용 (0이면 사용 안 함)
+COMPACT_COUNTER_THRESHOLD = int(os.getenv("COMPACT_COUNTER_THRESHOLD", "50000"))
+COMPACT_COUNTER_MIN_MERGE = 4096  # 새 사용자를 정렬된 배열에 합치는 최소 단위
+COMPACT_COUNTER_RANK_CHUNK = 64  # ranked()가 처음 계산하는 상위 수 (더 읽으면 두 배씩 늘림)
+
+
+# 사용자 ID를 정렬된 int64 배열(_ids)에, 채팅 수를 같은 위치의 int32 배열(_counts)에 저장함
+# 정렬된 ID 배열 자체가 사용자 -> 위치 색인 역할을 하므로(이진 탐색) 사용자마다 파이썬 객체가 생기지 않음
+# 처음 보는 사용자는 작은 딕셔너리(_new)에 모았다가 일정 수가 넘으면 배열에 한 번에 합침
+class CompactCounter(MutableMapping):
+    """사용자가 아주 많은 서버용으로 배열에 채팅 수를 저장하는 Counter 대체 클래스입니다"""
+
+    def __init__(self, iterable=None, /, **kwds):
+        self._ids = array("q")
+        self._counts = array("i")
+        self._new = {}
+        self.update(iterable, **kwds)
+
+    # 조회 --------------------------------------------------------------------
+
+    def _index(self, key):
+        ids = self._ids
+        i = bisect_left(ids, key)
+        if i < len(ids) and ids[i] == key:
+            return i
+        return -1
+
+    def __getitem__(self, key):
+        # Counter와 같이 없는 키는 0
+        i = self._index(key)
+        if i >= 0:
+            return self._counts[i]
+        return self._new.get(key, 0)
+
+    def get(self, key, default=None):
+        i = self._index(key)
+        if i >= 0:
+            return self._counts[i]
+        return self._new.get(key, default)
+
+    def __contains__(self, key):
+        return key in self._new or self._index(key) >= 0
+
+    def __len__(self):
+        return len(self._ids) + len(self._new)
+
+    def __iter__(self):
+        yield from self._ids
+        yield from list(self._new)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({len(self)}명)"
+
+    def memory_usage(self):
+        """카운트 저장에 사용하는 대략적인 바이트 수를 반환합니다"""
+        return (self._ids.itemsize * len(self._ids) + self._counts.itemsize * len(self._counts)
+                + len(self._new) * 100)
+
+    # 변경 --------------------------------------------------------------------
+
+    def __setitem__(self, key, value):
+        i = self._index(key)
+        if i >= 0:
+            self._counts[i] = value
+            return
+
+        self._new[key] = value
+        if len(self._new) >= max(COMPACT_COUNTER_MIN_MERGE, len(self._ids) // 16):
+            self._merge_new()
+
+    def __delitem__(self, key):
+        # Counter와 같이 없는 키는 무시
+        if key in self._new:
+            del self._new[key]
+            return
+        i = self._index(key)
+        if i >= 0:
+            del self._ids[i]
+            del self._counts[i]
+
+    def update(self, iterable=None, /, **kwds):
+        """Counter.update와 같이 채팅 수를 더합니다"""
+        increments = Counter()
+        Counter.update(increments, iterable, **kwds)
+        if not increments:
+            return
+
+        if not self:
+            # 비어 있으면 한 번에 정렬하여 배열 구성
+            items = sorted(increments.items())
+            self._ids = array("q", [key for key, _ in items])
+            self._counts = array("i", [count for _, count in items])
+            return
+
+        for key, amount in increments.items():
+            self[key] = self.get(key, 0) + amount
+
+    def clear(self):
+        self._ids = array("q")
+        self._counts = array("i")
+        self._new = {}
+
+    def copy(self):
+        return type(self)(self)
+
+    @classmethod
+    def from_sorted_arrays(cls, ids, counts):
+        """사용자 ID 오름차순으로 정렬된 배열로 바로 만듭니다 (스냅샷 복원용, 배열을 그대로 사용)"""
+        counter = cls()
+        counter._ids = ids
+        counter._counts = counts
+        return counter
+
+    def sorted_arrays(self):
+        """(사용자 ID 오름차순 배열, 채팅 수 배열)의 복사본을 반환합니다"""
+        self._merge_new()
+        return array("q", self._ids), array("i", self._counts)
+
+    def _merge_new(self):
+        """_new에 모인 사용자를 정렬된 배열에 합칩니다"""
+        if not self._new:
+            return
+
+        new_items = sorted(self._new.items())
+        self._new = {}
+
+        if np is not None:
+            ids = np.frombuffer(self._ids, dtype=np.int64)
+            counts = np.frombuffer(self._counts, dtype=np.int32)
+            new_ids = np.array([key for key, _ in new_items], dtype=np.int64)
+            new_counts = np.array([count for _, count in new_items], dtype=np.int32)
+            positions = np.searchsorted(ids, new_ids)
+            self._ids = array("q", np.insert(ids, positions, new_ids).tobytes())
+            self._counts = array("i", np.insert(counts, positions, new_counts).tobytes())
+            return
+
+        merged = list(heapq.merge(zip(self._ids, self._counts), new_items))
+        self._ids = array("q", [key for key, _ in merged])
+        self._counts = array("i", [count for _, count in merged])
+
+    # 순위 --------------------------------------------------------------------
+    # 순위는 채팅 수 내림차순, 같으면 사용자 ID 오름차순
+
+    def _ranked_indexes(self, n=None):
+        """순위 순서의 배열 위치 목록을 반환합니다 (n이 있으면 상위 n개만)"""
+        self._merge_new()
+        total = len(self._ids)
+        if n is None or n > total:
+            n = total
+        if n <= 0:
+            return []
+
+        if np is not None:
+            ids = np.frombuffer(self._ids, dtype=np.int64)
+            negated = -np.frombuffer(self._counts, dtype=np.int32).astype(np.int64)
+            if n < total:
+                # n번째 값 이상인 후보만 골라 정렬 (전체 정렬 없이 상위 n개)
+                kth = np.partition(negated, n - 1)[n - 1]
+                candidates = np.nonzero(negated <= kth)[0]
+            else:
+                candidates = np.arange(total)
+            order = candidates[np.lexsort((ids[candidates], negated[candidates]))]
+            return order[:n].tolist()
+
+        ids, counts = self._ids, self._counts
+        if n == total:
+            return sorted(range(total), key=lambda i: (-counts[i], ids[i]))
+        return heapq.nsmallest(n, range(total), key=lambda i: (-counts[i], ids[i]))
+
+    def rank_of(self, key):
+        """키의 순위(1부터)를 반환합니다. 없으면 None"""
+        if key not in self:
+            return None
+        self._merge_new()
+        count = self[key]
+
+        if np is not None:
+            ids = np.frombuffer(self._ids, dtype=np.int64)
+            counts = np.frombuffer(self._counts, dtype=np.int32)
+            return int(np.count_nonzero(counts > count) + np.count_nonzero((counts == count) & (ids < key))) + 1
+
+        return sum(1 for uid, c in zip(self._ids, self._counts) if c > count or (c == count and uid < key)) + 1
+
+    def top(self, n):
+        """상위 n개의 (키, 채팅 수) 목록을 반환합니다"""
+        return [(self._ids[i], self._counts[i]) for i in self._ranked_indexes(n)]
+
+    def page(self, page, per_page):
+        """page번째 페이지(1부터)의 (키, 채팅 수) 목록을 반환합니다"""
+        start = (page - 1) * per_page
+        return self.top(start + per_page)[start:]
+
+    def ranked(self):
+        """(키, 채팅 수)를 순위 순서대로 하나씩 반환합니다 (필터링하며 앞에서부터 읽을 때 사용)
+
+        앞에서 멈추는 호출(상위 몇 명만 필요한 경우)은 전체를 정렬하지 않음
+        numpy가 있으면 상위 일부만 부분 정렬로 계산하고 더 읽으면 범위를 두 배씩 늘림
+        (읽는 동안 카운터를 바꾸지 않는 동기 루프에서 사용, 끝까지 읽는 경우 마지막에만 전체 정렬),
+        없으면 힙을 만들어 읽는 만큼만 꺼냄
+        """
+        if np is None:
+            self._merge_new()
+            heap = [(-count, key) for key, count in zip(self._ids, self._counts)]
+            heapq.heapify(heap)
+            while heap:
+                negated, key = heapq.heappop(heap)
+                yield key, -negated
+            return
+
+        done = 0
+        n = COMPACT_COUNTER_RANK_CHUNK
+        while done < len(self):
+            chunk = self.top(n)[done:]
+            if not chunk:
+                return
+            yield from chunk
+            done += len(chunk)
+            # 절반을 넘게 읽으면 부분 정렬보다 전체 정렬이 빠름
+            n = n * 2 if n * 4 <= len(self) else len(self)
+
+    def most_common(self, n=None):
+        return self.top(len(self) if n is None else max(n, 0))
+
+
+def make_chat_counter(counts=None):
+    """서버 규모에 맞는 채팅 카운터를 만듭니다 (큰 서버는 CompactCounter)"""
+    if counts and COMPACT_COUNTER_THRESHOLD and len(counts) >= COMPACT_COUNTER_THRESHOLD:
+        return CompactCounter(counts)
+    return RankedCounter(counts)
+
+
+def compact_if_large(counter):
+    """RankedCounter가 기준 크기를 넘었으면 CompactCounter로 바꿔 반환합니다"""
+    if (COMPACT_COUNTER_THRESHOLD and len(counter) >= COMPACT_COUNTER_THRESHOLD
+            and not isinstance(counter, CompactCounter)):
+        print(f"[채팅 카운터] 사용자 {len(counter)}명, 배열 기반 카운터로 전환")
+        return CompactCounter(counter)
+    return counter
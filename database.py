@@ -1,7 +1,10 @@
 import os
+import time
 from dotenv import load_dotenv
 import pymongo
-from datetime import datetime, timezone  # timezone 추가
+from db_schema import ensure_indexes, print_index_report
+from mongo_health import PoolStatsListener
+from datetime import datetime, timezone, timedelta  # timezone 추가
 
 # 환경 변수 로드
 load_dotenv()
@@ -12,61 +15,311 @@ MONGO_URI = os.getenv("MONGODB_URI")
 # MongoDB 연결 여부 확인
 DEVELOPMENT_MODE = os.getenv("DEVELOPMENT_MODE", "False").lower() == "true"
 
-# MongoDB 클라이언트
-if (MONGO_URI and not DEVELOPMENT_MODE):
+# 커넥션 풀 크기 (비동기 DB 계층의 작업 스레드 수와 맞춤)
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+
+# 커넥션 풀 통계 (mongo_health.PoolStatsListener, 재연결해도 누적)
+pool_stats = PoolStatsListener()
+
+# MongoDB 클라이언트 (connect()가 설정, 연결 전이나 실패 시 None)
+client = None
+db = None
+_mongo_available = True  # 상태 확인 루프가 연결 끊김을 감지하면 False (차단기)
+_indexes_checked = False
+
+def _bind_collections(database):
+    """컬렉션 객체를 모듈 변수로 설정합니다"""
+    global roles_collection, excluded_roles_collection, chat_counts_collection, messages_collection
+    global aggregate_dates_collection, role_streaks_collection, auth_codes_collection, authorized_guilds_collection
+    global aggregate_history_collection, guilds_col, role_colors_collection, users_collection
+    global hourly_chat_counts_collection, rollup_status_collection, guild_configs_collection, bot_meta_collection
+    global aggregate_jobs_collection
+
+    # 컬렉션 설정
+    roles_collection = database.roles
+    excluded_roles_collection = database.excluded_roles
+    chat_counts_collection = database.chat_counts
+    messages_collection = database.messages
+    aggregate_dates_collection = database.aggregate_dates
+    role_streaks_collection = database.role_streaks
+    auth_codes_collection = database.auth_codes
+    authorized_guilds_collection = database.authorized_guilds
+
+    # 집계 기록 컬렉션 추가
+    aggregate_history_collection = database.aggregate_history
+    # 집계 작업 (단계별 진행 상황과 서버별 임대, 중단된 집계 재개용)
+    aggregate_jobs_collection = database.aggregate_jobs
+
+    guilds_col = database["guilds"]  # guilds 컬렉션 객체 추가
+    role_colors_collection = database.role_colors
+    users_collection = database.users
+
+    # 시간별 채팅 집계 (서버/사용자/시간 단위 카운터)
+    hourly_chat_counts_collection = database.hourly_chat_counts
+    rollup_status_collection = database.rollup_status
+
+    # 서버별 설정 (역할, 제외 역할, 인증, 역할 색상, 마지막 집계 날짜를 한 문서에 저장)
+    guild_configs_collection = database.guild_configs
+    bot_meta_collection = database.bot_meta
+
+def is_mongo_configured():
+    """MongoDB를 사용하도록 설정되어 있는지 반환합니다 (연결 여부와 무관)"""
+    return bool(MONGO_URI) and not DEVELOPMENT_MODE
+
+def connect():
+    """MongoDB에 연결하고 컬렉션을 설정합니다. 이미 연결되어 있거나 성공하면 True
+
+    시작 시 실패해도 상태 확인 루프(mongo_health.MongoHealthMonitor)가 백오프로 다시 호출함
+    """
+    global client, db, _indexes_checked
+    if client is not None:
+        return True
+    if not is_mongo_configured():
+        return False
+
+    new_client = None
     try:
         print(f"MongoDB 연결 시도 중... URI: {MONGO_URI[:20]}...")
-        client = pymongo.MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
+        new_client = pymongo.MongoClient(
+            MONGO_URI,
+            serverSelectionTimeoutMS=5000,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            event_listeners=[pool_stats]
+        )
         # 연결 테스트
-        client.server_info()
-        db = client.chatzipbot
-
-        # 컬렉션 설정
-        roles_collection = db.roles
-        excluded_roles_collection = db.excluded_roles
-        chat_counts_collection = db.chat_counts
-        messages_collection = db.messages
-        aggregate_dates_collection = db.aggregate_dates
-        role_streaks_collection = db.role_streaks
-        auth_codes_collection = db.auth_codes
-        authorized_guilds_collection = db.authorized_guilds
-
-        # 집계 기록 컬렉션 추가
-        aggregate_history_collection = db.aggregate_history
+        new_client.server_info()
+    except Exception as e:
+        print(f"MongoDB 연결 실패: {e}")
+        if new_client is not None:
+            new_client.close()
+        return False
 
-        guilds_col = db["guilds"]  # guilds 컬렉션 객체 추가
+    database = new_client.chatzipbot
+    _bind_collections(database)
+    client, db = new_client, database
 
-        # 인덱스 확인 및 생성
+    # 인덱스 확인 및 생성 (db_schema.INDEX_SPECS에 선언된 인덱스, 프로세스당 한 번)
+    if not _indexes_checked:
         try:
-            # 집계 기록 컬렉션 인덱스
-            index_info = aggregate_history_collection.index_information()
-            
-            # guild_id + aggregate_date 복합 인덱스 (조회 성능 향상)
-            if "guild_id_1_aggregate_date_-1" not in index_info:
-                aggregate_history_collection.create_index(
-                    [("guild_id", 1), ("aggregate_date", -1)],
-                    background=True
-                )
-                print("집계 기록 컬렉션 인덱스 생성 완료")
-                
+            print_index_report(ensure_indexes(db))
+            _indexes_checked = True
         except Exception as index_error:
             print(f"인덱스 생성 중 오류: {index_error}")
 
-        print("MongoDB 연결 성공!")
+    print("MongoDB 연결 성공!")
+    try:
         print(f"사용 가능한 데이터베이스: {client.list_database_names()}")
         print(f"컬렉션: {db.list_collection_names()}")
     except Exception as e:
-        print(f"MongoDB 연결 실패: {e}")
-        client = None
-        db = None
+        print(f"데이터베이스 목록 조회 실패: {e}")
+    return True
+
+def ping():
+    """MongoDB에 ping을 보내고 지연 시간(ms)을 반환합니다. 연결되지 않았으면 예외"""
+    if client is None:
+        raise ConnectionError("MongoDB 클라이언트가 없음")
+    started = time.perf_counter()
+    client.admin.command("ping")
+    return (time.perf_counter() - started) * 1000
+
+def set_mongo_available(available):
+    """상태 확인 루프가 연결 끊김/복구 시 호출합니다. False인 동안 is_mongo_connected()가 False"""
+    global _mongo_available
+    _mongo_available = available
+
+if is_mongo_configured():
+    connect()
 else:
     print("개발 모드 또는 MongoDB 연결 문자열이 없습니다. 로컬 SQLite를 사용합니다.")
-    client = None
-    db = None
 
 # MongoDB 헬퍼 함수
 def is_mongo_connected():
-    return db is not None
+    return db is not None and _mongo_available
+
+# 서버 설정 (guild_configs) ------------------------------------------------
+# 서버 하나의 설정을 _id가 guild_id인 문서 하나에 저장함
+# 예전에는 roles, excluded_roles, authorized_guilds, role_colors, aggregate_dates에 나뉘어 있었으며,
+# 아직 옮기지 않은 서버는 처음 읽거나 쓸 때 옮김 (migrate_guild_configs.py로 한 번에 옮길 수도 있음)
+
+GUILD_CONFIGS_MIGRATED_ID = "guild_configs_migrated"
+_guild_configs_migrated = False  # 모든 서버를 옮겼으면 True (이후에는 예전 컬렉션을 보지 않음)
+
+def _all_guild_configs_migrated():
+    global _guild_configs_migrated
+    if not _guild_configs_migrated:
+        _guild_configs_migrated = bot_meta_collection.find_one({"_id": GUILD_CONFIGS_MIGRATED_ID}, {"_id": 1}) is not None
+    return _guild_configs_migrated
+
+def _legacy_guild_config(guild_id):
+    """예전 컬렉션에 나뉘어 있는 서버 설정을 모읍니다"""
+    config = {}
+
+    roles = roles_collection.find_one({"guild_id": guild_id})
+    if roles:
+        config["first_role_id"] = roles.get("first_role_id")
+        config["other_role_id"] = roles.get("other_role_id")
+
+    excluded = [doc["role_id"] for doc in excluded_roles_collection.find({"guild_id": guild_id}, {"role_id": 1})]
+    if excluded:
+        config["excluded_role_ids"] = excluded
+
+    authorized = authorized_guilds_collection.find_one({"guild_id": guild_id})
+    if authorized:
+        config["authorized"] = True
+        config["authorized_at"] = authorized.get("authorized_at")
+        config["auth_code"] = authorized.get("auth_code")
+
+    colors = {str(doc["role_id"]): doc["original_color"]
+              for doc in role_colors_collection.find({"guild_id": guild_id})
+              if "original_color" in doc}
+    if colors:
+        config["role_colors"] = colors
+
+    aggregate = aggregate_dates_collection.find_one({"guild_id": guild_id})
+    if aggregate:
+        config["last_aggregate_date"] = aggregate.get("last_aggregate_date")
+
+    return config
+
+def migrate_guild_config(guild_id):
+    """서버 하나의 설정을 예전 컬렉션에서 guild_configs로 옮기고 옮긴 문서를 반환합니다
+
+    guild_configs에 이미 있는 값은 덮어쓰지 않으므로 여러 번 실행해도 결과가 같음
+    """
+    legacy = _legacy_guild_config(guild_id)
+    fields = {field: {"$ifNull": [f"${field}", {"$literal": value}]} for field, value in legacy.items()}
+    if "role_colors" in legacy:
+        fields["role_colors"] = {"$mergeObjects": [{"$literal": legacy["role_colors"]}, {"$ifNull": ["$role_colors", {}]}]}
+    fields["guild_id"] = {"$literal": guild_id}
+    fields["migrated_at"] = {"$ifNull": ["$migrated_at", "$$NOW"]}
+
+    return guild_configs_collection.find_one_and_update(
+        {"_id": guild_id},
+        [{"$set": fields}],
+        upsert=True,
+        return_document=pymongo.ReturnDocument.AFTER
+    )
+
+def migrate_guild_configs(guild_ids=None):
+    """예전 컬렉션의 서버 설정을 guild_configs로 옮깁니다. 옮긴 서버 수를 반환
+
+    guild_ids를 생략하면 예전 컬렉션에 있는 모든 서버를 옮기고 완료 표시를 남김
+    """
+    if not is_mongo_connected():
+        return 0
+
+    migrate_all = guild_ids is None
+    if migrate_all:
+        guild_ids = set()
+        for collection in (roles_collection, excluded_roles_collection, authorized_guilds_collection,
+                           role_colors_collection, aggregate_dates_collection):
+            guild_ids.update(collection.distinct("guild_id"))
+
+    done = set(guild_configs_collection.distinct("_id", {"migrated_at": {"$exists": True}}))
+    migrated = 0
+    skipped = 0
+    for guild_id in guild_ids:
+        # 예전 데이터 중 문자열 등 정수가 아닌 guild_id는 옮기지 않음
+        if not isinstance(guild_id, int):
+            skipped += 1
+            continue
+        if guild_id in done:
+            continue
+        migrate_guild_config(guild_id)
+        migrated += 1
+
+    if skipped:
+        print(f"⚠️ [서버 설정] 정수가 아닌 guild_id {skipped}개는 옮기지 않았습니다")
+
+    if migrate_all:
+        global _guild_configs_migrated
+        bot_meta_collection.update_one(
+            {"_id": GUILD_CONFIGS_MIGRATED_ID},
+            {"$set": {"migrated_at": datetime.now(timezone.utc), "guild_count": migrated}},
+            upsert=True
+        )
+        _guild_configs_migrated = True
+
+    return migrated
+
+def ensure_guild_configs_migrated():
+    """예전 컬렉션에 남은 서버 설정을 모두 옮깁니다 (이미 모두 옮겼으면 아무것도 하지 않음). 옮긴 서버 수 반환"""
+    if not is_mongo_connected() or _all_guild_configs_migrated():
+        return 0
+
+    migrated = migrate_guild_configs()
+    print(f"[서버 설정] 예전 컬렉션의 서버 설정 {migrated}개를 guild_configs로 옮김")
+    return migrated
+
+def _ensure_guild_config_migrated(guild_id):
+    """설정을 고치기 전에 서버 설정이 guild_configs로 옮겨졌는지 확인합니다"""
+    if _all_guild_configs_migrated():
+        return
+    if not guild_configs_collection.find_one({"_id": guild_id, "migrated_at": {"$exists": True}}, {"_id": 1}):
+        migrate_guild_config(guild_id)
+
+def _update_guild_config(guild_id, update):
+    """서버 설정 문서에 $set/$addToSet/$pull 등의 부분 업데이트를 적용합니다"""
+    _ensure_guild_config_migrated(guild_id)
+
+    now = datetime.now(timezone.utc)
+    update.setdefault("$set", {}).update({"guild_id": guild_id, "updated_at": now})
+    update["$setOnInsert"] = {"migrated_at": now}
+    return guild_configs_collection.update_one({"_id": guild_id}, update, upsert=True)
+
+def get_guild_config(guild_id):
+    """서버 설정 문서를 한 번의 find_one으로 조회합니다 (없으면 None)"""
+    if not is_mongo_connected():
+        return None
+
+    doc = guild_configs_collection.find_one({"_id": guild_id})
+    if (doc is None or "migrated_at" not in doc) and not _all_guild_configs_migrated():
+        doc = migrate_guild_config(guild_id)
+    return doc
+
+def load_guild_configs():
+    """모든 서버 설정을 하나의 커서로 조회합니다. {guild_id: 설정 문서} 반환"""
+    if not is_mongo_connected():
+        return {}
+
+    ensure_guild_configs_migrated()
+    return {doc["_id"]: doc for doc in guild_configs_collection.find()}
+
+def get_guild_configs(guild_ids):
+    """여러 서버의 설정 문서를 $in 조회 한 번으로 가져옵니다. {guild_id: 설정 문서} 반환 (ensure_guild_configs_migrated 이후 사용)"""
+    if not is_mongo_connected() or not guild_ids:
+        return {}
+
+    return {doc["_id"]: doc for doc in guild_configs_collection.find({"_id": {"$in": list(guild_ids)}})}
+
+def role_data_from_config(config):
+    """서버 설정 문서에서 {"first", "other"} 역할 설정을 꺼냅니다 (없으면 None)"""
+    if not config or config.get("first_role_id") is None or config.get("other_role_id") is None:
+        return None
+    return {"first": config["first_role_id"], "other": config["other_role_id"]}
+
+def excluded_roles_from_config(config):
+    """서버 설정 문서에서 제외 역할 ID 목록을 꺼냅니다"""
+    return list((config or {}).get("excluded_role_ids", []))
+
+# 봇 메타 정보 (bot_meta) ---------------------------------------------------
+def get_bot_meta(meta_id):
+    """bot_meta 컬렉션의 문서를 조회합니다 (없으면 None)"""
+    if not is_mongo_connected():
+        return None
+
+    return bot_meta_collection.find_one({"_id": meta_id})
+
+def set_bot_meta(meta_id, fields):
+    """bot_meta 컬렉션의 문서에 필드를 저장합니다"""
+    if not is_mongo_connected():
+        return
+
+    bot_meta_collection.update_one(
+        {"_id": meta_id},
+        {"$set": dict(fields, updated_at=datetime.now(timezone.utc))},
+        upsert=True
+    )
 
 # 역할 데이터 로드
 def load_role_data():
@@ -74,29 +327,29 @@ def load_role_data():
         return {}
 
     result = {}
-    for doc in roles_collection.find():
-        guild_id = doc["guild_id"]
-        result[guild_id] = {
-            "first": doc["first_role_id"],
-            "other": doc["other_role_id"]
-        }
+    for guild_id, config in load_guild_configs().items():
+        role_data = role_data_from_config(config)
+        if role_data:
+            result[guild_id] = role_data
     return result
 
+# 특정 서버의 역할 데이터 로드
+def get_guild_role_data(guild_id):
+    """특정 서버의 역할 설정을 조회합니다"""
+    if not is_mongo_connected():
+        return None
+
+    return role_data_from_config(get_guild_config(guild_id))
+
 # 역할 데이터 저장
 def save_role_data(guild_id, first_role_id, other_role_id):
     if not is_mongo_connected():
         return
 
-    roles_collection.update_one(
-        {"guild_id": guild_id},
-        {"$set": {
-            "guild_id": guild_id,
-            "first_role_id": first_role_id,
-            "other_role_id": other_role_id,
-            "updated_at": datetime.now(timezone.utc)  # utcnow() 대신 사용
-        }},
-        upsert=True
-    )
+    _update_guild_config(guild_id, {"$set": {
+        "first_role_id": first_role_id,
+        "other_role_id": other_role_id
+    }})
 
 # 제외 역할 로드
 def load_excluded_role_data():
@@ -106,15 +359,10 @@ def load_excluded_role_data():
 
     result = {}
     try:
-        # 집계 쿼리를 사용하여 서버별 역할 목록 한번에 가져오기
-        pipeline = [
-            {"$group": {"_id": "$guild_id", "role_ids": {"$push": "$role_id"}}}
-        ]
-
-        # 결과 처리
-        for doc in excluded_roles_collection.aggregate(pipeline):
-            guild_id = doc["_id"]  # guild_id가 _id로 그룹화됨
-            result[guild_id] = doc["role_ids"]
+        for guild_id, config in load_guild_configs().items():
+            excluded_roles = excluded_roles_from_config(config)
+            if excluded_roles:
+                result[guild_id] = excluded_roles
 
         # 로그 추가
         guild_count = len(result)
@@ -132,21 +380,46 @@ def load_excluded_role_data():
         traceback.print_exc()
         return {}
 
-# 제외 역할 저장
+# 특정 서버의 제외 역할 로드
+def get_guild_excluded_roles(guild_id):
+    """특정 서버의 제외 역할 ID 목록을 조회합니다"""
+    if not is_mongo_connected():
+        return []
+
+    return excluded_roles_from_config(get_guild_config(guild_id))
+
+# 제외 역할 저장 (목록 전체 교체)
 def save_excluded_role_data(guild_id, excluded_roles):
     if not is_mongo_connected():
         return
 
-    # 기존 데이터 삭제
-    excluded_roles_collection.delete_many({"guild_id": guild_id})
+    _update_guild_config(guild_id, {"$set": {"excluded_role_ids": list(excluded_roles)}})
+
+# 제외 역할 하나 추가
+def add_excluded_role(guild_id, role_id):
+    """제외 역할을 $addToSet으로 추가합니다. 새로 추가되었으면 True"""
+    if not is_mongo_connected():
+        return False
+
+    result = _update_guild_config(guild_id, {"$addToSet": {"excluded_role_ids": role_id}})
+    return result.modified_count > 0 or result.upserted_id is not None
 
-    # 새 데이터 저장
-    if excluded_roles:
-        documents = [
-            {"guild_id": guild_id, "role_id": role_id, "updated_at": datetime.now(timezone.utc)}  # 수정
-            for role_id in excluded_roles
-        ]
-        excluded_roles_collection.insert_many(documents)
+# 제외 역할 하나 제거
+def remove_excluded_role(guild_id, role_id):
+    """제외 역할을 $pull로 제거합니다. 제거되었으면 True"""
+    if not is_mongo_connected():
+        return False
+
+    # updated_at도 함께 바뀌므로 제거 여부는 조건부 업데이트로 확인
+    _ensure_guild_config_migrated(guild_id)
+    result = guild_configs_collection.update_one(
+        {"_id": guild_id, "excluded_role_ids": role_id},
+        {
+            "$pull": {"excluded_role_ids": role_id},
+            "$set": {"updated_at": datetime.now(timezone.utc)}
+        }
+    )
+    return result.modified_count > 0
 
 # 채팅 카운트 로드
 def load_chat_counts():
@@ -164,47 +437,501 @@ def load_chat_counts():
         result[guild_id][user_id] = count
     return result
 
-# 채팅 카운트 저장
-def save_chat_count(guild_id, user_id, count):
+# 특정 서버의 채팅 카운트 로드
+def get_guild_chat_counts(guild_id):
+    """특정 서버의 채팅 카운트를 {user_id: count} 형태로 조회합니다"""
     if not is_mongo_connected():
-        return
+        return {}
 
-    chat_counts_collection.update_one(
-        {"guild_id": guild_id, "user_id": user_id},
-        {"$set": {
-            "guild_id": guild_id,
-            "user_id": user_id,
-            "count": count,
-            "updated_at": datetime.now(timezone.utc)  # 수정
-        }},
-        upsert=True
+    cursor = chat_counts_collection.find({"guild_id": guild_id}, {"user_id": 1, "count": 1})
+    return {doc["user_id"]: doc.get("count", 0) for doc in cursor if doc.get("user_id")}
+
+# 여러 서버의 채팅 카운트 로드 (시작 시 워밍업에서 사용)
+def get_chat_counts_for_guilds(guild_ids):
+    """여러 서버의 채팅 카운트를 $in 조회 한 번으로 가져옵니다. {guild_id: {user_id: count}} 반환 (기록이 없는 서버는 빈 딕셔너리)"""
+    result = {guild_id: {} for guild_id in guild_ids}
+    if not is_mongo_connected() or not guild_ids:
+        return result
+
+    cursor = chat_counts_collection.find(
+        {"guild_id": {"$in": list(guild_ids)}},
+        {"_id": 0, "guild_id": 1, "user_id": 1, "count": 1}
     )
+    for doc in cursor:
+        if doc.get("user_id"):
+            result.setdefault(doc["guild_id"], {})[doc["user_id"]] = doc.get("count", 0)
+    return result
 
-def save_message(guild_id, user_id, message_id, timestamp):
-    """메시지를 MongoDB에 저장합니다"""
+# 스냅샷 이후 변경분 조회 (시작 시 스냅샷 복원에서 사용)
+def get_chat_count_changes(since):
+    """since 이후 바뀐 채팅 카운트를 {guild_id: {user_id: count}}로 반환합니다 (증가분이 아닌 DB의 현재 값)"""
+    result = {}
     if not is_mongo_connected():
-        return
+        return result
+
+    cursor = chat_counts_collection.find(
+        {"updated_at": {"$gte": since}},
+        {"_id": 0, "guild_id": 1, "user_id": 1, "count": 1}
+    )
+    for doc in cursor:
+        if doc.get("user_id"):
+            result.setdefault(doc["guild_id"], {})[doc["user_id"]] = doc.get("count", 0)
+    return result
+
+def get_guild_config_changes(since):
+    """since 이후 바뀐 서버 설정 문서를 {guild_id: 설정 문서}로 반환합니다"""
+    if not is_mongo_connected():
+        return {}
+
+    return {doc["_id"]: doc for doc in guild_configs_collection.find({"updated_at": {"$gte": since}})}
 
-    messages_collection.insert_one({
+def get_role_streak_changes(since):
+    """since 이후 바뀐 연속 기록을 {guild_id: {user_id: {"type", "count"}}}로 반환합니다"""
+    result = {}
+    if not is_mongo_connected():
+        return result
+
+    cursor = role_streaks_collection.find(
+        {"updated_at": {"$gte": since}},
+        {"_id": 0, "guild_id": 1, "user_id": 1, "role_type": 1, "streak_count": 1}
+    )
+    for doc in cursor:
+        result.setdefault(doc["guild_id"], {})[doc["user_id"]] = {
+            "type": doc.get("role_type"), "count": doc.get("streak_count", 0)
+        }
+    return result
+
+# 특정 서버의 채팅 카운트 문서 수
+def count_guild_chat_counts(guild_id):
+    """특정 서버의 채팅 카운트 문서 수를 조회합니다"""
+    if not is_mongo_connected():
+        return 0
+
+    return chat_counts_collection.count_documents({"guild_id": guild_id})
+
+# 채팅 카운트 증가 (단건)
+def increment_chat_count(guild_id, user_id, amount=1):
+    """채팅 카운트를 $inc로 원자적으로 올리고 DB의 최신 값을 반환합니다"""
+    if not is_mongo_connected():
+        return None
+
+    doc = chat_counts_collection.find_one_and_update(
+        {"guild_id": guild_id, "user_id": user_id},
+        {
+            "$inc": {"count": amount},
+            "$set": {"updated_at": datetime.now(timezone.utc)}
+        },
+        projection={"count": 1},
+        upsert=True,
+        return_document=pymongo.ReturnDocument.AFTER
+    )
+    return doc.get("count", 0) if doc else None
+
+# 채팅 카운트 증가분 일괄 저장 (쓰기 지연 버퍼에서 사용)
+def increment_chat_counts(increments, wal_mark=None):
+    """{(guild_id, user_id): 증가량} 형태의 증가분을 한 번의 bulk_write로 반영합니다
+
+    wal_mark: (writer_id, lsn), 수집 로그의 이 LSN까지 반영했다는 표시를 함께 남김 (재생 시 중복 방지)
+    반영 후 DB의 최신 값을 {(guild_id, user_id): count} 형태로 다시 읽어 반환 (다른 프로세스의 증가분 포함)
+    """
+    if not is_mongo_connected() or not increments:
+        return {}
+
+    now = datetime.now(timezone.utc)
+    extra = {"$set": {"updated_at": now}}
+    if wal_mark is not None:
+        extra["$max"] = _wal_mark_field(*wal_mark)
+    operations = [
+        pymongo.UpdateOne(
+            {"guild_id": guild_id, "user_id": user_id},
+            {"$inc": {"count": amount}, **extra},
+            upsert=True
+        )
+        for (guild_id, user_id), amount in increments.items()
+    ]
+
+    chat_counts_collection.bulk_write(operations, ordered=False)
+
+    # 서버별로 묶어 (guild_id, user_id) 인덱스로 한 번에 조회
+    users_by_guild = {}
+    for guild_id, user_id in increments:
+        users_by_guild.setdefault(guild_id, []).append(user_id)
+
+    cursor = chat_counts_collection.find(
+        {"$or": [{"guild_id": guild_id, "user_id": {"$in": user_ids}} for guild_id, user_ids in users_by_guild.items()]},
+        {"_id": 0, "guild_id": 1, "user_id": 1, "count": 1}
+    )
+    return {(doc["guild_id"], doc["user_id"]): doc.get("count", 0) for doc in cursor}
+
+def make_message_document(guild_id, user_id, message_id, timestamp, wal_mark=None):
+    """messages 컬렉션에 저장할 문서를 만듭니다
+
+    wal_mark: (writer_id, lsn), 이 메시지를 처음 저장한 수집 로그 기록 (재시도/재생 시 새로 저장된 것인지 구분)
+    """
+    document = {
         "guild_id": guild_id,
         "user_id": user_id,
         "message_id": message_id,
         "timestamp": timestamp,
         "created_at": datetime.now(timezone.utc)
-    })
+    }
+    if wal_mark is not None:
+        document["wal_writer"], document["wal_lsn"] = wal_mark
+    return document
 
-# 추가: 메시지 조회 함수
-def get_messages_in_period(guild_id, start_date, end_date):
-    """특정 기간의 메시지를 조회합니다"""
+def save_message(guild_id, user_id, message_id, timestamp):
+    """메시지를 MongoDB에 저장합니다. 새로 저장되었으면 True (이미 저장된 message_id면 False)"""
+    inserted = save_messages([make_message_document(guild_id, user_id, message_id, timestamp)])
+    return bool(inserted and inserted[0])
+
+# 메시지 일괄 저장 (메시지 수집 큐, 수집 로그 재생에서 사용)
+def save_messages(documents):
+    """메시지 문서를 (guild_id, message_id) 기준 $setOnInsert 업서트로 일괄 저장합니다
+
+    문서마다 이번에 새로 저장되었는지(True) 이미 있던 메시지인지(False)를 목록으로 반환
+    (채팅 카운트와 시간별 집계는 새로 저장된 메시지만 더함). 연결되지 않았으면 None
+    같은 배치 안에서 겹치는 message_id는 처음 것만 저장하고, 수집 로그 표시(wal_lsn)가 같은 문서가
+    이미 있으면 이전 시도에서 이 기록으로 저장된 것이므로 새로 저장된 것으로 봄
+    """
     if not is_mongo_connected():
-        return []
+        return None
 
-    cursor = messages_collection.find({
-        "guild_id": guild_id,
-        "timestamp": {"$gte": start_date, "$lte": end_date}
-    })
+    inserted = [False] * len(documents)
+    operations = []
+    indexes = []  # 작업 순서 -> 문서 위치
+    seen = set()
+    for i, document in enumerate(documents):
+        key = (document["guild_id"], document["message_id"])
+        if key in seen:
+            continue
+        seen.add(key)
+        operations.append(pymongo.UpdateOne(
+            {"guild_id": key[0], "message_id": key[1]},
+            {"$setOnInsert": document},
+            upsert=True
+        ))
+        indexes.append(i)
+
+    if not operations:
+        return inserted
+
+    try:
+        upserted = messages_collection.bulk_write(operations, ordered=False).upserted_ids
+    except pymongo.errors.BulkWriteError as e:
+        # 순서 없는 쓰기이므로 다른 문서는 그대로 반영됨. 동시에 같은 메시지를 업서트한 중복 키 오류만 무시
+        details = e.details or {}
+        errors = [error for error in details.get("writeErrors", []) if error.get("code") != 11000]
+        if errors:
+            raise
+        upserted = {entry["index"]: entry["_id"] for entry in details.get("upserted", [])}
+
+    for op_index in upserted:
+        inserted[indexes[op_index]] = True
+
+    # 이전 시도(저장 후 응답 전에 실패했거나 종료됨)에서 같은 수집 로그 기록으로 저장된 메시지 확인
+    logged = {}
+    for i in indexes:
+        document = documents[i]
+        if not inserted[i] and document.get("wal_lsn") is not None:
+            logged.setdefault(document["guild_id"], {})[document["message_id"]] = i
+    if logged:
+        cursor = messages_collection.find(
+            {"$or": [{"guild_id": guild_id, "message_id": {"$in": list(by_message)}} for guild_id, by_message in logged.items()]},
+            {"_id": 0, "guild_id": 1, "message_id": 1, "wal_writer": 1, "wal_lsn": 1}
+        )
+        for doc in cursor:
+            i = logged.get(doc["guild_id"], {}).get(doc["message_id"])
+            if i is not None and (doc.get("wal_writer"), doc.get("wal_lsn")) == (documents[i]["wal_writer"], documents[i]["wal_lsn"]):
+                inserted[i] = True
+
+    return inserted
+
+# 시간별 채팅 집계 --------------------------------------------------------
+
+ROLLUP_LIVE_ID = "live"
+
+def _to_utc_naive(value):
+    """DB에서 읽은 시각과 비교할 수 있도록 UTC 기준 naive datetime으로 변환합니다"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def hour_bucket(timestamp):
+    """시각이 속한 시간 구간의 시작 시각(UTC)을 반환합니다"""
+    return _to_utc_naive(timestamp).replace(minute=0, second=0, microsecond=0)
+
+def increment_hourly_chat_counts(increments, wal_mark=None):
+    """{(guild_id, user_id, hour): 증가량} 형태의 증가분을 시간별 집계에 $inc로 반영합니다 (wal_mark는 increment_chat_counts와 같음)"""
+    if not is_mongo_connected() or not increments:
+        return 0
+
+    extra = {}
+    if wal_mark is not None:
+        extra["$max"] = _wal_mark_field(*wal_mark)
+    operations = [
+        pymongo.UpdateOne(
+            {"guild_id": guild_id, "hour": hour, "user_id": user_id},
+            {"$inc": {"count": amount}, **extra},
+            upsert=True
+        )
+        for (guild_id, user_id, hour), amount in increments.items()
+    ]
+
+    result = hourly_chat_counts_collection.bulk_write(operations, ordered=False)
+    return result.modified_count + result.upserted_count
+
+# 수집 로그(WAL) 재생 ------------------------------------------------------
+# 채팅 카운트/시간별 집계 문서에는 수집 로그별로 반영한 마지막 LSN을 wal_lsn.<writer_id>에 $max로 남김.
+# 재생할 때는 이 값보다 큰 LSN의 기록만 더하므로 같은 기록을 여러 번 재생해도 한 번만 반영됨
+
+def _wal_mark_field(writer_id, lsn):
+    return {f"wal_lsn.{writer_id}": lsn}
+
+def _apply_logged_increments(collection, key_fields, lsns_by_key, writer_id, now=None):
+    """{키: [LSN, ...]} 중 문서에 표시된 LSN보다 큰 기록만 $inc로 반영합니다. 반영한 기록 수 반환"""
+    if not lsns_by_key:
+        return 0
+
+    marks = {}
+    cursor = collection.find(
+        {"$or": [dict(zip(key_fields, key)) for key in lsns_by_key]},
+        {"_id": 0, "wal_lsn": 1, **{field: 1 for field in key_fields}}
+    )
+    for doc in cursor:
+        marks[tuple(doc.get(field) for field in key_fields)] = doc.get("wal_lsn", {}).get(writer_id, 0)
+
+    operations = []
+    applied = 0
+    for key, lsns in lsns_by_key.items():
+        mark = marks.get(key, 0)
+        amount = sum(1 for lsn in lsns if lsn > mark)
+        if not amount:
+            continue
+        update = {"$inc": {"count": amount}, "$max": _wal_mark_field(writer_id, max(lsns))}
+        if now is not None:
+            update["$set"] = {"updated_at": now}
+        operations.append(pymongo.UpdateOne(dict(zip(key_fields, key)), update, upsert=True))
+        applied += amount
+
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+    return applied
+
+def replay_ingest_records(writer_id, records):
+    """수집 로그의 기록 [(lsn, guild_id, user_id, message_id, 시각(UNIX 초))]을 멱등하게 DB에 반영합니다
+
+    메시지는 message_id 기준으로 업서트하고, 새로 저장된 메시지의 기록만 채팅 카운트와 시간별 집계에 더함
+    (카운트 반영 전에 중단된 경우를 위해 wal_lsn 표시보다 큰 LSN만 더함)
+    """
+    if not records:
+        return {"messages": 0, "chat_counts": 0, "hourly": 0}
+
+    now = datetime.now(timezone.utc)
+    documents = [
+        make_message_document(guild_id, user_id, message_id, datetime.fromtimestamp(timestamp, timezone.utc), (writer_id, lsn))
+        for lsn, guild_id, user_id, message_id, timestamp in records
+    ]
+    inserted = save_messages(documents)
+    if inserted is None:
+        # 반영하지 않은 기록을 재생한 것으로 처리하지 않도록 예외로 알림
+        raise ConnectionError("MongoDB에 연결되지 않음")
+
+    count_lsns = {}
+    hourly_lsns = {}
+    for document, is_new in zip(documents, inserted):
+        if not is_new:
+            continue
+        lsn = document["wal_lsn"]
+        count_lsns.setdefault((document["guild_id"], document["user_id"]), []).append(lsn)
+        hourly_lsns.setdefault((document["guild_id"], hour_bucket(document["timestamp"]), document["user_id"]), []).append(lsn)
+
+    return {
+        "messages": sum(inserted),
+        "chat_counts": _apply_logged_increments(chat_counts_collection, ("guild_id", "user_id"), count_lsns, writer_id, now),
+        "hourly": _apply_logged_increments(hourly_chat_counts_collection, ("guild_id", "hour", "user_id"), hourly_lsns, writer_id),
+    }
 
-    return [{"user_id": doc["user_id"]} for doc in cursor]
+def mark_hourly_rollups_live():
+    """시간별 집계가 실시간으로 쌓이기 시작한 시각을 기록합니다 (처음 한 번만)"""
+    if not is_mongo_connected():
+        return None
+
+    now = datetime.now(timezone.utc)
+    rollup_status_collection.update_one(
+        {"_id": ROLLUP_LIVE_ID},
+        {"$setOnInsert": {"since": now}},
+        upsert=True
+    )
+    return rollup_status_collection.find_one({"_id": ROLLUP_LIVE_ID}).get("since")
+
+def get_hourly_rollup_start(guild_id):
+    """시간별 집계만으로 정확하게 합산할 수 있는 가장 이른 시각을 반환합니다 (없으면 None)"""
+    if not is_mongo_connected():
+        return None
+
+    # 백필이 끝난 서버는 전체 기간을 시간별 집계로 합산 가능
+    if rollup_status_collection.find_one({"_id": guild_id}, {"_id": 1}):
+        return datetime.min
+
+    live = rollup_status_collection.find_one({"_id": ROLLUP_LIVE_ID})
+    if not live or not live.get("since"):
+        return None
+
+    # 실시간 집계가 시작된 시간 구간은 일부만 쌓였으므로 다음 구간부터 사용
+    return hour_bucket(live["since"]) + timedelta(hours=1)
+
+def _raw_count_stages(guild_id, timestamp_ranges):
+    """원본 messages 컬렉션에서 사용자별 메시지 수({_id: user_id, count})를 구하는 단계를 만듭니다"""
+    return [
+        {"$match": {"guild_id": guild_id, "$or": [{"timestamp": r} for r in timestamp_ranges]}},
+        {"$group": {"_id": "$user_id", "count": {"$sum": 1}}}
+    ]
+
+def _period_count_pipeline(guild_id, start_date, end_date):
+    """기간의 사용자별 채팅 수 부분합({_id: user_id, count})을 내는 (컬렉션, 파이프라인)을 만듭니다
+
+    시간별 집계로 합산할 수 있는 구간은 hourly_chat_counts에서, 앞뒤 일부 구간은 원본 메시지에서
+    $unionWith로 가져오므로 같은 사용자가 여러 번 나올 수 있음 (호출하는 쪽에서 다시 $group)
+    """
+    start = _to_utc_naive(start_date)
+    end = _to_utc_naive(end_date)
+
+    rollup_start = get_hourly_rollup_start(guild_id)
+    if rollup_start is None:
+        return messages_collection, _raw_count_stages(guild_id, [{"$gte": start, "$lte": end}])
+
+    # [full_start, full_end) 사이의 시간 구간은 기간에 온전히 포함됨 (end는 포함 경계)
+    full_start = hour_bucket(start)
+    if full_start < start:
+        full_start += timedelta(hours=1)
+    full_start = max(full_start, rollup_start)
+    full_end = hour_bucket(end)
+
+    if full_start >= full_end:
+        return messages_collection, _raw_count_stages(guild_id, [{"$gte": start, "$lte": end}])
+
+    # 앞뒤 일부 구간은 원본 메시지로 보충
+    edges = [{"$gte": full_end, "$lte": end}]
+    if start < full_start:
+        edges.insert(0, {"$gte": start, "$lt": full_start})
+
+    pipeline = [
+        {"$match": {"guild_id": guild_id, "hour": {"$gte": full_start, "$lt": full_end}}},
+        {"$group": {"_id": "$user_id", "count": {"$sum": "$count"}}},
+        {"$unionWith": {"coll": messages_collection.name, "pipeline": _raw_count_stages(guild_id, edges)}}
+    ]
+    return hourly_chat_counts_collection, pipeline
+
+def get_chat_counts_in_period(guild_id, start_date, end_date):
+    """특정 기간의 사용자별 채팅 수를 {user_id: count} 형태로 조회합니다 (시간별 집계 + 원본 메시지 보충)"""
+    if not is_mongo_connected():
+        return {}
+
+    collection, pipeline = _period_count_pipeline(guild_id, start_date, end_date)
+    pipeline.append({"$group": {"_id": "$_id", "count": {"$sum": "$count"}}})
+    return {doc["_id"]: doc["count"] for doc in collection.aggregate(pipeline, allowDiskUse=True)}
+
+def get_top_chatters_in_period(guild_id, start_date, end_date, limit=6, exclude_user_ids=None):
+    """특정 기간의 채팅 상위 limit명과 합계를 DB에서 계산합니다
+
+    ([(user_id, count), ...], {"messages": 전체 메시지 수, "chatters": 채팅한 사용자 수}) 반환
+    합계는 제외 사용자를 포함한 값이고, 상위 목록에서만 exclude_user_ids를 뺌
+    """
+    empty_totals = {"messages": 0, "chatters": 0}
+    if not is_mongo_connected():
+        return [], empty_totals
+
+    top_stages = []
+    if exclude_user_ids:
+        top_stages.append({"$match": {"_id": {"$nin": list(exclude_user_ids)}}})
+    # 같은 채팅 수는 사용자 ID 순으로 고정
+    top_stages += [{"$sort": {"count": -1, "_id": 1}}, {"$limit": limit}]
+
+    collection, pipeline = _period_count_pipeline(guild_id, start_date, end_date)
+    pipeline += [
+        {"$group": {"_id": "$_id", "count": {"$sum": "$count"}}},
+        {"$facet": {
+            "top": top_stages,
+            "totals": [{"$group": {"_id": None, "messages": {"$sum": "$count"}, "chatters": {"$sum": 1}}}]
+        }}
+    ]
+
+    result = next(collection.aggregate(pipeline, allowDiskUse=True), None)
+    if not result:
+        return [], empty_totals
+
+    top = [(doc["_id"], doc["count"]) for doc in result["top"]]
+    totals = result["totals"][0] if result["totals"] else empty_totals
+    return top, {"messages": totals["messages"], "chatters": totals["chatters"]}
+
+def backfill_hourly_chat_counts(guild_id, cutoff):
+    """cutoff 이전의 원본 메시지로 서버의 시간별 집계를 다시 만듭니다 ($merge, 여러 번 실행해도 같은 결과)"""
+    if not is_mongo_connected():
+        return False
+
+    cutoff = hour_bucket(cutoff)
+    pipeline = [
+        {"$match": {"guild_id": guild_id, "timestamp": {"$lt": cutoff}}},
+        {"$group": {
+            "_id": {
+                "user_id": "$user_id",
+                "hour": {"$dateFromParts": {
+                    "year": {"$year": "$timestamp"},
+                    "month": {"$month": "$timestamp"},
+                    "day": {"$dayOfMonth": "$timestamp"},
+                    "hour": {"$hour": "$timestamp"}
+                }}
+            },
+            "count": {"$sum": 1}
+        }},
+        {"$project": {
+            "_id": 0,
+            "guild_id": {"$literal": guild_id},
+            "user_id": "$_id.user_id",
+            "hour": "$_id.hour",
+            "count": 1
+        }},
+        {"$merge": {
+            "into": hourly_chat_counts_collection.name,
+            "on": ["guild_id", "hour", "user_id"],
+            "whenMatched": "merge",
+            "whenNotMatched": "insert"
+        }}
+    ]
+    messages_collection.aggregate(pipeline, allowDiskUse=True)
+
+    rollup_status_collection.update_one(
+        {"_id": guild_id},
+        {"$set": {"backfilled_before": cutoff, "backfilled_at": datetime.now(timezone.utc)}},
+        upsert=True
+    )
+    return True
+
+# 서버의 채팅 기록 날짜 범위 조회 (메뉴얼 서버 정보에서 사용)
+def get_message_date_range(guild_id, count_limit=10000):
+    """가장 오래된/최근 메시지 시각과 (최대 count_limit까지의) 메시지 수를 조회합니다"""
+    if not is_mongo_connected():
+        return None, None, 0
+
+    oldest = list(messages_collection.find(
+        {"guild_id": guild_id},
+        {"timestamp": 1, "_id": 0}
+    ).sort("timestamp", 1).limit(1).max_time_ms(5000))
+
+    newest = list(messages_collection.find(
+        {"guild_id": guild_id},
+        {"timestamp": 1, "_id": 0}
+    ).sort("timestamp", -1).limit(1).max_time_ms(5000))
+
+    if not oldest or not newest:
+        return None, None, 0
+
+    total = messages_collection.count_documents(
+        {"guild_id": guild_id},
+        limit=count_limit,
+        maxTimeMS=3000
+    )
+    return oldest[0].get("timestamp"), newest[0].get("timestamp"), total
 
 # 추가: 집계 날짜 저장 함수
 def save_last_aggregate_date(guild_id):
@@ -212,15 +939,63 @@ def save_last_aggregate_date(guild_id):
     if not is_mongo_connected():
         return
 
-    aggregate_dates_collection.update_one(
-        {"guild_id": guild_id},
-        {"$set": {
-            "guild_id": guild_id,
-            "last_aggregate_date": datetime.now(timezone.utc),
-            "updated_at": datetime.now(timezone.utc)
-        }},
-        upsert=True
+    _update_guild_config(guild_id, {"$set": {"last_aggregate_date": datetime.now(timezone.utc)}})
+
+# 예약 집계 설정 저장
+def set_aggregate_schedule(guild_id, weekday, hour, minute, period_days, channel_id, next_run_at):
+    """서버 설정에 예약 집계(매주 weekday요일 hour:minute, KST)를 저장합니다"""
+    if not is_mongo_connected():
+        return False
+
+    _update_guild_config(guild_id, {"$set": {"aggregate_schedule": {
+        "weekday": weekday,
+        "hour": hour,
+        "minute": minute,
+        "period_days": period_days,
+        "channel_id": channel_id,
+        "next_run_at": next_run_at,
+    }}})
+    return True
+
+def clear_aggregate_schedule(guild_id):
+    """예약 집계를 해제합니다. 해제되었으면 True"""
+    if not is_mongo_connected():
+        return False
+
+    _ensure_guild_config_migrated(guild_id)
+    result = guild_configs_collection.update_one(
+        {"_id": guild_id, "aggregate_schedule": {"$exists": True}},
+        {
+            "$unset": {"aggregate_schedule": ""},
+            "$set": {"updated_at": datetime.now(timezone.utc)}
+        }
+    )
+    return result.modified_count > 0
+
+def get_due_aggregate_schedules(now):
+    """실행 시각이 지난 예약 집계를 조회합니다. [(guild_id, 예약 설정)] 반환"""
+    if not is_mongo_connected():
+        return []
+
+    cursor = guild_configs_collection.find(
+        {"aggregate_schedule.next_run_at": {"$lte": now}},
+        {"aggregate_schedule": 1}
+    ).sort("aggregate_schedule.next_run_at", 1)
+    return [(doc["_id"], doc["aggregate_schedule"]) for doc in cursor]
+
+def claim_aggregate_schedule(guild_id, expected_run_at, next_run_at):
+    """예약 실행을 가져갑니다 (next_run_at을 다음 실행 시각으로 옮김). 가져왔으면 True
+
+    next_run_at이 조회한 값 그대로일 때만 바꾸므로 여러 인스턴스가 같은 실행을 중복으로 가져가지 않음
+    """
+    if not is_mongo_connected():
+        return False
+
+    result = guild_configs_collection.update_one(
+        {"_id": guild_id, "aggregate_schedule.next_run_at": expected_run_at},
+        {"$set": {"aggregate_schedule.next_run_at": next_run_at, "updated_at": datetime.now(timezone.utc)}}
     )
+    return result.modified_count > 0
 
 # 추가: 집계 날짜 조회 함수
 def get_last_aggregate_date(guild_id):
@@ -228,16 +1003,24 @@ def get_last_aggregate_date(guild_id):
     if not is_mongo_connected():
         return None
 
-    doc = aggregate_dates_collection.find_one({"guild_id": guild_id})
-    return doc["last_aggregate_date"] if doc else None
+    config = get_guild_config(guild_id)
+    return config.get("last_aggregate_date") if config else None
 
 # 추가: 채팅 카운트 초기화 함수
-def reset_chat_counts(guild_id):
-    """특정 길드의 모든 채팅 카운트를 초기화합니다"""
+def reset_chat_counts(guild_id, job_id=None):
+    """특정 길드의 모든 채팅 카운트를 초기화합니다
+
+    job_id: 초기화한 집계 작업, 재개한 작업이 같은 초기화를 다시 하지 않도록 서버 설정에 남김
+    """
     if not is_mongo_connected():
         return
 
     chat_counts_collection.delete_many({"guild_id": guild_id})
+    # 삭제는 updated_at으로 찾을 수 없으므로 서버 설정에 초기화 시각을 남김 (스냅샷 복원 시 확인)
+    fields = {"chat_counts_reset_at": datetime.now(timezone.utc)}
+    if job_id is not None:
+        fields["chat_counts_reset_job_id"] = job_id
+    _update_guild_config(guild_id, {"$set": fields})
 
 # 추가: 역할 연속 기록 조회 함수
 def get_role_streak(guild_id, user_id):
@@ -275,6 +1058,65 @@ def update_role_streak(guild_id, user_id, role_type):
 
     return new_streak
 
+def get_role_streaks(guild_id, user_ids):
+    """여러 사용자의 역할 연속 기록을 한 번에 조회합니다. {user_id: {"type", "count"}} 반환 (기록이 없으면 count 0)"""
+    user_ids = list(user_ids)
+    result = {user_id: {"type": None, "count": 0} for user_id in user_ids}
+    if not is_mongo_connected() or not user_ids:
+        return result
+
+    cursor = role_streaks_collection.find(
+        {"guild_id": guild_id, "user_id": {"$in": user_ids}},
+        {"_id": 0, "user_id": 1, "role_type": 1, "streak_count": 1}
+    )
+    for doc in cursor:
+        result[doc["user_id"]] = {"type": doc.get("role_type"), "count": doc.get("streak_count", 0)}
+    return result
+
+def update_ranking_streaks(guild_id, role_types, dropped_user_ids=None, lookup_user_ids=None, job_id=None):
+    """집계 결과의 연속 기록을 한 번의 bulk_write로 반영합니다
+
+    role_types: {user_id: "first" 또는 "other"}, 같은 역할이면 +1 아니면 1부터 다시 시작
+    dropped_user_ids: 순위권에서 벗어나 0으로 초기화할 사용자
+    job_id: 집계 작업 ID, 이미 이 작업으로 증가한 기록은 다시 증가하지 않음 (재개 시 중복 방지)
+    role_types와 lookup_user_ids 사용자의 새 연속 기록을 {user_id: {"type", "count"}}로 반환
+    """
+    lookup = list(role_types) + [user_id for user_id in (lookup_user_ids or []) if user_id not in role_types]
+    if not is_mongo_connected():
+        return {user_id: {"type": role_types.get(user_id), "count": 1 if user_id in role_types else 0} for user_id in lookup}
+
+    now = datetime.now(timezone.utc)
+    operations = []
+    for user_id, role_type in role_types.items():
+        # 파이프라인 업데이트: 이전 role_type과 비교해 한 번에 증가/재시작 (find_one 없이)
+        streak_count = {"$cond": [
+            {"$eq": ["$role_type", role_type]},
+            {"$add": [{"$ifNull": ["$streak_count", 0]}, 1]},
+            1
+        ]}
+        fields = {"role_type": role_type, "updated_at": now}
+        if job_id is not None:
+            streak_count = {"$cond": [{"$eq": ["$streak_job_id", job_id]}, "$streak_count", streak_count]}
+            fields["streak_job_id"] = job_id
+        fields["streak_count"] = streak_count
+        operations.append(pymongo.UpdateOne(
+            {"guild_id": guild_id, "user_id": user_id},
+            [{"$set": fields}],
+            upsert=True
+        ))
+
+    dropped = [user_id for user_id in (dropped_user_ids or []) if user_id not in role_types]
+    if dropped:
+        operations.append(pymongo.UpdateMany(
+            {"guild_id": guild_id, "user_id": {"$in": dropped}},
+            {"$set": {"streak_count": 0, "updated_at": now}}
+        ))
+
+    if operations:
+        role_streaks_collection.bulk_write(operations, ordered=False)
+
+    return get_role_streaks(guild_id, lookup)
+
 # 연속 기록 초기화 함수
 def reset_role_streaks(guild_id):
     """특정 길드의 모든 연속 기록을 초기화합니다"""
@@ -352,15 +1194,11 @@ def use_auth_code(code, guild_id):
     )
 
     # 서버 인증 상태 저장
-    authorized_guilds_collection.update_one(
-        {"guild_id": guild_id},
-        {"$set": {
-            "guild_id": guild_id,
-            "authorized_at": datetime.now(timezone.utc),
-            "auth_code": code
-        }},
-        upsert=True
-    )
+    _update_guild_config(guild_id, {"$set": {
+        "authorized": True,
+        "authorized_at": datetime.now(timezone.utc),
+        "auth_code": code
+    }})
 
     return True
 
@@ -370,11 +1208,9 @@ def load_authorized_guilds():
     if not is_mongo_connected():
         return {}
 
-    result = {}
-    for doc in authorized_guilds_collection.find():
-        result[doc["guild_id"]] = True
+    ensure_guild_configs_migrated()
 
-    return result
+    return {doc["_id"]: True for doc in guild_configs_collection.find({"authorized": True}, {"_id": 1})}
 
 # 추가: 서버 인증 상태 확인 함수
 def is_guild_authorized(guild_id):
@@ -382,7 +1218,8 @@ def is_guild_authorized(guild_id):
     if not is_mongo_connected():
         return False
 
-    return authorized_guilds_collection.find_one({"guild_id": guild_id}) is not None
+    config = get_guild_config(guild_id)
+    return bool(config and config.get("authorized"))
 
 # 서버 인증 취소 함수
 def delete_authorized_guild(guild_id):
@@ -390,8 +1227,35 @@ def delete_authorized_guild(guild_id):
     if not is_mongo_connected():
         return False
 
-    result = authorized_guilds_collection.delete_one({"guild_id": guild_id})
-    return result.deleted_count > 0
+    _ensure_guild_config_migrated(guild_id)
+    result = guild_configs_collection.update_one(
+        {"_id": guild_id, "authorized": True},
+        {
+            "$set": {"authorized": False, "updated_at": datetime.now(timezone.utc)},
+            "$unset": {"authorized_at": "", "auth_code": ""}
+        }
+    )
+    return result.modified_count > 0
+
+# 인증된 서버 목록 조회 (관리 패널용, 최신순)
+def list_authorized_guilds():
+    """인증된 서버 목록을 (guild_id, authorized_at, auth_code) 형태로 조회합니다"""
+    if not is_mongo_connected():
+        return []
+
+    ensure_guild_configs_migrated()
+
+    cursor = guild_configs_collection.find({"authorized": True}).sort("authorized_at", -1)
+    return [(doc["_id"], doc.get("authorized_at", ""), doc.get("auth_code", "")) for doc in cursor]
+
+# 미사용 인증 코드 목록 조회 (관리 패널용, 최신순)
+def list_unused_auth_codes():
+    """사용되지 않은 인증 코드를 (code, created_at) 형태로 조회합니다"""
+    if not is_mongo_connected():
+        return []
+
+    cursor = auth_codes_collection.find({"used": False}).sort("created_at", -1)
+    return [(doc["code"], doc.get("created_at", "")) for doc in cursor]
 
 # 인증 코드 삭제 함수
 def delete_auth_code(code):
@@ -403,8 +1267,14 @@ def delete_auth_code(code):
     return result.deleted_count > 0
 
 # 새로운 함수: 집계 기록 저장
-def save_aggregate_history(guild_id, aggregate_date, start_date, end_date, top_chatters, first_role_name=None, first_role_color=None, other_role_name=None, other_role_color=None):
-    """집계 결과를 저장합니다"""
+def save_aggregate_history(guild_id, aggregate_date, start_date, end_date, top_chatters, first_role_name=None, first_role_color=None, other_role_name=None, other_role_color=None,
+                           trigger=None, status="ok", timings=None, error=None, scheduled_for=None, job_id=None):
+    """집계 결과를 저장합니다
+
+    trigger: 실행 방식 ("command", "text", "schedule"), timings: 단계별 소요 시간(ms)
+    예약 집계는 실패한 실행도 status와 error로 남김
+    job_id: 집계 작업 ID, 같은 작업의 기록은 한 번만 저장 (재개 시 중복 방지)
+    """
     if not is_mongo_connected():
         print(f"⚠️ MongoDB에 연결되지 않아 집계 기록을 저장할 수 없습니다 (길드: {guild_id})")
         return False
@@ -440,8 +1310,23 @@ def save_aggregate_history(guild_id, aggregate_date, start_date, end_date, top_c
             "end_date": end_date,
             "top_chatters": formatted_chatters,
             "role_info": role_info,
+            "status": status,
             "created_at": datetime.now(timezone.utc)
         }
+        if trigger:
+            document["trigger"] = trigger
+        if timings:
+            document["timings"] = timings
+        if error:
+            document["error"] = error
+        if scheduled_for:
+            document["scheduled_for"] = scheduled_for
+
+        if job_id is not None:
+            document["job_id"] = job_id
+            result = aggregate_history_collection.update_one({"job_id": job_id}, {"$setOnInsert": document}, upsert=True)
+            print(f"✅ 집계 기록 저장 완료: 길드 {guild_id}, 작업: {job_id}")
+            return result.upserted_id or True
         
         result = aggregate_history_collection.insert_one(document)
         print(f"✅ 집계 기록 저장 완료: 길드 {guild_id}, ID: {result.inserted_id}")
@@ -492,24 +1377,67 @@ def get_aggregate_record(record_id):
         import traceback
         traceback.print_exc()
         return None
+
+# 집계 작업 생성
+def create_aggregate_job(document):
+    """집계 작업을 저장합니다. 같은 서버에 진행 중인 작업이 있으면 None
+
+    진행 중인 작업은 active_guild_id(유니크 sparse 인덱스)를 가지므로 서버마다 하나만 저장됨
+    """
+    if not is_mongo_connected():
+        return None
+
+    document = dict(document, active_guild_id=document["guild_id"])
     try:
-        # 기존 데이터 삭제
-        delete_result = excluded_roles_collection.delete_many({"guild_id": guild_id})
-        
-        # 새 데이터 저장
-        if excluded_roles:
-            documents = [
-                {"guild_id": guild_id, "role_id": role_id, "updated_at": datetime.now(timezone.utc)}
-                for role_id in excluded_roles
-            ]
-            insert_result = excluded_roles_collection.insert_many(documents)
-            print(f"제외 역할 저장 완료: 길드 {guild_id}, {len(excluded_roles)}개 역할, 삭제: {delete_result.deleted_count}개, 삽입: {len(insert_result.inserted_ids)}개")
-        else:
-            print(f"제외 역할 초기화: 길드 {guild_id}, 삭제: {delete_result.deleted_count}개")
-    except Exception as e:
-        print(f"⚠️ 제외 역할 저장 중 오류 발생: {e}")
-        import traceback
-        traceback.print_exc()
+        document["_id"] = aggregate_jobs_collection.insert_one(document).inserted_id
+    except pymongo.errors.DuplicateKeyError:
+        return None
+    return document
+
+def get_active_aggregate_job(guild_id):
+    """서버에서 진행 중인 집계 작업을 조회합니다 (없으면 None)"""
+    if not is_mongo_connected():
+        return None
+
+    return aggregate_jobs_collection.find_one({"active_guild_id": guild_id})
+
+def get_resumable_aggregate_jobs(now):
+    """임대가 끝난(실행하던 프로세스가 멈춘) 진행 중인 집계 작업을 조회합니다"""
+    if not is_mongo_connected():
+        return []
+
+    return list(aggregate_jobs_collection.find({"active_guild_id": {"$exists": True}, "lease_until": {"$lt": now}}))
+
+def claim_aggregate_job(job_id, owner, lease_until, now):
+    """임대가 끝난 집계 작업을 가져옵니다 (시도 횟수 증가). 가져온 작업 문서 또는 None"""
+    if not is_mongo_connected():
+        return None
+
+    return aggregate_jobs_collection.find_one_and_update(
+        {"_id": job_id, "active_guild_id": {"$exists": True}, "lease_until": {"$lt": now}},
+        {"$set": {"lease_owner": owner, "lease_until": lease_until, "updated_at": now}, "$inc": {"attempts": 1}},
+        return_document=pymongo.ReturnDocument.AFTER
+    )
+
+def update_aggregate_job(job_id, owner, update):
+    """임대를 가진 프로세스만 진행 중인 집계 작업을 고칩니다 (단계 완료, 임대 연장). 고쳤으면 True"""
+    if not is_mongo_connected():
+        return False
+
+    update.setdefault("$set", {})["updated_at"] = datetime.now(timezone.utc)
+    result = aggregate_jobs_collection.update_one(
+        {"_id": job_id, "lease_owner": owner, "active_guild_id": {"$exists": True}},
+        update
+    )
+    return result.matched_count > 0
+
+def finish_aggregate_job(job_id, owner, status, error=None):
+    """집계 작업을 끝내고 서버 임대를 풉니다. 끝냈으면 True"""
+    now = datetime.now(timezone.utc)
+    fields = {"status": status, "finished_at": now}
+    if error:
+        fields["error"] = error
+    return update_aggregate_job(job_id, owner, {"$set": fields, "$unset": {"active_guild_id": "", "lease_until": ""}})
 
 # 기존 코드 뒤에 추가
 def reset_user_role_streak(guild_id, user_id):
@@ -528,9 +1456,10 @@ def reset_user_role_streak(guild_id, user_id):
     return result.modified_count > 0
 
 # 서버 정보 저장/업데이트 함수 (슬래시 명령어에서 사용)
-def save_guild_info(guild):
+def save_guild_info(guild, member_ids=None):
     """
     guild: disnake.Guild 객체
+    member_ids: 채팅 기록이 있는 사용자 ID 목록 (None이면 메모리 캐시에서 추출)
     DB 구조:
     {
       guild_id: int,
@@ -544,13 +1473,14 @@ def save_guild_info(guild):
     }
     """
     # 채팅 기록이 1회 이상인 사용자 ID 목록 추출
-    member_ids = []
-    try:
-        from bot import server_chat_counts
-        chat_counts = server_chat_counts.get(guild.id, {})
-        member_ids = [uid for uid, cnt in chat_counts.items() if cnt > 0]
-    except Exception as e:
-        print(f"[save_guild_info] member_ids 추출 오류: {e}")
+    if member_ids is None:
+        member_ids = []
+        try:
+            from bot import server_chat_counts
+            chat_counts = server_chat_counts.get(guild.id, {})
+            member_ids = [uid for uid, cnt in chat_counts.items() if cnt > 0]
+        except Exception as e:
+            print(f"[save_guild_info] member_ids 추출 오류: {e}")
 
     # 기존 DB의 member_ids와 합집합 처리
     try:
@@ -578,4 +1508,48 @@ def save_guild_info(guild):
         },
         upsert=True
     )
-    return result.modified_count > 0 or result.upserted_id is not None
\ No newline at end of file
+    return result.modified_count > 0 or result.upserted_id is not None
+
+# 역할 원래 색상 저장 (역할색상 명령어에서 사용)
+def save_role_original_color(guild_id, role_id, color):
+    """역할의 원래 색상을 저장합니다"""
+    if not is_mongo_connected():
+        return
+
+    _update_guild_config(guild_id, {"$set": {f"role_colors.{role_id}": color}})
+
+# 역할 원래 색상 조회
+def get_role_original_color(guild_id, role_id):
+    """저장된 역할의 원래 색상을 조회합니다 (없으면 None)"""
+    if not is_mongo_connected():
+        return None
+
+    config = get_guild_config(guild_id)
+    if not config:
+        return None
+    return config.get("role_colors", {}).get(str(role_id))
+
+# 사용자 정보 저장 (메시지를 보낸 사용자)
+def save_user_data(user, guild_id):
+    """
+    user: disnake.Member 객체
+    users 컬렉션에 사용자 기본 정보와 참여 서버 목록을 저장합니다
+    """
+    if not is_mongo_connected():
+        return False
+
+    result = users_collection.update_one(
+        {"user_id": user.id},
+        {
+            "$set": {
+                "name": user.name,
+                "display_name": user.display_name,
+                "avatar_url": user.display_avatar.url if user.display_avatar else None,
+                "updated_at": datetime.now(timezone.utc)
+            },
+            "$addToSet": {"guild_ids": guild_id},
+            "$setOnInsert": {"created_at": datetime.now(timezone.utc)}
+        },
+        upsert=True
+    )
+    return result.modified_count > 0 or result.upserted_id is not None
@@ -0,0 +1,249 @@
+import pymongo
+
+# 컬렉션별로 필요한 인덱스 선언
+# keys: 인덱스 키 목록, unique: 유니크 여부, sparse: 필드가 있는 문서만 포함, queries: 이 인덱스를 사용하는 조회 (설명용)
+INDEX_SPECS = {
+    "messages": [
+        {"keys": [("guild_id", 1), ("timestamp", 1)],
+         "queries": "기간별 메시지 조회/집계, 서버별 가장 오래된/최근 메시지 (manual.py)"},
+        {"keys": [("guild_id", 1), ("message_id", 1)], "unique": True,
+         "queries": "메시지 $setOnInsert 업서트 (같은 메시지를 한 번만 저장/카운트), 수집 로그 재생 시 저장 여부 확인"},
+    ],
+    "chat_counts": [
+        {"keys": [("guild_id", 1), ("user_id", 1)], "unique": True,
+         "queries": "서버별 채팅 카운트 로드, 채팅 카운트 $inc 업서트"},
+        {"keys": [("updated_at", 1)],
+         "queries": "스냅샷 이후 바뀐 채팅 카운트 (시작 시 스냅샷 복원)"},
+    ],
+    "hourly_chat_counts": [
+        {"keys": [("guild_id", 1), ("hour", 1), ("user_id", 1)], "unique": True,
+         "queries": "시간별 집계 기간 합산, $inc 업서트, 백필 $merge 기준 키"},
+    ],
+    "role_streaks": [
+        {"keys": [("guild_id", 1), ("user_id", 1)], "unique": True,
+         "queries": "사용자별 연속 기록 조회/갱신, 서버별 연속 기록 초기화"},
+        {"keys": [("updated_at", 1)],
+         "queries": "스냅샷 이후 바뀐 연속 기록 (시작 시 스냅샷 복원)"},
+    ],
+    "guild_configs": [
+        {"keys": [("authorized", 1), ("authorized_at", -1)],
+         "queries": "인증된 서버 목록 (관리 패널, 시작 시 인증 캐시)"},
+        {"keys": [("updated_at", 1)],
+         "queries": "스냅샷 이후 바뀐 서버 설정 (시작 시 스냅샷 복원)"},
+        {"keys": [("aggregate_schedule.next_run_at", 1)], "sparse": True,
+         "queries": "실행 시각이 지난 예약 집계 조회 (예약 집계 스케줄러)"},
+    ],
+    # roles, excluded_roles, aggregate_dates, authorized_guilds, role_colors는 guild_configs 이전 전의 컬렉션
+    "roles": [
+        {"keys": [("guild_id", 1)], "unique": True,
+         "queries": "guild_configs 이전 시 서버별 역할 설정 조회"},
+    ],
+    "excluded_roles": [
+        {"keys": [("guild_id", 1), ("role_id", 1)],
+         "queries": "guild_configs 이전 시 서버별 제외 역할 조회"},
+    ],
+    "aggregate_dates": [
+        {"keys": [("guild_id", 1)], "unique": True,
+         "queries": "guild_configs 이전 시 마지막 집계 날짜 조회"},
+    ],
+    "aggregate_history": [
+        {"keys": [("guild_id", 1), ("aggregate_date", -1)],
+         "queries": "서버별 집계 기록 최신순 조회"},
+        {"keys": [("job_id", 1)], "unique": True, "sparse": True,
+         "queries": "집계 작업 기록 $setOnInsert 업서트 (재개한 작업의 기록을 한 번만 저장)"},
+    ],
+    "aggregate_jobs": [
+        {"keys": [("active_guild_id", 1)], "unique": True, "sparse": True,
+         "queries": "서버별 진행 중인 집계 작업 (서버마다 하나만, 임대), 임대가 끝난 작업 재개"},
+    ],
+    "auth_codes": [
+        {"keys": [("code", 1)], "unique": True,
+         "queries": "인증 코드 확인/사용/삭제"},
+        {"keys": [("used", 1), ("created_at", -1)],
+         "queries": "미사용 인증 코드 목록 (!list)"},
+    ],
+    "authorized_guilds": [
+        {"keys": [("guild_id", 1)], "unique": True,
+         "queries": "guild_configs 이전 시 서버 인증 여부 조회"},
+    ],
+    "role_colors": [
+        {"keys": [("guild_id", 1), ("role_id", 1)], "unique": True,
+         "queries": "guild_configs 이전 시 역할 원래 색상 조회"},
+    ],
+    "users": [
+        {"keys": [("user_id", 1)], "unique": True,
+         "queries": "메시지를 보낸 사용자 정보 업서트"},
+    ],
+    "guilds": [
+        {"keys": [("guild_id", 1)], "unique": True,
+         "queries": "서버 정보 조회/업서트"},
+    ],
+}
+
+# 인덱스를 타야 하는 주요 조회 (explain으로 COLLSCAN 여부 확인)
+HOT_QUERIES = [
+    {"collection": "messages", "filter": {"guild_id": 0, "timestamp": {"$gte": 0, "$lte": 0}},
+     "description": "기간별 메시지 조회"},
+    {"collection": "messages", "filter": {"guild_id": 0}, "sort": [("timestamp", 1)],
+     "description": "서버별 가장 오래된 메시지"},
+    {"collection": "messages", "filter": {"guild_id": 0, "message_id": 0},
+     "description": "메시지 업서트 대상"},
+    {"collection": "chat_counts", "filter": {"guild_id": 0},
+     "description": "서버별 채팅 카운트 로드"},
+    {"collection": "chat_counts", "filter": {"guild_id": 0, "user_id": 0},
+     "description": "채팅 카운트 업서트 대상"},
+    {"collection": "chat_counts", "filter": {"updated_at": {"$gte": 0}},
+     "description": "스냅샷 이후 바뀐 채팅 카운트"},
+    {"collection": "hourly_chat_counts", "filter": {"guild_id": 0, "hour": {"$gte": 0, "$lt": 0}},
+     "description": "시간별 집계 기간 합산"},
+    {"collection": "role_streaks", "filter": {"guild_id": 0, "user_id": 0},
+     "description": "사용자별 연속 기록"},
+    {"collection": "role_streaks", "filter": {"updated_at": {"$gte": 0}},
+     "description": "스냅샷 이후 바뀐 연속 기록"},
+    {"collection": "guild_configs", "filter": {"_id": 0},
+     "description": "서버 설정 문서"},
+    {"collection": "guild_configs", "filter": {"authorized": True}, "sort": [("authorized_at", -1)],
+     "description": "인증된 서버 목록"},
+    {"collection": "guild_configs", "filter": {"updated_at": {"$gte": 0}},
+     "description": "스냅샷 이후 바뀐 서버 설정"},
+    {"collection": "guild_configs", "filter": {"aggregate_schedule.next_run_at": {"$lte": 0}},
+     "sort": [("aggregate_schedule.next_run_at", 1)],
+     "description": "실행 시각이 지난 예약 집계"},
+    {"collection": "aggregate_history", "filter": {"guild_id": 0}, "sort": [("aggregate_date", -1)],
+     "description": "집계 기록 최신순"},
+    {"collection": "aggregate_jobs", "filter": {"active_guild_id": {"$exists": True}, "lease_until": {"$lt": 0}},
+     "description": "임대가 끝난 집계 작업"},
+    {"collection": "auth_codes", "filter": {"code": ""},
+     "description": "인증 코드 확인"},
+    {"collection": "auth_codes", "filter": {"used": False}, "sort": [("created_at", -1)],
+     "description": "미사용 인증 코드 목록"},
+    {"collection": "users", "filter": {"user_id": 0},
+     "description": "사용자 정보"},
+    {"collection": "guilds", "filter": {"guild_id": 0},
+     "description": "서버 정보"},
+]
+
+
+def _key_pattern(keys):
+    # 텍스트/해시 인덱스는 방향 대신 문자열이므로 그대로 둠
+    return tuple((field, direction if isinstance(direction, str) else int(direction)) for field, direction in keys)
+
+
+def _existing_indexes(collection):
+    """{키 패턴: 인덱스 정보} 형태로 현재 인덱스를 반환합니다"""
+    return {_key_pattern(info["key"]): dict(info, name=name)
+            for name, info in collection.index_information().items()}
+
+
+def ensure_indexes(database, create=True):
+    """선언된 인덱스가 모두 있는지 확인하고 없으면 만듭니다. {created, missing, failed, present} 목록을 반환"""
+    report = {"created": [], "missing": [], "failed": [], "present": []}
+
+    for collection_name, specs in INDEX_SPECS.items():
+        collection = database[collection_name]
+        try:
+            existing = _existing_indexes(collection)
+        except Exception as e:
+            report["failed"].append((collection_name, None, str(e)))
+            continue
+
+        for spec in specs:
+            pattern = _key_pattern(spec["keys"])
+            label = f"{collection_name}({', '.join(f'{field}:{direction}' for field, direction in pattern)})"
+            current = existing.get(pattern)
+
+            if current is not None:
+                if spec.get("unique", False) and not current.get("unique", False):
+                    # 같은 키의 일반 인덱스가 이미 있으면 자동으로 바꾸지 않고 알림만 남김
+                    report["failed"].append((label, current["name"], "유니크가 아닌 인덱스가 이미 있음"))
+                else:
+                    report["present"].append(label)
+                continue
+
+            if not create:
+                report["missing"].append(label)
+                continue
+
+            try:
+                collection.create_index(spec["keys"], unique=spec.get("unique", False),
+                                        sparse=spec.get("sparse", False), background=True)
+                report["created"].append(label)
+            except pymongo.errors.OperationFailure as e:
+                if e.code == 11000:
+                    report["failed"].append((label, None, f"중복 데이터로 유니크 인덱스 생성 실패: {e}"))
+                else:
+                    report["failed"].append((label, None, str(e)))
+            except Exception as e:
+                report["failed"].append((label, None, str(e)))
+
+    return report
+
+
+def print_index_report(report):
+    if report["created"]:
+        print(f"인덱스 생성 완료: {', '.join(report['created'])}")
+    if report["missing"]:
+        print(f"⚠️ 없는 인덱스: {', '.join(report['missing'])}")
+    for label, name, error in report["failed"]:
+        print(f"⚠️ 인덱스 확인 실패 {label}{f' [{name}]' if name else ''}: {error}")
+    if not report["created"] and not report["missing"] and not report["failed"]:
+        print(f"인덱스 확인 완료: {len(report['present'])}개 모두 있음")
+
+
+def find_unused_indexes(database):
+    """$indexStats로 사용되지 않았거나 선언되지 않은 인덱스를 찾습니다. [(컬렉션, 이름, 사용 횟수, 사유)] 반환"""
+    results = []
+    for collection_name in database.list_collection_names():
+        if collection_name.startswith("system."):
+            continue
+
+        declared = {_key_pattern(spec["keys"]) for spec in INDEX_SPECS.get(collection_name, [])}
+        try:
+            stats = list(database[collection_name].aggregate([{"$indexStats": {}}]))
+        except Exception as e:
+            results.append((collection_name, None, None, f"$indexStats 실패: {e}"))
+            continue
+
+        for stat in stats:
+            name = stat["name"]
+            if name == "_id_":
+                continue
+            ops = stat.get("accesses", {}).get("ops", 0)
+            if _key_pattern(stat["key"].items()) not in declared:
+                results.append((collection_name, name, ops, "INDEX_SPECS에 선언되지 않음"))
+            elif ops == 0:
+                results.append((collection_name, name, ops, f"{stat.get('accesses', {}).get('since')} 이후 사용되지 않음"))
+    return results
+
+
+def _plan_stages(plan):
+    """실행 계획에 포함된 모든 stage 이름을 모읍니다"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(_plan_stages(item))
+    return stages
+
+
+def explain_hot_queries(database):
+    """주요 조회를 explain하여 [(설명, 컬렉션, IXSCAN 여부, stage 목록)]을 반환합니다"""
+    results = []
+    for query in HOT_QUERIES:
+        cursor = database[query["collection"]].find(query["filter"])
+        if query.get("sort"):
+            cursor = cursor.sort(query["sort"])
+        try:
+            plan = cursor.explain().get("queryPlanner", {}).get("winningPlan", {})
+        except Exception as e:
+            results.append((query["description"], query["collection"], False, [f"explain 실패: {e}"]))
+            continue
+
+        stages = _plan_stages(plan)
+        uses_index = "COLLSCAN" not in stages and any(stage in ("IXSCAN", "IDHACK", "EXPRESS_IXSCAN") for stage in stages)
+        results.append((query["description"], query["collection"], uses_index, stages))
+    return results
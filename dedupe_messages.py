@@ -0,0 +1,62 @@
+import sys
+
+import database as db
+from db_schema import ensure_indexes, print_index_report
+
+# 사용법: python dedupe_messages.py [guild_id ...]
+# messages 컬렉션에서 같은 (guild_id, message_id)로 여러 번 저장된 메시지를 하나만 남기고 지운 뒤
+# (guild_id, message_id) 유니크 인덱스를 만듭니다. 서버 ID를 지정하지 않으면 모든 서버를 처리합니다.
+# 예전에는 메시지를 중복 확인 없이 저장했으므로 유니크 인덱스 생성이 실패하면 먼저 이 스크립트를 실행합니다.
+# 이미 중복으로 더해진 채팅 카운트는 고치지 않습니다.
+
+DELETE_BATCH_SIZE = 1000
+
+def dedupe_guild_messages(guild_id):
+    """서버의 중복 메시지를 지우고 지운 문서 수를 반환합니다 (가장 먼저 저장된 문서를 남김)"""
+    pipeline = [
+        {"$match": {"guild_id": guild_id}},
+        {"$sort": {"_id": 1}},
+        {"$group": {"_id": "$message_id", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ]
+    extra_ids = []
+    for group in db.messages_collection.aggregate(pipeline, allowDiskUse=True):
+        extra_ids.extend(group["ids"][1:])
+
+    deleted = 0
+    for start in range(0, len(extra_ids), DELETE_BATCH_SIZE):
+        result = db.messages_collection.delete_many({"_id": {"$in": extra_ids[start:start + DELETE_BATCH_SIZE]}})
+        deleted += result.deleted_count
+    return deleted
+
+def dedupe_messages(guild_ids=None):
+    if not db.is_mongo_connected():
+        print("❌ MongoDB에 연결되지 않았습니다.")
+        return False
+
+    if not guild_ids:
+        guild_ids = db.messages_collection.distinct("guild_id")
+
+    print(f"중복 메시지 정리 시작: 서버 {len(guild_ids)}개")
+    total = 0
+    failed = 0
+    for index, guild_id in enumerate(guild_ids, 1):
+        try:
+            deleted = dedupe_guild_messages(guild_id)
+        except Exception as e:
+            failed += 1
+            print(f"❌ [{index}/{len(guild_ids)}] 서버 {guild_id} 정리 실패: {e}")
+            continue
+        total += deleted
+        if deleted:
+            print(f"✅ [{index}/{len(guild_ids)}] 서버 {guild_id}: 중복 메시지 {deleted}개 삭제")
+
+    print(f"중복 메시지 정리 완료: {total}개 삭제 (실패 {failed}개)")
+
+    # 정리 후 유니크 인덱스 생성 (중복이 남은 서버가 있으면 실패로 보고)
+    report = ensure_indexes(db.db)
+    print_index_report(report)
+    return failed == 0 and not report["failed"]
+
+if __name__ == "__main__":
+    sys.exit(0 if dedupe_messages([int(arg) for arg in sys.argv[1:]]) else 1)
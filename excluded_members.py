@@ -0,0 +1,77 @@
+class ExcludedMemberIndex:
+    """서버별로 제외 역할을 가진 멤버 ID 집합을 유지합니다
+
+    처음 조회할 때(또는 제외 역할 목록이 바뀌었을 때) role.members로 한 번 만들고,
+    이후에는 멤버 입장/퇴장/역할 변경 이벤트로 갱신하므로 제외 여부 확인은 집합 조회 한 번
+    """
+
+    def __init__(self, excluded_roles):
+        self.excluded_roles = excluded_roles  # {guild_id: [제외 역할 ID]} (server_excluded_roles)
+        self._members = {}  # {guild_id: 제외 멤버 ID 집합}
+        self._built_for = {}  # {guild_id: 집합을 만들 때의 제외 역할 ID frozenset}
+
+        # 통계
+        self.rebuilds = 0
+        self.updates = 0
+
+    def stats(self):
+        return {
+            "guilds": len(self._members),
+            "members": sum(len(members) for members in self._members.values()),
+            "rebuilds": self.rebuilds,
+            "updates": self.updates,
+        }
+
+    def rebuild(self, guild):
+        """제외 역할의 role.members로 서버의 제외 멤버 집합을 다시 만듭니다"""
+        role_ids = frozenset(self.excluded_roles.get(guild.id) or ())
+        members = set()
+        for role_id in role_ids:
+            role = guild.get_role(role_id)
+            if role is not None:
+                members.update(member.id for member in role.members)
+        self._members[guild.id] = members
+        self._built_for[guild.id] = role_ids
+        self.rebuilds += 1
+        return members
+
+    def rebuild_all(self, guilds):
+        """제외 역할이 설정된 서버의 집합을 모두 만듭니다 (시작 시 워밍업 후 호출). 만든 서버 수 반환"""
+        built = 0
+        for guild in guilds:
+            if self.excluded_roles.get(guild.id):
+                self.rebuild(guild)
+                built += 1
+        return built
+
+    def get(self, guild):
+        """서버의 제외 멤버 ID 집합을 반환합니다 (제외 역할 목록이 바뀌었으면 다시 만듦)"""
+        members = self._members.get(guild.id)
+        if members is None or self._built_for.get(guild.id) != frozenset(self.excluded_roles.get(guild.id) or ()):
+            members = self.rebuild(guild)
+        return members
+
+    def is_excluded(self, guild, member_id):
+        return member_id in self.get(guild)
+
+    def discard_guild(self, guild_id):
+        self._members.pop(guild_id, None)
+        self._built_for.pop(guild_id, None)
+
+    def update_member(self, member):
+        """멤버의 현재 역할로 제외 여부를 갱신합니다 (아직 만들지 않은 서버는 다음 조회 때 만듦)"""
+        members = self._members.get(member.guild.id)
+        if members is None:
+            return
+        role_ids = self._built_for[member.guild.id]
+        if any(role.id in role_ids for role in member.roles):
+            members.add(member.id)
+        else:
+            members.discard(member.id)
+        self.updates += 1
+
+    def remove_member(self, member):
+        members = self._members.get(member.guild.id)
+        if members is not None:
+            members.discard(member.id)
+            self.updates += 1
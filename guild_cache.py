@@ -0,0 +1,157 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+from compact_counter import CompactCounter
+
+# 서버 상태 캐시 설정 (환경 변수로 조정 가능)
+GUILD_CACHE_MEMORY_MB = float(os.getenv("GUILD_CACHE_MEMORY_MB", "512"))  # 채팅 카운트 메모리 예산 (0이면 제한 없음)
+GUILD_CACHE_IDLE_TTL = float(os.getenv("GUILD_CACHE_IDLE_TTL", "21600"))  # 초, 이 시간 동안 사용되지 않은 서버는 내림 (0이면 사용 안 함)
+GUILD_CACHE_SWEEP_INTERVAL = float(os.getenv("GUILD_CACHE_SWEEP_INTERVAL", "60"))  # 초
+RANKED_COUNTER_BYTES_PER_USER = 120  # bench_counters.py 측정값 기준 RankedCounter 사용자당 메모리
+
+
+def estimate_counter_bytes(counter):
+    """채팅 카운터 하나의 대략적인 메모리 사용량을 반환합니다"""
+    if isinstance(counter, CompactCounter):
+        return counter.memory_usage()
+    return len(counter) * RANKED_COUNTER_BYTES_PER_USER
+
+
+class GuildStateCache:
+    """서버별 메모리 상태를 사용 순서대로 추적하고, 오래 쓰지 않았거나 예산을 넘은 서버를 내립니다"""
+
+    def __init__(self, chat_counts, other_states, flush_dirty, pending_guild_ids,
+                 memory_budget_mb=GUILD_CACHE_MEMORY_MB, idle_ttl=GUILD_CACHE_IDLE_TTL,
+                 sweep_interval=GUILD_CACHE_SWEEP_INTERVAL):
+        self.chat_counts = chat_counts  # {guild_id: 채팅 카운터}, 서버 상태가 올라와 있는지의 기준
+        self.other_states = other_states  # 함께 내릴 서버별 딕셔너리 목록 (역할, 제외 역할 등)
+        self.flush_dirty = flush_dirty  # 내리기 전에 저장되지 않은 변경분을 DB에 쓰는 코루틴 함수
+        self.pending_guild_ids = pending_guild_ids  # 아직 저장되지 않은 변경분이 있는 서버 ID 집합을 반환
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval
+        self._last_access = OrderedDict()  # guild_id -> 마지막 사용 시각, 오래된 순서
+        self._evicted = set()
+        self._task = None
+
+        # 통계
+        self.idle_evictions = 0
+        self.budget_evictions = 0
+        self.skipped_dirty = 0
+        self.reloads = 0
+        self.estimated_bytes = 0
+        self.last_sweep_ms = 0
+
+    def touch(self, guild_id):
+        """서버 상태를 사용했음을 기록합니다"""
+        self._last_access[guild_id] = time.monotonic()
+        self._last_access.move_to_end(guild_id)
+
+    def record_load(self, guild_id):
+        """서버 상태를 DB에서 (다시) 불러왔음을 기록합니다"""
+        if guild_id in self._evicted:
+            self._evicted.discard(guild_id)
+            self.reloads += 1
+        self.touch(guild_id)
+
+    def stats(self):
+        """캐시 통계를 반환합니다"""
+        return {
+            "guilds": len(self.chat_counts),
+            "estimated_mb": round(self.estimated_bytes / 1024 / 1024, 1),
+            "budget_mb": round(self.memory_budget / 1024 / 1024, 1),
+            "idle_evictions": self.idle_evictions,
+            "budget_evictions": self.budget_evictions,
+            "skipped_dirty": self.skipped_dirty,
+            "reloads": self.reloads,
+            "last_sweep_ms": self.last_sweep_ms,
+        }
+
+    def start(self):
+        """주기적인 정리 루프를 시작합니다 (on_ready가 여러 번 호출되어도 한 번만 실행)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            print(f"[서버 캐시] 정리 루프 시작: 예산 {self.memory_budget / 1024 / 1024:.0f}MB, 유휴 {self.idle_ttl:.0f}초")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"⚠️ [서버 캐시] 정리 중 오류: {e}")
+
+    def _select(self, now):
+        """내릴 서버를 (guild_id, 마지막 사용 시각, 이유) 목록으로 고릅니다"""
+        # 다른 경로(리더보드 등)로 직접 올라온 서버도 추적 대상에 포함
+        for guild_id in self.chat_counts:
+            if guild_id not in self._last_access:
+                self.touch(guild_id)
+        for guild_id in [g for g in self._last_access if g not in self.chat_counts]:
+            del self._last_access[guild_id]
+
+        sizes = {guild_id: estimate_counter_bytes(counter) for guild_id, counter in self.chat_counts.items()}
+        self.estimated_bytes = sum(sizes.values())
+
+        selected = []
+        remaining = self.estimated_bytes
+        for guild_id, last_access in self._last_access.items():
+            if self.idle_ttl and now - last_access >= self.idle_ttl:
+                selected.append((guild_id, last_access, "idle"))
+                remaining -= sizes.get(guild_id, 0)
+            elif self.memory_budget and remaining > self.memory_budget:
+                selected.append((guild_id, last_access, "budget"))
+                remaining -= sizes.get(guild_id, 0)
+            else:
+                # 오래된 순서이므로 이후 서버는 모두 최근에 사용됨
+                break
+        return selected
+
+    async def sweep(self):
+        """유휴 서버와 예산을 넘는 서버를 변경분 저장 후 메모리에서 내립니다"""
+        started = time.perf_counter()
+        selected = self._select(time.monotonic())
+        if not selected:
+            self.last_sweep_ms = round((time.perf_counter() - started) * 1000, 1)
+            return 0
+
+        # 저장되지 않은 증가분을 먼저 DB에 씀
+        await self.flush_dirty()
+        dirty = self.pending_guild_ids()
+
+        evicted = 0
+        for guild_id, last_access, reason in selected:
+            # 저장하는 동안 다시 사용되었거나 아직 저장되지 않은 변경분이 있으면 건너뜀
+            if self._last_access.get(guild_id) != last_access:
+                continue
+            if guild_id in dirty:
+                self.skipped_dirty += 1
+                continue
+
+            self.chat_counts.pop(guild_id, None)
+            for state in self.other_states:
+                state.pop(guild_id, None)
+            del self._last_access[guild_id]
+            self._evicted.add(guild_id)
+            evicted += 1
+            if reason == "idle":
+                self.idle_evictions += 1
+            else:
+                self.budget_evictions += 1
+
+        self.estimated_bytes = sum(estimate_counter_bytes(counter) for counter in self.chat_counts.values())
+        self.last_sweep_ms = round((time.perf_counter() - started) * 1000, 1)
+        if evicted:
+            print(f"[서버 캐시] {evicted}개 서버를 메모리에서 내림: {self.stats()}")
+        return evicted
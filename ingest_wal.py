@@ -0,0 +1,425 @@
+import asyncio
+import os
+import struct
+import time
+import uuid
+import zlib
+from bisect import bisect_right
+
+import async_database as adb
+import database as db
+
+# 수집 로그(WAL) 설정 (환경 변수로 조정 가능)
+INGEST_WAL_DIR = os.getenv("INGEST_WAL_DIR", "ingest_wal")  # 빈 값이면 사용 안 함
+INGEST_WAL_SEGMENT_BYTES = int(os.getenv("INGEST_WAL_SEGMENT_BYTES", str(4 * 1024 * 1024)))  # 세그먼트 파일 하나의 크기
+INGEST_WAL_FLUSH_INTERVAL = float(os.getenv("INGEST_WAL_FLUSH_INTERVAL", "0.2"))  # 초, 모아 둔 기록을 파일에 쓰는 주기
+INGEST_WAL_FSYNC = os.getenv("INGEST_WAL_FSYNC", "true").lower() == "true"  # 파일에 쓸 때마다 fsync
+INGEST_WAL_REPLAY_BATCH = int(os.getenv("INGEST_WAL_REPLAY_BATCH", "5000"))  # 재생 시 한 번에 DB에 반영할 기록 수
+INGEST_WAL_TRUNCATE_INTERVAL = 5  # 초
+INGEST_WAL_RETRY_DELAY = 5  # 초
+INGEST_WAL_DRAIN_POLL = 0.5  # 초, 재생 전에 버퍼/큐가 이전 기록을 반영했는지 확인하는 간격
+
+# 파일 구조 (리틀 엔디언)
+#   세그먼트: 헤더(매직, 형식 버전, 예약, 첫 LSN) + 고정 크기 기록의 연속
+#   기록: LSN, guild_id, user_id, message_id, 메시지 시각(UNIX 초) + 기록 CRC32
+# 세그먼트 안의 LSN은 빈틈없이 이어지므로 LSN으로 바로 위치를 계산해 읽음
+WAL_MAGIC = b"MZWL"
+WAL_VERSION = 1
+_SEGMENT_HEADER = struct.Struct("<4sHHQ")
+_RECORD = struct.Struct("<Qqqqd")
+_CRC = struct.Struct("<I")
+RECORD_SIZE = _RECORD.size + _CRC.size
+_ACK = struct.Struct("<Q")  # 반영 완료 LSN + CRC32
+
+
+def encode_record(lsn, guild_id, user_id, message_id, timestamp):
+    body = _RECORD.pack(lsn, guild_id, user_id, message_id, timestamp)
+    return body + _CRC.pack(zlib.crc32(body))
+
+
+def read_records(path, first_lsn, from_lsn, limit):
+    """세그먼트에서 from_lsn부터 최대 limit개의 기록을 읽습니다. 끝이 잘렸거나 손상된 기록에서 멈춤"""
+    records = []
+    with open(path, "rb") as f:
+        header = f.read(_SEGMENT_HEADER.size)
+        if len(header) < _SEGMENT_HEADER.size:
+            return records
+        magic, version, _, header_lsn = _SEGMENT_HEADER.unpack(header)
+        if magic != WAL_MAGIC or version != WAL_VERSION or header_lsn != first_lsn:
+            raise ValueError(f"{path}: 수집 로그 세그먼트가 아님")
+
+        f.seek(_SEGMENT_HEADER.size + max(0, from_lsn - first_lsn) * RECORD_SIZE)
+        data = f.read(limit * RECORD_SIZE)
+
+    for offset in range(0, len(data) - RECORD_SIZE + 1, RECORD_SIZE):
+        body = data[offset:offset + _RECORD.size]
+        (crc,) = _CRC.unpack_from(data, offset + _RECORD.size)
+        if zlib.crc32(body) != crc:
+            break
+        record = _RECORD.unpack(body)
+        # 기록 중 종료되어 남은 이전 내용이 섞이지 않도록 LSN 연속성도 확인
+        if records and record[0] != records[-1][0] + 1:
+            break
+        records.append(record)
+    return records
+
+
+class IngestWAL:
+    """메시지 수집 기록을 DB보다 먼저 로컬 세그먼트 파일에 추가하고, DB에 반영되지 못한 기록을 재생합니다
+
+    평소에는 기록만 남기고 저장은 쓰기 지연 버퍼/메시지 큐가 함.
+    버퍼가 가득 차거나 시작 시 반영되지 않은 기록이 있으면 재생 모드로 바꾸고,
+    그동안의 기록은 로그에만 남겼다가 DB에 연결되면 순서대로 멱등하게 반영함
+    """
+
+    def __init__(self, directory=INGEST_WAL_DIR, segment_bytes=INGEST_WAL_SEGMENT_BYTES,
+                 flush_interval=INGEST_WAL_FLUSH_INTERVAL, fsync=INGEST_WAL_FSYNC,
+                 replay_batch=INGEST_WAL_REPLAY_BATCH):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.replay_batch = replay_batch
+        self.ack_sources = []  # DB에 반영된 마지막 LSN을 반환하는 함수 목록 (따라잡았으면 None)
+
+        self.writer_id = None
+        self.next_lsn = 1
+        self.durable_lsn = 0  # 파일에 쓴 마지막 LSN
+        self.acked_lsn = 0  # 이 LSN까지 DB에 반영되어 지워도 되는 기록
+        self.spilling = False  # 재생 모드 (기록을 버퍼/큐에 넣지 않고 로그에서 재생)
+        self.replayed_lsn = 0  # 재생 모드에서 DB에 반영한 마지막 LSN
+        self.spill_lsn = None  # 재생 모드를 시작한 LSN (이전 기록은 버퍼/큐가 반영)
+        self._segments = []  # [(첫 LSN, 경로)], 오름차순
+        self._buffer = bytearray()
+        self._buffer_first_lsn = None
+        self._file = None
+        self._file_size = 0
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._replay_task = None
+
+        # 통계
+        self.appended = 0
+        self.replayed = 0
+        self.spills = 0
+        self.failed_writes = 0
+        self.failed_replays = 0
+        self.truncated_segments = 0
+
+        if self.directory:
+            self._open()
+
+    @property
+    def enabled(self):
+        return self.writer_id is not None
+
+    def stats(self):
+        return {
+            "next_lsn": self.next_lsn,
+            "durable_lsn": self.durable_lsn,
+            "acked_lsn": self.acked_lsn,
+            "segments": len(self._segments),
+            "spilling": self.spilling,
+            "replayed_lsn": self.replayed_lsn,
+            "appended": self.appended,
+            "replayed": self.replayed,
+            "spills": self.spills,
+            "failed_writes": self.failed_writes,
+            "failed_replays": self.failed_replays,
+            "truncated_segments": self.truncated_segments,
+        }
+
+    # 시작 -------------------------------------------------------------------
+    def _open(self):
+        """세그먼트를 확인하여 다음 LSN과 재생할 위치를 정합니다"""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            self.writer_id = self._load_writer_id()
+            self.acked_lsn = self._load_ack()
+
+            for name in os.listdir(self.directory):
+                if name.startswith("ingest-") and name.endswith(".wal"):
+                    self._segments.append((int(name[7:-4]), os.path.join(self.directory, name)))
+            self._segments.sort()
+
+            last_lsn = self.acked_lsn
+            if self._segments:
+                first_lsn, path = self._segments[-1]
+                last_lsn = max(last_lsn, first_lsn - 1)
+                # 마지막 세그먼트 끝까지 읽어 마지막으로 온전히 기록된 LSN을 찾음
+                while True:
+                    records = read_records(path, first_lsn, last_lsn + 1, self.replay_batch)
+                    if not records:
+                        break
+                    last_lsn = records[-1][0]
+        except Exception as e:
+            print(f"❌ [수집 로그] {self.directory}을(를) 열 수 없어 사용하지 않습니다: {e}")
+            self.writer_id = None
+            self._segments = []
+            return
+
+        self.next_lsn = last_lsn + 1
+        self.durable_lsn = last_lsn
+        if last_lsn > self.acked_lsn:
+            # 지난 실행에서 DB에 반영되지 못한 기록이 있음
+            self._start_spill(self.acked_lsn + 1, "지난 실행에서 반영되지 않은 기록")
+        print(f"[수집 로그] {self.directory}: 세그먼트 {len(self._segments)}개, 다음 LSN {self.next_lsn}, 반영 완료 LSN {self.acked_lsn}")
+
+    def _load_writer_id(self):
+        # DB에 남기는 반영 표시(wal_lsn.<writer_id>)의 이름, 로그 디렉터리마다 하나
+        path = os.path.join(self.directory, "writer_id")
+        try:
+            with open(path) as f:
+                writer_id = f.read().strip()
+            if writer_id:
+                return writer_id
+        except FileNotFoundError:
+            pass
+        writer_id = uuid.uuid4().hex[:12]
+        with open(path, "w") as f:
+            f.write(writer_id)
+        return writer_id
+
+    def _load_ack(self):
+        # 없거나 손상되었으면 처음부터 재생 (재생은 멱등하므로 안전)
+        try:
+            with open(os.path.join(self.directory, "ack"), "rb") as f:
+                data = f.read(_ACK.size + _CRC.size)
+            (lsn,) = _ACK.unpack_from(data)
+            (crc,) = _CRC.unpack_from(data, _ACK.size)
+        except (FileNotFoundError, struct.error):
+            return 0
+        return lsn if zlib.crc32(data[:_ACK.size]) == crc else 0
+
+    def start(self):
+        """파일 쓰기/정리 루프와 (필요하면) 재생 루프를 시작합니다"""
+        if not self.enabled:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            print(f"[수집 로그] 쓰기 루프 시작: {self.flush_interval}초 간격, fsync {'사용' if self.fsync else '사용 안 함'}")
+        if self.spilling:
+            self._ensure_replay_task()
+
+    # 기록 -------------------------------------------------------------------
+    def append(self, guild_id, user_id, message_id, created_at):
+        """메시지 수집 기록을 메모리 버퍼에 추가하고 LSN을 반환합니다 (파일 쓰기는 쓰기 루프가 모아서 함)"""
+        lsn = self.next_lsn
+        self.next_lsn += 1
+        if self._buffer_first_lsn is None:
+            self._buffer_first_lsn = lsn
+        self._buffer += encode_record(lsn, guild_id, user_id, message_id, created_at.timestamp())
+        self.appended += 1
+        return lsn
+
+    async def flush(self):
+        """모아 둔 기록을 세그먼트 파일에 씁니다"""
+        async with self._lock:
+            await self._flush_locked()
+
+    async def _flush_locked(self):
+        if not self._buffer:
+            return
+        data, first_lsn = bytes(self._buffer), self._buffer_first_lsn
+        self._buffer.clear()
+        self._buffer_first_lsn = None
+        last_lsn = first_lsn + len(data) // RECORD_SIZE - 1
+        try:
+            await asyncio.to_thread(self._write, data, first_lsn)
+        except Exception:
+            # 다음 쓰기에서 다시 시도 (이후 기록 앞에 붙임)
+            self._buffer[:0] = data
+            self._buffer_first_lsn = first_lsn
+            self.failed_writes += 1
+            raise
+        self.durable_lsn = last_lsn
+
+    def _write(self, data, first_lsn):
+        if self._file is None or self._file_size >= self.segment_bytes:
+            self._rotate(first_lsn)
+        self._file.write(data)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._file_size += len(data)
+
+    def _rotate(self, first_lsn):
+        """새 세그먼트 파일을 엽니다 (실행마다, 그리고 크기를 넘을 때마다)"""
+        if self._file is not None:
+            self._file.close()
+        path = os.path.join(self.directory, f"ingest-{first_lsn:020d}.wal")
+        if self._segments and self._segments[-1][0] == first_lsn:
+            # 지난 실행에서 헤더만 쓰고 끝난 같은 이름의 세그먼트는 덮어씀
+            self._segments.pop()
+        self._file = open(path, "wb")
+        self._file.write(_SEGMENT_HEADER.pack(WAL_MAGIC, WAL_VERSION, 0, first_lsn))
+        self._file_size = _SEGMENT_HEADER.size
+        self._segments.append((first_lsn, path))
+
+    async def _run(self):
+        last_truncate = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.monotonic() - last_truncate >= INGEST_WAL_TRUNCATE_INTERVAL:
+                    last_truncate = time.monotonic()
+                    await self.truncate()
+            except Exception as e:
+                print(f"⚠️ [수집 로그] 파일 쓰기 실패: {e}")
+
+    # 반영 확인 / 정리 ----------------------------------------------------------
+    def _sources_lsn(self):
+        """버퍼/큐가 DB에 반영한 마지막 LSN 중 가장 늦은 곳을 반환합니다. 모두 따라잡았으면 None"""
+        lsns = [lsn for lsn in (source() for source in self.ack_sources) if lsn is not None]
+        return min(lsns) if lsns else None
+
+    def watermark(self):
+        """이 LSN까지의 기록은 모두 DB에 반영되었습니다 (버퍼/큐와 재생 중 가장 늦은 곳)"""
+        candidates = [self.replayed_lsn] if self.spilling else []
+        sources_lsn = self._sources_lsn()
+        if sources_lsn is not None:
+            candidates.append(sources_lsn)
+        return min(candidates) if candidates else self.next_lsn - 1
+
+    async def truncate(self):
+        """DB에 반영된 기록만 있는 세그먼트를 지우고 반영 위치를 저장합니다"""
+        watermark = min(self.watermark(), self.durable_lsn)
+        if watermark <= self.acked_lsn:
+            return
+        async with self._lock:
+            removable = []
+            for i, (first_lsn, path) in enumerate(self._segments[:-1]):
+                # 다음 세그먼트의 첫 LSN 직전까지가 이 세그먼트의 범위
+                if self._segments[i + 1][0] - 1 <= watermark:
+                    removable.append((first_lsn, path))
+            await asyncio.to_thread(self._save_ack, watermark, [path for _, path in removable])
+            for segment in removable:
+                self._segments.remove(segment)
+            self.truncated_segments += len(removable)
+            self.acked_lsn = watermark
+
+    def _save_ack(self, lsn, paths):
+        # 반영 위치를 먼저 원자적으로 저장한 뒤 세그먼트를 지움
+        ack_path = os.path.join(self.directory, "ack")
+        temp_path = f"{ack_path}.tmp"
+        with open(temp_path, "wb") as f:
+            body = _ACK.pack(lsn)
+            f.write(body + _CRC.pack(zlib.crc32(body)))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, ack_path)
+        for path in paths:
+            os.remove(path)
+
+    # 재생 -------------------------------------------------------------------
+    def start_spill(self, lsn):
+        """버퍼/큐가 기록을 받지 못했으면 이 LSN부터는 로그에서 재생합니다"""
+        if self.enabled and not self.spilling:
+            self._start_spill(lsn, "쓰기 버퍼/큐가 가득 참")
+            self._ensure_replay_task()
+
+    def _start_spill(self, lsn, reason):
+        self.spilling = True
+        self.spill_lsn = lsn
+        self.replayed_lsn = lsn - 1
+        self.spills += 1
+        print(f"⚠️ [수집 로그] 재생 모드 시작 (LSN {lsn}부터, {reason}): DB에 연결되면 로그에서 순서대로 반영합니다")
+
+    def _ensure_replay_task(self):
+        if self._replay_task is None or self._replay_task.done():
+            self._replay_task = asyncio.get_running_loop().create_task(self._replay_loop())
+
+    def _read_from(self, lsn, limit):
+        firsts = [first_lsn for first_lsn, _ in self._segments]
+        i = bisect_right(firsts, lsn) - 1
+        records = []
+        # 앞 세그먼트의 끝이 잘렸으면 다음 세그먼트로 넘어감
+        while i < len(self._segments) and len(records) < limit:
+            if i >= 0:
+                first_lsn, path = self._segments[i]
+                records += read_records(path, first_lsn, max(lsn, first_lsn), limit - len(records))
+                if records:
+                    lsn = records[-1][0] + 1
+            i += 1
+        return records
+
+    def _sources_drained(self):
+        """재생 모드 이전 기록을 버퍼/큐가 모두 DB에 반영했는지 반환합니다
+
+        재생은 채팅 카운트/시간별 집계 문서에 wal_lsn을 $max로 올리므로, 그보다 앞선 기록이 큐에 남은 채
+        재생하면 종료 후 다시 재생할 때 그 기록의 증가분을 이미 반영된 것으로 보고 건너뛰게 됨
+        """
+        sources_lsn = self._sources_lsn()
+        return sources_lsn is None or sources_lsn >= self.spill_lsn - 1
+
+    async def _replay_loop(self):
+        waiting = False
+        while self.spilling:
+            if not db.is_mongo_connected():
+                await asyncio.sleep(INGEST_WAL_RETRY_DELAY)
+                continue
+            if not self._sources_drained():
+                if not waiting:
+                    waiting = True
+                    print(f"[수집 로그] 재생 대기: LSN {self.spill_lsn} 이전 기록을 버퍼/큐가 저장할 때까지 기다립니다")
+                await asyncio.sleep(INGEST_WAL_DRAIN_POLL)
+                continue
+            try:
+                await self._replay_step()
+            except Exception as e:
+                self.failed_replays += 1
+                print(f"⚠️ [수집 로그] 재생 실패 (LSN {self.replayed_lsn + 1}부터 다시 시도): {e}")
+                await asyncio.sleep(INGEST_WAL_RETRY_DELAY)
+
+    async def _replay_step(self):
+        async with self._lock:
+            # 쓰기 중인 기록이 없도록 잠근 상태에서 파일에 쓰고 읽음
+            await self._flush_locked()
+            records = await asyncio.to_thread(self._read_from, self.replayed_lsn + 1, self.replay_batch)
+            if not records and not self._buffer:
+                # 따라잡음: 같은 틱에서 재생 모드를 끄므로 이후 기록은 버퍼/큐로 감
+                self.spilling = False
+                print(f"✅ [수집 로그] 재생 완료: LSN {self.replayed_lsn}까지 반영 (누적 {self.replayed}개)")
+                return
+        if not records:
+            return
+
+        await adb.replay_ingest_records(self.writer_id, records, timeout=None)
+        self.replayed_lsn = records[-1][0]
+        self.replayed += len(records)
+        if self.replayed % (self.replay_batch * 20) < len(records):
+            print(f"[수집 로그] 재생 중: LSN {self.replayed_lsn}/{self.next_lsn - 1}")
+
+    async def wait_replayed(self, timeout=None):
+        """재생 모드가 끝날 때까지 기다립니다 (시작 시 워밍업 전에 사용). 끝났으면 True"""
+        if not self.spilling or self._replay_task is None:
+            return not self.spilling
+        try:
+            await asyncio.wait_for(asyncio.shield(self._replay_task), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return not self.spilling
+
+    async def close(self):
+        """남은 기록을 파일에 쓰고 반영된 세그먼트를 정리합니다 (버퍼/큐를 닫은 뒤 호출)"""
+        if not self.enabled:
+            return
+        for task in (self._task, self._replay_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._replay_task = None
+
+        try:
+            await self.flush()
+            await self.truncate()
+        except Exception as e:
+            print(f"❌ [수집 로그] 종료 시 정리 실패: {e}")
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        print(f"[수집 로그] 종료: {self.stats()}")
@@ -0,0 +1,50 @@
+COMMAND_PREFIX = "!"
+
+
+class MessageRoute:
+    """텍스트 명령어 하나의 처리 정보를 담습니다"""
+
+    __slots__ = ("name", "handler", "guild_only", "exact")
+
+    def __init__(self, name, handler, guild_only, exact):
+        self.name = name
+        self.handler = handler
+        self.guild_only = guild_only  # True면 서버 메시지에서만 처리
+        self.exact = exact  # True면 인자 없이 명령어만 입력했을 때만 처리
+
+
+class MessageRouter:
+    """텍스트 명령어를 첫 단어 기준의 딕셔너리로 찾아 처리합니다"""
+
+    def __init__(self, prefix=COMMAND_PREFIX):
+        self.prefix = prefix
+        self._routes = {}
+
+    def command(self, name, guild_only=True, exact=False):
+        """텍스트 명령어 처리 함수를 등록하는 데코레이터입니다 (handler(message, args))"""
+        name = name.lower()
+        if not name.startswith(self.prefix):
+            raise ValueError(f"텍스트 명령어는 '{self.prefix}'로 시작해야 합니다: {name}")
+
+        def decorator(handler):
+            if name in self._routes:
+                raise ValueError(f"이미 등록된 텍스트 명령어입니다: {name}")
+            self._routes[name] = MessageRoute(name, handler, guild_only, exact)
+            return handler
+        return decorator
+
+    def match(self, content):
+        """메시지 내용에 해당하는 명령어를 찾아 (route, args)를 반환합니다. 없으면 (None, None)"""
+        # 일반 채팅은 접두사 한 글자만 확인하고 바로 반환 (파싱 없음)
+        if not content.startswith(self.prefix):
+            return None, None
+
+        parts = content.split(maxsplit=1)
+        route = self._routes.get(parts[0].lower())
+        if route is None:
+            return None, None
+
+        args = parts[1].strip() if len(parts) > 1 else ""
+        if route.exact and args:
+            return None, None
+        return route, args
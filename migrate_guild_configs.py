@@ -0,0 +1,30 @@
+import sys
+
+import database as db
+
+# 사용법: python migrate_guild_configs.py [guild_id ...]
+# 예전 컬렉션(roles, excluded_roles, authorized_guilds, role_colors, aggregate_dates)에 나뉘어 있던
+# 서버 설정을 guild_configs 문서 하나로 옮깁니다. 서버 ID를 지정하지 않으면 모든 서버를 옮깁니다.
+# 봇도 시작할 때나 서버 설정을 처음 읽을 때 자동으로 옮기므로, 미리 한 번에 옮겨 두고 싶을 때 사용합니다.
+# 이미 guild_configs에 있는 값은 덮어쓰지 않으므로 여러 번 실행해도 결과는 같습니다.
+# 예전 컬렉션은 지우지 않으므로, 확인이 끝난 뒤 필요하면 직접 삭제하세요.
+
+def migrate(guild_ids=None):
+    if not db.is_mongo_connected():
+        print("❌ MongoDB에 연결되지 않았습니다.")
+        return False
+
+    try:
+        migrated = db.migrate_guild_configs(guild_ids or None)
+    except Exception as e:
+        print(f"❌ 서버 설정 이전 실패: {e}")
+        return False
+
+    total = db.guild_configs_collection.count_documents({})
+    authorized = db.guild_configs_collection.count_documents({"authorized": True})
+    print(f"✅ 서버 설정 이전 완료: {migrated}개 서버를 옮김 (guild_configs 전체 {total}개, 인증된 서버 {authorized}개)")
+    return True
+
+if __name__ == "__main__":
+    ok = migrate([int(arg) for arg in sys.argv[1:]])
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,199 @@
+import asyncio
+import os
+import random
+import time
+
+from pymongo import monitoring
+
+# MongoDB 연결 상태 확인 설정 (환경 변수로 조정 가능)
+MONGO_HEALTH_INTERVAL = float(os.getenv("MONGO_HEALTH_INTERVAL", "10"))  # 초, 연결된 동안 ping 주기
+MONGO_HEALTH_TIMEOUT = float(os.getenv("MONGO_HEALTH_TIMEOUT", "5"))  # 초, ping 하나의 최대 시간
+MONGO_CIRCUIT_FAILURES = int(os.getenv("MONGO_CIRCUIT_FAILURES", "3"))  # 연속 실패가 이 수가 되면 차단
+MONGO_RECONNECT_BACKOFF_MIN = float(os.getenv("MONGO_RECONNECT_BACKOFF_MIN", "1"))  # 초
+MONGO_RECONNECT_BACKOFF_MAX = float(os.getenv("MONGO_RECONNECT_BACKOFF_MAX", "60"))  # 초
+
+# 차단기 상태
+CIRCUIT_CLOSED = "closed"  # 정상, DB 호출 허용
+CIRCUIT_OPEN = "open"  # 연결 끊김, DB 호출 차단 (쓰기는 버퍼/큐에 보관)
+CIRCUIT_HALF_OPEN = "half_open"  # 재연결 시도 중
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """pymongo 커넥션 풀 이벤트로 풀 통계를 모읍니다 (MongoClient의 event_listeners로 등록)"""
+
+    def __init__(self):
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0  # 현재 사용 중인 커넥션 수
+        self.max_checked_out = 0
+        self.checkout_failures = 0
+        self.pool_clears = 0
+
+    def stats(self):
+        return {
+            "open": self.created - self.closed,
+            "checked_out": self.checked_out,
+            "max_checked_out": self.max_checked_out,
+            "created": self.created,
+            "checkout_failures": self.checkout_failures,
+            "pool_clears": self.pool_clears,
+        }
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self.pool_clears += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.created += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.closed += 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        self.checked_out += 1
+        self.max_checked_out = max(self.max_checked_out, self.checked_out)
+
+    def connection_checked_in(self, event):
+        self.checked_out = max(0, self.checked_out - 1)
+
+
+class MongoHealthMonitor:
+    """주기적인 ping으로 MongoDB 상태를 확인하고, 연속으로 실패하면 차단한 뒤 백오프로 재연결합니다"""
+
+    def __init__(self, ping, reconnect, set_available, on_recovered=None,
+                 interval=MONGO_HEALTH_INTERVAL, failure_threshold=MONGO_CIRCUIT_FAILURES,
+                 backoff_min=MONGO_RECONNECT_BACKOFF_MIN, backoff_max=MONGO_RECONNECT_BACKOFF_MAX):
+        self.ping = ping  # ping 지연 시간(ms)을 반환하는 코루틴 함수, 실패하면 예외
+        self.reconnect = reconnect  # 클라이언트를 다시 만드는 코루틴 함수, 성공하면 True
+        self.set_available = set_available  # DB 호출 허용 여부를 바꾸는 함수 (database.set_mongo_available)
+        self.on_recovered = on_recovered  # 차단이 풀렸을 때 실행할 코루틴 함수 (밀린 쓰기 저장 등)
+        self.interval = interval
+        self.failure_threshold = failure_threshold
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.state = CIRCUIT_CLOSED
+        self._task = None
+
+        # 통계
+        self.consecutive_failures = 0
+        self.total_failures = 0
+        self.reconnect_attempts = 0
+        self.outages = 0
+        self.last_ping_ms = None
+        self.avg_ping_ms = None
+        self.max_ping_ms = 0
+        self.last_error = None
+        self.opened_at = None
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "last_ping_ms": self.last_ping_ms,
+            "avg_ping_ms": self.avg_ping_ms,
+            "max_ping_ms": self.max_ping_ms,
+            "consecutive_failures": self.consecutive_failures,
+            "total_failures": self.total_failures,
+            "outages": self.outages,
+            "reconnect_attempts": self.reconnect_attempts,
+            "down_seconds": round(time.monotonic() - self.opened_at) if self.opened_at else 0,
+            "last_error": self.last_error,
+        }
+
+    def start(self, connected):
+        """상태 확인 루프를 시작합니다. 시작 시 연결되지 않았으면 차단 상태에서 재연결부터 시도"""
+        if self._task is None or self._task.done():
+            if not connected and self.state == CIRCUIT_CLOSED:
+                self._open("시작 시 연결 실패")
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            print(f"[DB 상태] 확인 루프 시작: {self.interval:.0f}초 간격, 연속 {self.failure_threshold}회 실패 시 차단")
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        backoff = self.backoff_min
+        while True:
+            if self.state == CIRCUIT_CLOSED:
+                await asyncio.sleep(self.interval)
+                await self._check()
+                backoff = self.backoff_min
+            else:
+                # 여러 프로세스가 동시에 재연결하지 않도록 지터를 더함
+                await asyncio.sleep(backoff * random.uniform(0.5, 1.0))
+                if not await self._try_recover():
+                    backoff = min(backoff * 2, self.backoff_max)
+
+    def _record_ping(self, latency_ms):
+        self.last_ping_ms = round(latency_ms, 1)
+        self.max_ping_ms = max(self.max_ping_ms, self.last_ping_ms)
+        # 지수 이동 평균
+        self.avg_ping_ms = self.last_ping_ms if self.avg_ping_ms is None else round(self.avg_ping_ms * 0.8 + latency_ms * 0.2, 1)
+
+    async def _check(self):
+        try:
+            self._record_ping(await self.ping())
+        except Exception as e:
+            self.consecutive_failures += 1
+            self.total_failures += 1
+            self.last_error = str(e)
+            print(f"⚠️ [DB 상태] ping 실패 ({self.consecutive_failures}/{self.failure_threshold}): {e}")
+            if self.consecutive_failures >= self.failure_threshold:
+                self._open(e)
+            return
+        self.consecutive_failures = 0
+
+    def _open(self, reason):
+        self.state = CIRCUIT_OPEN
+        self.opened_at = time.monotonic()
+        self.outages += 1
+        self.set_available(False)
+        print(f"❌ [DB 상태] MongoDB 연결 차단, 재연결을 시도합니다 (쓰기는 버퍼에 보관): {reason}")
+
+    async def _try_recover(self):
+        self.state = CIRCUIT_HALF_OPEN
+        self.reconnect_attempts += 1
+        try:
+            if not await self.reconnect():
+                raise ConnectionError("클라이언트를 만들 수 없음")
+            self._record_ping(await self.ping())
+        except Exception as e:
+            self.state = CIRCUIT_OPEN
+            self.last_error = str(e)
+            return False
+
+        down_seconds = round(time.monotonic() - self.opened_at) if self.opened_at else 0
+        self.state = CIRCUIT_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.set_available(True)
+        print(f"✅ [DB 상태] MongoDB 연결 복구 ({down_seconds}초 만, 재연결 시도 {self.reconnect_attempts}회 누적)")
+
+        if self.on_recovered is not None:
+            try:
+                await self.on_recovered()
+            except Exception as e:
+                print(f"⚠️ [DB 상태] 복구 후 처리 중 오류: {e}")
+        return True
@@ -0,0 +1,205 @@
+from collections import Counter
+
+
+# 키를 채팅 수 내림차순 리스트로 유지하고, 같은 채팅 수를 가진 키들의 구간(시작/끝 위치)을 기록함
+# 값이 1 바뀌면 구간 경계의 키와 자리만 바꾸면 되므로 메시지마다 O(1)로 순위가 갱신되고,
+# 상위 목록/순위/페이지를 정렬 없이 바로 꺼낼 수 있음
+class RankedCounter(Counter):
+    """채팅 수 내림차순 순위를 항상 유지하는 Counter입니다"""
+
+    def __init__(self, iterable=None, /, **kwds):
+        self._order = []  # 채팅 수 내림차순으로 정렬된 키 목록
+        self._pos = {}  # 키 -> _order 내 위치
+        self._first = {}  # 채팅 수 -> 해당 구간의 첫 위치
+        self._last = {}  # 채팅 수 -> 해당 구간의 마지막 위치
+        super().__init__(iterable, **kwds)
+
+    # 순위 조회 ---------------------------------------------------------------
+
+    def rank_of(self, key):
+        """키의 순위(1부터)를 반환합니다. 없으면 None"""
+        pos = self._pos.get(key)
+        return None if pos is None else pos + 1
+
+    def top(self, n):
+        """상위 n개의 (키, 채팅 수) 목록을 반환합니다"""
+        return [(key, dict.__getitem__(self, key)) for key in self._order[:n]]
+
+    def page(self, page, per_page):
+        """page번째 페이지(1부터)의 (키, 채팅 수) 목록을 반환합니다"""
+        start = (page - 1) * per_page
+        return [(key, dict.__getitem__(self, key)) for key in self._order[start:start + per_page]]
+
+    def ranked(self):
+        """(키, 채팅 수)를 순위 순서대로 하나씩 반환합니다 (필터링하며 앞에서부터 읽을 때 사용)"""
+        for key in self._order:
+            yield key, dict.__getitem__(self, key)
+
+    def most_common(self, n=None):
+        """Counter.most_common과 같지만 정렬하지 않고 유지 중인 순위를 그대로 사용합니다"""
+        if n is None:
+            return self.top(len(self._order))
+        return self.top(max(n, 0))
+
+    # Counter/dict 변경 메서드 ------------------------------------------------
+
+    def __setitem__(self, key, value):
+        if key in self._pos:
+            old = dict.__getitem__(self, key)
+            dict.__setitem__(self, key, value)
+            if value > old:
+                self._raise(key, old, value)
+            elif value < old:
+                self._lower(key, old, value)
+            return
+
+        # 새 키는 맨 뒤에 붙인 뒤 자기 자리까지 올림
+        dict.__setitem__(self, key, value)
+        self._order.append(key)
+        self._pos[key] = len(self._order) - 1
+        self._settle_up(key, len(self._order) - 1, value)
+
+    def __delitem__(self, key):
+        # Counter와 같이 없는 키는 무시
+        if key not in self._pos:
+            return
+
+        old = dict.__getitem__(self, key)
+        pos = self._detach_to_last(key, old)
+
+        # 아래 구간들을 모두 지나 맨 뒤로 보낸 후 제거
+        while pos < len(self._order) - 1:
+            pos = self._cross_down(pos)
+
+        self._order.pop()
+        del self._pos[key]
+        dict.__delitem__(self, key)
+
+    def update(self, iterable=None, /, **kwds):
+        """Counter.update와 같이 채팅 수를 더합니다 (비어 있으면 한 번에 정렬하여 구성)"""
+        increments = Counter()
+        Counter.update(increments, iterable, **kwds)
+        if not increments:
+            return
+
+        if not self:
+            dict.update(self, increments)
+            self._rebuild()
+            return
+
+        for key, amount in increments.items():
+            self[key] = self.get(key, 0) + amount
+
+    def clear(self):
+        dict.clear(self)
+        self._order.clear()
+        self._pos.clear()
+        self._first.clear()
+        self._last.clear()
+
+    def pop(self, key, *default):
+        if key in self._pos:
+            value = dict.__getitem__(self, key)
+            del self[key]
+            return value
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def popitem(self):
+        if not self._order:
+            raise KeyError("popitem(): dictionary is empty")
+        key = self._order[-1]
+        value = dict.__getitem__(self, key)
+        del self[key]
+        return key, value
+
+    def setdefault(self, key, default=0):
+        if key not in self._pos:
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+    # 내부 구현 ---------------------------------------------------------------
+
+    def _rebuild(self):
+        """현재 값으로 순위 목록과 구간 정보를 처음부터 다시 만듭니다"""
+        self._order = sorted(dict.keys(self), key=lambda k: dict.__getitem__(self, k), reverse=True)
+        self._pos = {}
+        self._first = {}
+        self._last = {}
+        for pos, key in enumerate(self._order):
+            count = dict.__getitem__(self, key)
+            self._pos[key] = pos
+            if count not in self._first:
+                self._first[count] = pos
+            self._last[count] = pos
+
+    def _swap(self, i, j):
+        order = self._order
+        order[i], order[j] = order[j], order[i]
+        self._pos[order[i]] = i
+        self._pos[order[j]] = j
+
+    def _count_at(self, pos):
+        return dict.__getitem__(self, self._order[pos])
+
+    def _raise(self, key, old, new):
+        # 이전 구간의 맨 앞으로 옮긴 뒤 구간에서 뺌
+        first = self._first[old]
+        self._swap(self._pos[key], first)
+        if self._last[old] == first:
+            del self._first[old]
+            del self._last[old]
+        else:
+            self._first[old] = first + 1
+        self._settle_up(key, first, new)
+
+    def _settle_up(self, key, pos, new):
+        # 채팅 수가 더 적은 구간을 하나씩 건너 앞으로 이동 (구간 수만큼만 반복)
+        while pos > 0:
+            count = self._count_at(pos - 1)
+            if count >= new:
+                break
+            block_first = self._first[count]
+            self._swap(pos, block_first)
+            self._first[count] = block_first + 1
+            self._last[count] = pos
+            pos = block_first
+
+        if pos > 0 and self._count_at(pos - 1) == new:
+            self._last[new] = pos
+        else:
+            self._first[new] = pos
+            self._last[new] = pos
+
+    def _detach_to_last(self, key, old):
+        # 현재 구간의 맨 뒤로 옮긴 뒤 구간에서 뺌
+        last = self._last[old]
+        self._swap(self._pos[key], last)
+        if self._first[old] == last:
+            del self._first[old]
+            del self._last[old]
+        else:
+            self._last[old] = last - 1
+        return last
+
+    def _cross_down(self, pos):
+        # 바로 뒤 구간 전체를 건너 뒤로 이동
+        count = self._count_at(pos + 1)
+        block_last = self._last[count]
+        self._swap(pos, block_last)
+        self._first[count] = pos
+        self._last[count] = block_last - 1
+        return block_last
+
+    def _lower(self, key, old, new):
+        pos = self._detach_to_last(key, old)
+
+        # 채팅 수가 더 많은 구간을 하나씩 건너 뒤로 이동
+        while pos < len(self._order) - 1 and self._count_at(pos + 1) > new:
+            pos = self._cross_down(pos)
+
+        # 바로 뒤가 같은 채팅 수 구간이면 그 구간의 앞에 합류
+        self._first[new] = pos
+        if pos == len(self._order) - 1 or self._count_at(pos + 1) != new:
+            self._last[new] = pos
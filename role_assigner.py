@@ -0,0 +1,210 @@
+import asyncio
+import os
+import random
+import time
+
+import disnake
+
+# 역할 변경 설정 (환경 변수로 조정 가능)
+ROLE_EDIT_CONCURRENCY = int(os.getenv("ROLE_EDIT_CONCURRENCY", "5"))  # 서버별 동시에 실행하는 역할 변경 수
+ROLE_EDIT_MAX_RETRIES = int(os.getenv("ROLE_EDIT_MAX_RETRIES", "3"))  # 429/5xx 응답 시 다시 시도하는 횟수
+ROLE_EDIT_PROGRESS_INTERVAL = float(os.getenv("ROLE_EDIT_PROGRESS_INTERVAL", "2"))  # 초, 진행 상황을 알리는 최소 간격
+ROLE_EDIT_RETRY_DELAY = 1  # 초, 재시도 대기 시간의 기본값 (응답에 대기 시간이 없을 때)
+
+
+def _retry_after(error, attempt):
+    """429 응답의 대기 시간(초)을 반환합니다. 헤더가 없으면 지수 백오프"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    for name in ("X-RateLimit-Reset-After", "Retry-After"):
+        try:
+            return max(float(headers[name]), 0)
+        except (KeyError, TypeError, ValueError):
+            continue
+    return ROLE_EDIT_RETRY_DELAY * 2 ** attempt
+
+
+class RoleAssigner:
+    """역할 변경을 서버별 세마포어로 제한하며 병렬로 실행합니다
+
+    멤버 역할 변경 API는 서버 ID가 rate limit 버킷의 기준이므로 서버마다 동시 실행 수를 따로 제한하고,
+    429 응답을 받으면 해당 서버의 모든 작업을 대기 시간만큼 멈춘 뒤 다시 시도합니다
+    """
+
+    def __init__(self, concurrency=ROLE_EDIT_CONCURRENCY, max_retries=ROLE_EDIT_MAX_RETRIES,
+                 progress_interval=ROLE_EDIT_PROGRESS_INTERVAL):
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.progress_interval = progress_interval
+        self._semaphores = {}  # {guild_id: asyncio.Semaphore}
+        self._blocked_until = {}  # {guild_id: 429로 멈춘 서버의 재개 시각 (monotonic)}
+
+        # 통계
+        self.runs = 0
+        self.edits = 0
+        self.failed = 0
+        self.rate_limited = 0
+        self.retries = 0
+
+    def stats(self):
+        return {
+            "runs": self.runs,
+            "edits": self.edits,
+            "failed": self.failed,
+            "rate_limited": self.rate_limited,
+            "retries": self.retries,
+            "active_guilds": sum(1 for semaphore in self._semaphores.values() if semaphore.locked()),
+        }
+
+    def _semaphore(self, guild_id):
+        semaphore = self._semaphores.get(guild_id)
+        if semaphore is None:
+            semaphore = self._semaphores[guild_id] = asyncio.Semaphore(self.concurrency)
+        return semaphore
+
+    async def _wait_unblocked(self, guild_id):
+        while True:
+            delay = self._blocked_until.get(guild_id, 0) - time.monotonic()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    async def _apply(self, member, add_roles, remove_roles, reason):
+        """멤버 한 명의 역할을 한 번의 API 호출로 바꿉니다"""
+        if add_roles and remove_roles:
+            # 추가와 제거를 함께 하면 최종 역할 목록으로 한 번에 바꿈
+            removed = {role.id for role in remove_roles}
+            roles = [role for role in member.roles if role.id not in removed and not role.is_default()]
+            roles += [role for role in add_roles if role not in roles]
+            await member.edit(roles=roles, reason=reason)
+        elif add_roles:
+            await member.add_roles(*add_roles, reason=reason)
+        elif remove_roles:
+            await member.remove_roles(*remove_roles, reason=reason)
+
+    async def _run_one(self, guild_id, member, add_roles, remove_roles, reason):
+        """역할 변경 하나를 실행합니다. 성공하면 None, 실패하면 예외 (멤버가 나갔으면 성공으로 봄)"""
+        semaphore = self._semaphore(guild_id)
+        for attempt in range(self.max_retries + 1):
+            async with semaphore:
+                await self._wait_unblocked(guild_id)
+                try:
+                    await self._apply(member, add_roles, remove_roles, reason)
+                    return None
+                except disnake.NotFound:
+                    return None
+                except disnake.HTTPException as e:
+                    if attempt >= self.max_retries or not (e.status == 429 or e.status >= 500):
+                        return e
+                    self.retries += 1
+                    delay = _retry_after(e, attempt)
+                    if e.status == 429:
+                        # 같은 버킷을 쓰는 다른 작업도 재개 시각까지 함께 멈춤
+                        self.rate_limited += 1
+                        self._blocked_until[guild_id] = max(self._blocked_until.get(guild_id, 0),
+                                                            time.monotonic() + delay)
+                        print(f"⚠️ [역할 변경] 서버 {guild_id} rate limit, {delay:.1f}초 대기")
+                        continue
+                except Exception as e:
+                    return e
+            # 서버 오류(5xx)는 세마포어를 놓고 지터를 더해 기다림
+            await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+
+    async def _tracked(self, guild_id, operation, result, reason):
+        member, add_roles, remove_roles = operation
+        error = await self._run_one(guild_id, member, tuple(add_roles), tuple(remove_roles), reason)
+        result["done"] += 1
+        if error is not None:
+            result["failed"] += 1
+            result["errors"].append((member.id, error))
+
+    async def _report(self, result, started, on_progress):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            try:
+                await on_progress(result["done"], result["total"], result["done"] / (time.perf_counter() - started))
+            except Exception as e:
+                print(f"⚠️ [역할 변경] 진행 상황 알림 실패: {e}")
+
+    async def run(self, guild, operations, on_progress=None, reason=None):
+        """역할 변경 목록 [(member, 추가할 역할들, 제거할 역할들)]을 병렬로 실행합니다
+
+        on_progress: (완료 수, 전체 수, 초당 처리 수)를 받는 코루틴 함수, progress_interval마다 호출
+        {total, done, failed, elapsed, per_second, errors: [(member_id, 예외)]}를 반환
+        """
+        self.runs += 1
+        started = time.perf_counter()
+        result = {"total": len(operations), "done": 0, "failed": 0, "elapsed": 0, "per_second": 0, "errors": []}
+        if not operations:
+            return result
+
+        reporter = None
+        if on_progress is not None and self.progress_interval:
+            reporter = asyncio.ensure_future(self._report(result, started, on_progress))
+        try:
+            await asyncio.gather(*(self._tracked(guild.id, operation, result, reason) for operation in operations))
+        finally:
+            if reporter is not None:
+                reporter.cancel()
+
+        result["elapsed"] = round(time.perf_counter() - started, 2)
+        result["per_second"] = round(result["done"] / result["elapsed"], 1) if result["elapsed"] else 0
+        self.edits += result["done"] - result["failed"]
+        self.failed += result["failed"]
+        print(f"[역할 변경] 서버 {guild.id}: {result['done'] - result['failed']}/{result['total']}건 완료, "
+              f"{result['elapsed']}초 ({result['per_second']}건/초), 실패 {result['failed']}건")
+        return result
+
+
+def plan_role_changes(first_role, other_role, ranking, get_member):
+    """현재 역할 보유자와 새 순위를 비교해 필요한 역할 변경만 계산합니다
+
+    ranking: 새 순위의 사용자 ID 목록 (1등은 first_role, 나머지는 other_role)
+    get_member: 사용자 ID로 멤버를 찾는 함수 (guild.get_member), 서버에 없는 사용자는 건너뜀
+    {operations: [(member, 추가할 역할들, 제거할 역할들)], role_types, added, removed, moved, unchanged} 반환
+    (같은 등급에 남는 사용자는 건드리지 않고, 등급이 바뀌는 사용자는 한 번의 변경으로 옮김)
+    """
+    members = {}
+    held = {}
+    for role in (first_role, other_role):
+        for member in role.members:
+            members[member.id] = member
+            held.setdefault(member.id, set()).add(role)
+
+    wanted = {}
+    role_types = {}
+    for index, user_id in enumerate(ranking):
+        member = members.get(user_id) or get_member(user_id)
+        if member is None:
+            continue
+        members[user_id] = member
+        role_types[user_id] = "first" if index == 0 else "other"
+        wanted[user_id] = {first_role if index == 0 else other_role}
+
+    plan = {"operations": [], "role_types": role_types, "added": [], "removed": [], "moved": [], "unchanged": []}
+    for user_id, member in members.items():
+        have = held.get(user_id, set())
+        want = wanted.get(user_id, set())
+        if have == want:
+            plan["unchanged"].append(user_id)
+            continue
+        add_roles = [role for role in (first_role, other_role) if role in want and role not in have]
+        remove_roles = [role for role in (first_role, other_role) if role in have and role not in want]
+        plan["operations"].append((member, add_roles, remove_roles))
+        if not have:
+            plan["added"].append(user_id)
+        elif not want:
+            plan["removed"].append(user_id)
+        else:
+            plan["moved"].append(user_id)
+    return plan
+
+
+def describe_plan(plan):
+    """역할 변경 계획을 사람이 읽을 수 있는 줄 목록으로 반환합니다 (미리보기용)"""
+    lines = [f"변경 {len(plan['operations'])}건 (추가 {len(plan['added'])}, 제거 {len(plan['removed'])}, "
+             f"등급 이동 {len(plan['moved'])}), 유지 {len(plan['unchanged'])}명"]
+    for member, add_roles, remove_roles in plan["operations"]:
+        changes = [f"+{role.name}" for role in add_roles] + [f"-{role.name}" for role in remove_roles]
+        lines.append(f"- {member.display_name}: {' '.join(changes)}")
+    return lines
@@ -0,0 +1,282 @@
+import asyncio
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+from bisect import bisect_left
+
+from compact_counter import CompactCounter, make_chat_counter, COMPACT_COUNTER_THRESHOLD
+
+# 메모리 상태 스냅샷 설정 (환경 변수로 조정 가능)
+STATE_SNAPSHOT_PATH = os.getenv("STATE_SNAPSHOT_PATH", "state_snapshot.bin")
+STATE_SNAPSHOT_INTERVAL = float(os.getenv("STATE_SNAPSHOT_INTERVAL", "300"))  # 초 (0이면 사용 안 함)
+STATE_SNAPSHOT_DELTA_SLACK = float(os.getenv("STATE_SNAPSHOT_DELTA_SLACK", "300"))  # 초, 스냅샷 시각보다 이만큼 앞부터 변경분 조회 (시계 차이 대비)
+
+# 파일 구조 (리틀 엔디언)
+#   헤더: 매직, 형식 버전, 예약, 시퀀스, 저장 시각(UNIX 초), 서버 수
+#   서버마다: 서버 헤더 + 제외 역할 ID(int64 배열) + 사용자 ID(int64, 오름차순) + 채팅 수(int32)
+#             + 연속 기록 사용자 ID(int64) + 역할 종류(int8) + 연속 횟수(int32)
+#   끝: 앞의 모든 바이트의 CRC32
+# 배열은 그대로 이어 붙여 저장하므로 mmap으로 연 파일에서 복사 한 번으로 배열을 만들 수 있음
+SNAPSHOT_MAGIC = b"MZSS"
+SNAPSHOT_VERSION = 1
+_HEADER = struct.Struct("<4sHHQdI")
+_GUILD = struct.Struct("<qqqIII")  # guild_id, 1등 역할, 2-6등 역할 (없으면 0), 제외 역할 수, 사용자 수, 연속 기록 수
+_TRAILER = struct.Struct("<I")
+_STREAK_TYPES = {None: 0, "first": 1, "other": 2}
+_STREAK_NAMES = {value: key for key, value in _STREAK_TYPES.items()}
+
+
+def _le_bytes(values):
+    """배열을 리틀 엔디언 바이트로 반환합니다"""
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _read_array(typecode, buffer, offset, length):
+    """버퍼의 offset부터 length개의 값을 배열로 읽습니다. (배열, 다음 offset) 반환"""
+    values = array(typecode)
+    end = offset + values.itemsize * length
+    values.frombytes(buffer[offset:end])
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values, end
+
+
+def _capture_counter(counter):
+    """채팅 카운터를 복사합니다 (CompactCounter는 정렬된 배열 복사본, 나머지는 (ID, 채팅 수) 목록)"""
+    if isinstance(counter, CompactCounter):
+        return counter.sorted_arrays()
+    return list(counter.items())
+
+
+def _sorted_counter_arrays(captured):
+    """복사한 채팅 카운터를 사용자 ID 오름차순의 (ID 배열, 채팅 수 배열)로 반환합니다"""
+    if isinstance(captured, tuple):
+        return captured
+    items = sorted(captured)
+    return array("q", [user_id for user_id, _ in items]), array("i", [count for _, count in items])
+
+
+def capture_state(chat_counts, roles, excluded_roles, streaks, skip_guild_ids=()):
+    """스냅샷에 넣을 메모리 상태를 복사합니다 (이벤트 루프에서 호출, 정렬과 인코딩은 encode_captured가 스레드에서)
+
+    skip_guild_ids: 넣지 않을 서버 (DB에서 불러오지 못해 빈 상태로 올라온 서버 등)
+    [(guild_id, 카운터 복사본, 역할, 제외 역할, 연속 기록)] 반환
+    """
+    return [
+        (guild_id, _capture_counter(counter), dict(roles.get(guild_id) or {}), list(excluded_roles.get(guild_id, [])),
+         {user_id: dict(streak) for user_id, streak in streaks.get(guild_id, {}).items()})
+        for guild_id, counter in chat_counts.items()
+        if guild_id not in skip_guild_ids
+    ]
+
+
+def _index_of(ids, user_id):
+    i = bisect_left(ids, user_id)
+    return i if i < len(ids) and ids[i] == user_id else -1
+
+
+def encode_snapshot(sequence, taken_at, chat_counts, roles, excluded_roles, streaks, pending=None, skip_guild_ids=()):
+    """메모리 상태를 스냅샷 바이트로 만듭니다
+
+    pending: 아직 DB에 저장되지 않은 {(guild_id, user_id): 증가량}, 스냅샷에서는 빼서 DB와 같은 값으로 저장
+    """
+    return encode_captured(sequence, taken_at, capture_state(chat_counts, roles, excluded_roles, streaks, skip_guild_ids), pending)
+
+
+def encode_captured(sequence, taken_at, captured, pending=None):
+    """capture_state로 복사한 상태를 스냅샷 바이트로 만듭니다 (메모리 상태를 건드리지 않으므로 스레드에서 실행 가능)"""
+    pending_by_guild = {}
+    for (guild_id, user_id), amount in (pending or {}).items():
+        pending_by_guild.setdefault(guild_id, {})[user_id] = amount
+
+    parts = [_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, sequence, taken_at, len(captured))]
+    for guild_id, counter, role_data, excluded, guild_streaks in captured:
+        ids, counts = _sorted_counter_arrays(counter)
+        for user_id, amount in pending_by_guild.get(guild_id, {}).items():
+            i = _index_of(ids, user_id)
+            if i >= 0:
+                counts[i] -= amount
+
+        excluded = array("q", excluded)
+        streak_ids = array("q", guild_streaks)
+        streak_types = array("b", [_STREAK_TYPES.get(guild_streaks[user_id].get("type"), 0) for user_id in streak_ids])
+        streak_counts = array("i", [guild_streaks[user_id].get("count", 0) for user_id in streak_ids])
+
+        parts.append(_GUILD.pack(guild_id, role_data.get("first") or 0, role_data.get("other") or 0,
+                                 len(excluded), len(ids), len(streak_ids)))
+        parts += [_le_bytes(excluded), _le_bytes(ids), _le_bytes(counts),
+                  _le_bytes(streak_ids), _le_bytes(streak_types), _le_bytes(streak_counts)]
+
+    body = b"".join(parts)
+    return body + _TRAILER.pack(zlib.crc32(body))
+
+
+def decode_snapshot(buffer):
+    """스냅샷 바이트(또는 mmap)를 읽습니다. 형식이 맞지 않거나 손상되었으면 ValueError"""
+    if len(buffer) < _HEADER.size + _TRAILER.size:
+        raise ValueError("파일이 너무 짧음")
+
+    body_end = len(buffer) - _TRAILER.size
+    (crc,) = _TRAILER.unpack_from(buffer, body_end)
+    if zlib.crc32(buffer[:body_end]) != crc:
+        raise ValueError("CRC 불일치 (저장 중 중단되었거나 손상됨)")
+
+    magic, version, _, sequence, taken_at, guild_count = _HEADER.unpack_from(buffer, 0)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError("스냅샷 파일이 아님")
+    if version != SNAPSHOT_VERSION:
+        raise ValueError(f"지원하지 않는 형식 버전 {version}")
+
+    guilds = {}
+    offset = _HEADER.size
+    for _ in range(guild_count):
+        guild_id, first_role, other_role, excluded_count, user_count, streak_count = _GUILD.unpack_from(buffer, offset)
+        offset += _GUILD.size
+        excluded, offset = _read_array("q", buffer, offset, excluded_count)
+        ids, offset = _read_array("q", buffer, offset, user_count)
+        counts, offset = _read_array("i", buffer, offset, user_count)
+        streak_ids, offset = _read_array("q", buffer, offset, streak_count)
+        streak_types, offset = _read_array("b", buffer, offset, streak_count)
+        streak_counts, offset = _read_array("i", buffer, offset, streak_count)
+
+        guilds[guild_id] = {
+            "roles": {"first": first_role, "other": other_role} if first_role and other_role else None,
+            "excluded_roles": list(excluded),
+            "ids": ids,
+            "counts": counts,
+            "streaks": {user_id: {"type": _STREAK_NAMES.get(kind), "count": count}
+                        for user_id, kind, count in zip(streak_ids, streak_types, streak_counts)},
+        }
+
+    if offset != body_end:
+        raise ValueError("서버 데이터 길이가 헤더와 맞지 않음")
+    return {"version": version, "sequence": sequence, "taken_at": taken_at, "guilds": guilds}
+
+
+def counter_from_arrays(ids, counts):
+    """스냅샷의 (ID 배열, 채팅 수 배열)로 서버 규모에 맞는 채팅 카운터를 만듭니다"""
+    if COMPACT_COUNTER_THRESHOLD and len(ids) >= COMPACT_COUNTER_THRESHOLD:
+        # 정렬된 배열을 그대로 사용 (사용자별 파이썬 객체를 만들지 않음)
+        return CompactCounter.from_sorted_arrays(ids, counts)
+    return make_chat_counter(dict(zip(ids, counts)))
+
+
+class StateSnapshotter:
+    """메모리 상태(채팅 카운트, 역할, 제외 역할, 연속 기록)를 주기적으로 로컬 파일에 저장하고 시작 시 읽습니다"""
+
+    def __init__(self, chat_counts, roles, excluded_roles, streaks, flush_pending, pending_counts,
+                 skip_guild_ids=None, path=STATE_SNAPSHOT_PATH, interval=STATE_SNAPSHOT_INTERVAL):
+        self.chat_counts = chat_counts
+        self.roles = roles
+        self.excluded_roles = excluded_roles
+        self.streaks = streaks
+        self.flush_pending = flush_pending  # 스냅샷 전에 채팅 카운트 증가분을 DB에 쓰는 코루틴 함수
+        self.pending_counts = pending_counts  # 아직 저장되지 않은 증가분 {(guild_id, user_id): 증가량}을 반환
+        self.skip_guild_ids = skip_guild_ids  # 스냅샷에 넣지 않을 서버 ID 집합을 반환 (DB에서 불러오지 못한 서버)
+        self.path = path
+        self.interval = interval
+        self.sequence = 0
+        self._lock = asyncio.Lock()
+        self._task = None
+
+        # 통계
+        self.saves = 0
+        self.failed_saves = 0
+        self.last_save_ms = 0
+        self.last_size = 0
+
+    def stats(self):
+        return {
+            "sequence": self.sequence,
+            "saves": self.saves,
+            "failed_saves": self.failed_saves,
+            "last_save_ms": self.last_save_ms,
+            "last_size_kb": round(self.last_size / 1024, 1),
+        }
+
+    def start(self):
+        """주기적인 저장 루프를 시작합니다 (on_ready가 여러 번 호출되어도 한 번만 실행)"""
+        if not self.interval:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            print(f"[스냅샷] 저장 루프 시작: {self.interval:.0f}초 간격, {self.path}")
+
+    async def close(self):
+        """루프를 멈추고 마지막 스냅샷을 저장합니다 (봇 종료 시 호출)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.interval:
+            await self.save()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.save()
+
+    def load(self):
+        """스냅샷 파일을 mmap으로 읽습니다. 없거나 읽을 수 없으면 None (스냅샷을 쓰지 않도록 설정했으면 항상 None)"""
+        if not self.interval:
+            return None
+        try:
+            with open(self.path, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return None
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                    snapshot = decode_snapshot(buffer)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, struct.error) as e:
+            print(f"⚠️ [스냅샷] {self.path}을(를) 읽을 수 없어 사용하지 않습니다: {e}")
+            return None
+
+        self.sequence = max(self.sequence, snapshot["sequence"])
+        return snapshot
+
+    async def save(self):
+        """증가분을 저장한 뒤 현재 메모리 상태를 파일에 원자적으로 씁니다"""
+        async with self._lock:
+            started = time.perf_counter()
+            # 스냅샷 시각은 플러시 전 시각으로 기록 (이후 변경분은 시작 시 updated_at으로 다시 조회)
+            taken_at = time.time()
+            try:
+                await self.flush_pending()
+                # 상태 복사만 이벤트 루프에서 하고, 정렬과 인코딩은 스레드에서 실행
+                skip = self.skip_guild_ids() if self.skip_guild_ids else ()
+                captured = capture_state(self.chat_counts, self.roles, self.excluded_roles, self.streaks, skip)
+                pending = self.pending_counts()
+                data = await asyncio.to_thread(encode_captured, self.sequence + 1, taken_at, captured, pending)
+                await asyncio.to_thread(self._write, data)
+            except Exception as e:
+                self.failed_saves += 1
+                print(f"⚠️ [스냅샷] 저장 실패: {e}")
+                return False
+
+            self.sequence += 1
+            self.saves += 1
+            self.last_size = len(data)
+            self.last_save_ms = round((time.perf_counter() - started) * 1000, 1)
+            if self.saves % 12 == 1 or self.last_save_ms > 1000:
+                print(f"[스냅샷] 저장 완료: {self.stats()}")
+            return True
+
+    def _write(self, data):
+        # 임시 파일에 쓴 뒤 교체하여 저장 중 종료되어도 이전 스냅샷이 남도록 함
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
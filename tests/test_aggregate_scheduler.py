@@ -0,0 +1,63 @@
+import asyncio
+import datetime
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+import aggregate_scheduler
+from aggregate_scheduler import AggregateScheduler
+
+
+class FakeBot:
+    def __init__(self, guild_ids):
+        self.guilds = {guild_id: SimpleNamespace(id=guild_id, get_channel=lambda channel_id: None) for guild_id in guild_ids}
+
+    def get_guild(self, guild_id):
+        return self.guilds.get(guild_id)
+
+
+class EvictedGuildScheduleTest(unittest.IsolatedAsyncioTestCase):
+    """캐시에서 내려간(역할 설정이 메모리에 없는) 서버의 예약 집계"""
+
+    async def test_scheduled_run_loads_evicted_guild_state(self):
+        guild_id = 1234
+        server_roles = {}  # 캐시에서 내려가 비어 있음
+        loaded = []
+        results = []
+
+        async def ensure_state(guild_id):
+            loaded.append(guild_id)
+            server_roles[guild_id] = {"first": 1, "other": 2}
+
+        async def run_job(guild, start_date, end_date, **kwargs):
+            # run_period_aggregation과 같이 역할 설정이 메모리에 없으면 no_roles
+            if guild.id not in server_roles:
+                result = {"status": "no_roles", "message": "no roles", "timings": {}, "resumable": False}
+            else:
+                result = {"status": "ok", "image": None, "timings": {}, "resumable": False}
+            results.append(result["status"])
+            return result
+
+        schedule = {
+            "weekday": 0, "hour": 0, "minute": 5, "period_days": 7, "channel_id": None,
+            "next_run_at": datetime.datetime.utcnow() - datetime.timedelta(minutes=1),
+        }
+        scheduler = AggregateScheduler(FakeBot([guild_id]), jobs=None, jitter=0)
+        scheduler.run_job = run_job
+        scheduler.ensure_state = ensure_state
+
+        adb = aggregate_scheduler.adb
+        with mock.patch.object(adb, "get_due_aggregate_schedules", mock.AsyncMock(return_value=[(guild_id, schedule)])), \
+                mock.patch.object(adb, "claim_aggregate_schedule", mock.AsyncMock(return_value=True)), \
+                mock.patch.object(adb, "save_aggregate_history", mock.AsyncMock()) as save_history:
+            self.assertEqual(await scheduler.check_due(), 1)
+            await asyncio.gather(*scheduler._running.values())
+
+        self.assertEqual(loaded, [guild_id])
+        self.assertEqual(results, ["ok"])
+        save_history.assert_not_awaited()
+        self.assertEqual(scheduler.stats()["failed"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
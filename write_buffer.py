@@ -0,0 +1,497 @@
+import asyncio
+import os
+import time
+from collections import Counter
+
+import async_database as adb
+import database as db
+
+# 쓰기 지연 버퍼 설정 (환경 변수로 조정 가능)
+CHAT_COUNT_FLUSH_INTERVAL = float(os.getenv("CHAT_COUNT_FLUSH_INTERVAL", "5"))  # 초
+CHAT_COUNT_FLUSH_THRESHOLD = int(os.getenv("CHAT_COUNT_FLUSH_THRESHOLD", "500"))  # 대기 중인 (서버, 사용자) 수
+CHAT_COUNT_MAX_PENDING = int(os.getenv("CHAT_COUNT_MAX_PENDING", "200000"))  # DB 연결이 끊긴 동안 보관할 최대 (서버, 사용자) 수
+CHAT_COUNT_SHUTDOWN_RETRIES = 3
+
+
+class ChatCountBuffer:
+    """채팅 카운트 증가분을 (guild_id, user_id)별로 모아 주기적으로 한 번에 저장합니다"""
+
+    def __init__(self, chat_counts=None, flush_interval=CHAT_COUNT_FLUSH_INTERVAL,
+                 flush_threshold=CHAT_COUNT_FLUSH_THRESHOLD, max_pending=CHAT_COUNT_MAX_PENDING,
+                 wal_writer_id=None):
+        self.chat_counts = chat_counts  # {guild_id: 채팅 카운터}, 저장 후 DB 값으로 맞출 메모리 카운터
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.max_pending = max_pending
+        self.wal_writer_id = wal_writer_id  # 수집 로그를 쓰면 저장할 때 반영한 LSN을 함께 남김
+        self._pending = Counter()
+        self._unconfirmed = Counter()  # 메모리 카운터에는 올렸지만 메시지 저장을 기다리는 증가분
+        self._last_lsn = None  # 버퍼에 들어온 마지막 수집 로그 LSN
+        self.acked_lsn = 0  # 이 LSN까지의 증가분은 DB에 반영됨
+        self._flush_lock = asyncio.Lock()
+        self._discarded_during_flush = set()  # 플러시 중에 증가분을 버린 서버 (실패한 배치를 되돌리지 않음)
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+        # 통계
+        self.flush_count = 0
+        self.failed_flush_count = 0
+        self.flushed_increments = 0
+        self.reconciled = 0  # DB 값과 달라 메모리 카운터를 고친 횟수
+        self.deferred_flush_count = 0  # DB 연결이 끊겨 미룬 플러시 횟수
+        self.dropped = 0  # 버퍼가 가득 차 버려진 증가분 수
+        self.rejected = 0  # 메시지가 이미 저장되어 있었거나 버려져 되돌린 증가분 수
+        self.last_flush_at = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def has_room(self, guild_id, user_id):
+        """증가분을 더 받을 수 있는지 반환합니다"""
+        return (guild_id, user_id) in self._pending or len(self._pending) < self.max_pending
+
+    def add(self, guild_id, user_id, amount=1, lsn=None):
+        """증가분을 버퍼에 합칩니다 (DB 호출 없음). 버퍼가 가득 차 받지 못했으면 False"""
+        if not self.has_room(guild_id, user_id):
+            # DB 연결이 오래 끊겨 버퍼가 가득 찬 경우에만 해당 (같은 사용자의 증가분은 계속 합침)
+            self.dropped += amount
+            if self.dropped % 1000 == 1:
+                print(f"⚠️ [채팅 버퍼] 버퍼가 가득 차 증가분을 버리는 중: 대기 {len(self._pending)}개, 버림 {self.dropped}회분")
+            return False
+        self._pending[(guild_id, user_id)] += amount
+        if lsn is not None:
+            self._last_lsn = lsn
+
+        # 임계치를 넘으면 타이머를 기다리지 않고 바로 플러시
+        if len(self._pending) >= self.flush_threshold:
+            self._wakeup.set()
+        return True
+
+    def expect(self, guild_id, user_id):
+        """메모리 카운터에 먼저 올린 증가분을 메시지 저장 확인 대기로 기록합니다"""
+        self._unconfirmed[(guild_id, user_id)] += 1
+
+    def _settle(self, key):
+        if self._unconfirmed.get(key, 0) <= 0:
+            return False
+        self._unconfirmed[key] -= 1
+        if not self._unconfirmed[key]:
+            del self._unconfirmed[key]
+        return True
+
+    def confirm(self, guild_id, user_id, lsn=None):
+        """메시지가 새로 저장된 증가분을 버퍼에 넣습니다. 받지 못했으면 False
+
+        확인 대기 중인 증가분이 없으면(채팅 카운트 초기화로 버려짐) 더하지 않음
+        """
+        if not self._settle((guild_id, user_id)):
+            return False
+        return self.add(guild_id, user_id, lsn=lsn)
+
+    def reject(self, guild_id, user_id, expected=True):
+        """메시지가 이미 저장되어 있었거나 버려진 증가분을 메모리 카운터에서 되돌립니다
+
+        expected: expect로 기록한 증가분인지 여부 (큐에 넣기 전에 버려졌으면 False)
+        """
+        if expected and not self._settle((guild_id, user_id)):
+            return
+        self.rejected += 1
+        counter = self.chat_counts.get(guild_id) if self.chat_counts is not None else None
+        if counter is not None and counter.get(user_id, 0) > 0:
+            counter[user_id] -= 1
+
+    def applied_lsn(self):
+        """DB에 반영된 마지막 수집 로그 LSN을 반환합니다. 대기 중인 증가분이 없으면 None (모두 반영됨)"""
+        if self._pending or self._flush_lock.locked():
+            return self.acked_lsn
+        return None
+
+    def pending_guild_ids(self):
+        """아직 저장되지 않은 증가분(메시지 저장 확인 대기 포함)이 있는 서버 ID 집합을 반환합니다"""
+        return {guild_id for guild_id, _ in self._pending} | {guild_id for guild_id, _ in self._unconfirmed}
+
+    def pending_counts(self):
+        """아직 저장되지 않은 증가분(메시지 저장 확인 대기 포함) {(guild_id, user_id): 증가량}을 반환합니다"""
+        return dict(self._pending + self._unconfirmed)
+
+    def discard_guild(self, guild_id):
+        """특정 서버의 대기 중인 증가분을 버립니다 (채팅 카운트 초기화 시 사용)"""
+        for key in [key for key in self._pending if key[0] == guild_id]:
+            del self._pending[key]
+        for key in [key for key in self._unconfirmed if key[0] == guild_id]:
+            del self._unconfirmed[key]
+        if self._flush_lock.locked():
+            self._discarded_during_flush.add(guild_id)
+
+    async def reset_guild(self, guild_id, reset):
+        """진행 중인 플러시가 끝난 뒤 플러시 잠금 안에서 서버의 증가분을 버리고 reset을 실행합니다
+
+        reset: 메모리 카운터와 DB의 채팅 카운트를 지우는 코루틴 함수
+        (저장 중인 $inc가 DB 삭제 뒤에 반영되거나, 실패한 배치가 초기화 뒤에 버퍼로 돌아오지 않도록 함)
+        """
+        async with self._flush_lock:
+            self.discard_guild(guild_id)
+            await reset()
+
+    async def reload_guild(self, guild_id, load):
+        """플러시 잠금 안에서 load를 실행하고 (load 결과, 서버의 아직 저장되지 않은 증가분 {user_id: 증가량})을 반환합니다
+
+        load: 서버의 채팅 카운트를 DB에서 읽는 코루틴 함수
+        (읽는 동안 플러시가 없으므로 DB 값에 저장되지 않은 증가분을 더하면 메모리 카운터 값이 됨)
+        """
+        async with self._flush_lock:
+            result = await load()
+            pending = Counter()
+            for (pending_guild_id, user_id), amount in (self._pending + self._unconfirmed).items():
+                if pending_guild_id == guild_id:
+                    pending[user_id] += amount
+            return result, pending
+
+    def start(self):
+        """백그라운드 플러시 루프를 시작합니다 (on_ready가 여러 번 호출되어도 한 번만 실행)"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            print(f"[채팅 버퍼] 플러시 루프 시작: {self.flush_interval}초 간격, 임계치 {self.flush_threshold}개")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        """대기 중인 증가분을 하나의 bulk_write로 저장합니다. 실패하면 버퍼에 되돌립니다"""
+        async with self._flush_lock:
+            if not self._pending:
+                return True
+            if not db.is_mongo_connected():
+                # 연결이 끊긴 동안은 버퍼에 그대로 두고 복구 후 저장
+                self.deferred_flush_count += 1
+                return False
+
+            batch = self._pending
+            self._pending = Counter()
+            self._discarded_during_flush.clear()
+            # 이 LSN 이전에 들어온 증가분은 모두 이번 배치나 이전 배치에 포함됨
+            batch_lsn = self._last_lsn
+            wal_mark = (self.wal_writer_id, batch_lsn) if self.wal_writer_id and batch_lsn else None
+
+            started = time.perf_counter()
+            try:
+                stored_counts = await adb.increment_chat_counts(batch, wal_mark)
+            except Exception as e:
+                # 실패한 증가분은 버퍼에 다시 합쳐 다음 플러시에서 재시도 (그 사이 초기화된 서버는 버림)
+                discarded = self._discarded_during_flush
+                self._pending.update({key: amount for key, amount in batch.items() if key[0] not in discarded})
+                self.failed_flush_count += 1
+                print(f"⚠️ [채팅 버퍼] 플러시 실패 ({len(batch)}개 항목 재시도 대기): {e}")
+                return False
+
+            self.flush_count += 1
+            self.flushed_increments += sum(batch.values())
+            self.last_flush_at = time.time()
+            if batch_lsn is not None:
+                self.acked_lsn = batch_lsn
+            self._reconcile(stored_counts)
+
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if self.flush_count % 100 == 0 or elapsed_ms > 1000:
+                print(f"[채팅 버퍼] 플러시 완료: {len(batch)}개 항목, {elapsed_ms:.1f}ms (누적 {self.flush_count}회)")
+            return True
+
+    def _reconcile(self, stored_counts):
+        """DB에 $inc로 반영된 최신 값으로 메모리 카운터를 맞춥니다
+
+        다른 프로세스가 같은 사용자를 올렸거나 메모리 값이 오래된 경우 DB 값을 기준으로 하고,
+        이번 플러시 이후 새로 쌓인 증가분(_pending)과 메시지 저장을 기다리는 증가분(_unconfirmed)은 그 위에 더함
+        """
+        if self.chat_counts is None or not stored_counts:
+            return
+
+        corrected = 0
+        for (guild_id, user_id), stored in stored_counts.items():
+            counter = self.chat_counts.get(guild_id)
+            # 내려갔거나 초기화된 서버/사용자는 다시 만들지 않음
+            if counter is None or user_id not in counter:
+                continue
+            key = (guild_id, user_id)
+            value = stored + self._pending.get(key, 0) + self._unconfirmed.get(key, 0)
+            if counter[user_id] != value:
+                counter[user_id] = value
+                corrected += 1
+
+        if corrected:
+            self.reconciled += corrected
+            print(f"[채팅 버퍼] DB 값과 다른 채팅 카운트 {corrected}개를 맞춤 (누적 {self.reconciled}개)")
+
+    async def close(self):
+        """루프를 멈추고 남은 증가분을 저장합니다 (봇 종료 시 호출)"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        for attempt in range(1, CHAT_COUNT_SHUTDOWN_RETRIES + 1):
+            if await self.flush():
+                return True
+            await asyncio.sleep(attempt)
+
+        print(f"❌ [채팅 버퍼] 종료 시 저장 실패: {sum(self._pending.values())}회분의 채팅 카운트가 저장되지 못했습니다")
+        return False
+
+
+# 메시지 수집 큐 설정 (환경 변수로 조정 가능)
+MESSAGE_INGEST_BATCH_SIZE = int(os.getenv("MESSAGE_INGEST_BATCH_SIZE", "200"))
+MESSAGE_INGEST_LINGER = float(os.getenv("MESSAGE_INGEST_LINGER", "1"))  # 초, 배치를 채우기 위해 기다리는 시간
+MESSAGE_INGEST_QUEUE_SIZE = int(os.getenv("MESSAGE_INGEST_QUEUE_SIZE", "10000"))
+MESSAGE_INGEST_PUT_TIMEOUT = float(os.getenv("MESSAGE_INGEST_PUT_TIMEOUT", "0.5"))  # 초, 큐가 가득 찼을 때 기다리는 시간
+MESSAGE_INGEST_RETRY_DELAY = 5  # 초
+MESSAGE_INGEST_DRAIN_TIMEOUT = 30  # 초
+
+
+class MessageIngestQueue:
+    """메시지 문서를 크기 제한이 있는 큐에 모아 message_id 기준 업서트로 일괄 저장합니다
+
+    새로 저장된 메시지만 채팅 카운트 버퍼와 시간별 집계에 더하므로 같은 메시지가 여러 번 들어와도 한 번만 셈
+    """
+
+    def __init__(self, chat_count_buffer=None, batch_size=MESSAGE_INGEST_BATCH_SIZE, linger=MESSAGE_INGEST_LINGER,
+                 capacity=MESSAGE_INGEST_QUEUE_SIZE, put_timeout=MESSAGE_INGEST_PUT_TIMEOUT,
+                 wal_writer_id=None):
+        self.chat_count_buffer = chat_count_buffer  # 새로 저장된 메시지의 채팅 카운트 증가분을 넣을 버퍼
+        self.batch_size = batch_size
+        self.linger = linger
+        self.put_timeout = put_timeout
+        self.wal_writer_id = wal_writer_id  # 수집 로그를 쓰면 시간별 집계에 반영한 LSN을 함께 남김
+        self._queue = asyncio.Queue(maxsize=capacity)  # (수집 로그 LSN, 메시지 문서)
+        self._retry_batch = []
+        self._inflight = []  # 큐에서 꺼내 저장 중인 배치 (종료 시 저장이 끊기면 다시 저장)
+        self._written_lsn = None  # 저장한 마지막 메시지의 LSN (시간별 집계는 아직일 수 있음)
+        self.acked_lsn = 0  # 이 LSN까지의 메시지와 시간별 집계는 DB에 반영됨
+        self._pending_rollups = Counter()  # 저장하지 못한 시간별 집계 증가분 {(guild_id, user_id, hour): 증가량}
+        self._task = None
+        self._idle = False
+        self._closing = False
+
+        # 통계
+        self.enqueued = 0
+        self.dropped = 0  # 큐가 가득 차서 버려진 메시지 수
+        self.backpressure_waits = 0  # 큐가 가득 차서 기다린 횟수
+        self.inserted = 0
+        self.duplicates = 0  # 이미 저장되어 있어 세지 않은 메시지 수
+        self.batches = 0
+        self.failed_batches = 0
+        self.failed_rollups = 0
+        self.max_depth = 0
+
+    def stats(self):
+        """수집 큐 통계를 반환합니다"""
+        return {
+            "depth": self._queue.qsize(),
+            "capacity": self._queue.maxsize,
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "backpressure_waits": self.backpressure_waits,
+            "inserted": self.inserted,
+            "duplicates": self.duplicates,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "retry_pending": len(self._retry_batch),
+            "failed_rollups": self.failed_rollups,
+            "rollup_pending": len(self._pending_rollups),
+        }
+
+    def has_room(self):
+        """메시지를 기다리지 않고 바로 넣을 수 있는지 반환합니다"""
+        return not self._closing and not self._queue.full()
+
+    def applied_lsn(self):
+        """DB에 반영된 마지막 수집 로그 LSN을 반환합니다. 저장할 메시지가 없으면 None (모두 반영됨)"""
+        if self._queue.qsize() or self._retry_batch or self._inflight or self._pending_rollups:
+            return self.acked_lsn
+        return None
+
+    async def put_message(self, guild_id, user_id, message_id, timestamp, lsn=None):
+        """메시지 문서를 큐에 넣습니다. 큐가 가득 차면 잠시 기다린 후 버립니다 (DB 연결이 끊긴 동안은 기다리지 않음)
+
+        메모리 카운터는 이미 올린 상태로 호출하며, 버린 메시지는 메모리 카운터에서도 되돌림
+        """
+        if self._closing:
+            self._drop(guild_id, user_id)
+            return False
+
+        wal_mark = (self.wal_writer_id, lsn) if self.wal_writer_id and lsn is not None else None
+        item = (lsn, db.make_message_document(guild_id, user_id, message_id, timestamp, wal_mark))
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.backpressure_waits += 1
+            try:
+                # 연결이 끊겨 큐가 비워지지 않는 동안에는 메시지 처리가 밀리지 않도록 바로 버림
+                timeout = self.put_timeout if db.is_mongo_connected() else 0
+                await asyncio.wait_for(self._queue.put(item), timeout=timeout)
+            except asyncio.TimeoutError:
+                self._drop(guild_id, user_id)
+                if self.dropped % 100 == 1:
+                    print(f"⚠️ [메시지 큐] 큐가 가득 차 메시지를 버리는 중: {self.stats()}")
+                return False
+
+        if self.chat_count_buffer is not None:
+            self.chat_count_buffer.expect(guild_id, user_id)
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+        return True
+
+    def _drop(self, guild_id, user_id):
+        self.dropped += 1
+        if self.chat_count_buffer is not None:
+            self.chat_count_buffer.reject(guild_id, user_id, expected=False)
+
+    def start(self):
+        """배치 저장 루프를 시작합니다 (on_ready가 여러 번 호출되어도 한 번만 실행)"""
+        if self._task is None or self._task.done():
+            self._closing = False
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            print(f"[메시지 큐] 저장 루프 시작: 배치 {self.batch_size}개, 대기 {self.linger}초, 용량 {self._queue.maxsize}개")
+
+    def _take_batch(self, batch):
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            if self._retry_batch:
+                batch, self._retry_batch = self._retry_batch, []
+                self._inflight = batch
+            else:
+                if self._closing and self._queue.empty():
+                    return
+
+                self._idle = True
+                try:
+                    first = await self._queue.get()
+                finally:
+                    self._idle = False
+                self._inflight = [first]
+
+                # 배치가 찰 때까지 잠시 기다림 (종료 중에는 바로 저장)
+                if not self._closing and self._queue.qsize() < self.batch_size - 1:
+                    await asyncio.sleep(self.linger)
+                batch = self._take_batch(self._inflight)
+
+            written = await self._write(batch)
+            self._inflight = []
+            if not written:
+                self._retry_batch = batch
+                if self._closing:
+                    return
+                await asyncio.sleep(MESSAGE_INGEST_RETRY_DELAY)
+
+    async def _write(self, batch):
+        if not db.is_mongo_connected():
+            # 연결이 끊긴 동안은 저장하지 않고 재시도 대기
+            return False
+
+        try:
+            inserted = await adb.save_messages([document for _, document in batch])
+        except Exception as e:
+            # 업서트는 멱등하므로 일부만 저장된 배치를 그대로 다시 저장해도 됨
+            self.failed_batches += 1
+            print(f"⚠️ [메시지 큐] 배치 저장 실패 ({len(batch)}개, 재시도 대기): {e}")
+            return False
+        if inserted is None:
+            return False
+
+        self.batches += 1
+
+        # 새로 저장된 메시지만 채팅 카운트와 시간별 집계에 반영 (이미 있던 메시지는 메모리 카운터에서 되돌림)
+        for (lsn, document), is_new in zip(batch, inserted):
+            guild_id, user_id = document["guild_id"], document["user_id"]
+            if is_new:
+                self.inserted += 1
+                bucket = db.hour_bucket(document["timestamp"])
+                self._pending_rollups[(guild_id, user_id, bucket)] += 1
+                if self.chat_count_buffer is not None:
+                    self.chat_count_buffer.confirm(guild_id, user_id, lsn=lsn)
+            else:
+                self.duplicates += 1
+                if self.chat_count_buffer is not None:
+                    self.chat_count_buffer.reject(guild_id, user_id)
+            if lsn is not None:
+                self._written_lsn = lsn
+        # 채팅 카운트에 반영했으므로 이후 끊겨도 다시 저장하지 않음 (시간별 집계는 _pending_rollups에 남음)
+        self._inflight = []
+        await self._flush_rollups()
+
+        if self.batches % 100 == 0:
+            print(f"[메시지 큐] 통계: {self.stats()}")
+        return True
+
+    async def _flush_rollups(self):
+        """시간별 집계 증가분을 저장합니다. 실패하면 다음 배치와 함께 다시 시도합니다"""
+        if not self._pending_rollups:
+            return True
+        if not db.is_mongo_connected():
+            return False
+
+        rollups, self._pending_rollups = self._pending_rollups, Counter()
+        rollup_lsn = self._written_lsn
+        wal_mark = (self.wal_writer_id, rollup_lsn) if self.wal_writer_id and rollup_lsn else None
+        try:
+            await adb.increment_hourly_chat_counts(rollups, wal_mark)
+        except Exception as e:
+            # 메시지는 이미 저장되었으므로 배치는 다시 저장하지 않고 집계 증가분만 보관
+            self._pending_rollups.update(rollups)
+            self.failed_rollups += 1
+            print(f"⚠️ [메시지 큐] 시간별 집계 저장 실패 ({len(rollups)}개 항목 재시도 대기): {e}")
+            return False
+        if rollup_lsn is not None:
+            self.acked_lsn = rollup_lsn
+        return True
+
+    async def close(self):
+        """새 메시지를 받지 않고 큐에 남은 메시지를 모두 저장합니다 (봇 종료 시 호출)"""
+        self._closing = True
+
+        if self._task is not None:
+            if self._idle:
+                # 빈 큐를 기다리는 중이면 루프를 멈추고 아래에서 직접 비움
+                self._task.cancel()
+                try:
+                    await self._task
+                except asyncio.CancelledError:
+                    pass
+            else:
+                try:
+                    await asyncio.wait_for(self._task, timeout=MESSAGE_INGEST_DRAIN_TIMEOUT)
+                except asyncio.TimeoutError:
+                    # wait_for가 루프를 취소함. 저장 중이던 배치는 아래에서 한 번 더 저장 (업서트라 멱등)
+                    print(f"⚠️ [메시지 큐] 종료 대기 시간 초과: 저장 중이던 {len(self._inflight)}개, 큐에 {self._queue.qsize()}개 남음")
+            self._task = None
+
+        if self._inflight:
+            self._retry_batch, self._inflight = self._inflight + self._retry_batch, []
+        await self._run()
+
+        remaining = self._queue.qsize() + len(self._retry_batch)
+        if remaining:
+            # 수집 로그를 쓰면 반영되지 않은 기록은 다음 시작 시 재생됨
+            recovery = "다음 시작 시 수집 로그에서 재생" if self.wal_writer_id else "버려짐"
+            print(f"❌ [메시지 큐] 종료 시 {remaining}개 메시지를 저장하지 못했습니다 ({recovery})")
+            return False
+        if not await self._flush_rollups():
+            print(f"❌ [메시지 큐] 종료 시 시간별 집계 {len(self._pending_rollups)}개 항목을 저장하지 못했습니다")
+            return False
+        print(f"[메시지 큐] 종료 전 저장 완료: {self.stats()}")
+        return True